@@ -4,12 +4,16 @@ from dotenv import load_dotenv
 load_dotenv()
 
 from app.frontend.gradio_app import build_interface
+from app.services.runtime import shutdown  # noqa: E402 - after load_dotenv, like the settings it pulls in
 
 
 def main() -> None:
     iface = build_interface()
     # For HF Spaces, server_name defaults work; expose 7860
-    iface.launch(server_name="0.0.0.0", server_port=int(os.getenv("PORT", 7860)))
+    try:
+        iface.launch(server_name="0.0.0.0", server_port=int(os.getenv("PORT", 7860)))
+    finally:
+        shutdown()
 
 
 if __name__ == "__main__":
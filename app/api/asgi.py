@@ -0,0 +1,263 @@
+import asyncio
+import json
+import time
+from typing import Any, Awaitable, Callable, Dict, Tuple
+from urllib.parse import parse_qs
+
+import uvicorn
+from flask import Flask
+from uvicorn.middleware.wsgi import WSGIMiddleware
+
+from app.config import settings
+from app.metrics.metrics import REQUEST_SECONDS, REQUESTS, REQUESTS_IN_FLIGHT
+from app.metrics.tracing import REQUEST_ID_HEADER, trace_request, wants_profile
+from app.services.codegen import generate_code, generate_code_stream
+from app.services.diagram import generate_diagram
+from app.services.analysis import analyze_code
+from app.storage.db import fetch_history
+from app.storage.writer import submit_message
+from app.services.hf_clients import HFInferenceClient, aclose_http_client
+from app.services.jobs import submit_diagram_job
+from app.api.server import _sse, create_app, history_headers, history_query, metrics_response, run_generation
+
+
+Scope = Dict[str, Any]
+Receive = Callable[[], Awaitable[Dict[str, Any]]]
+Send = Callable[[Dict[str, Any]], Awaitable[None]]
+Handler = Callable[[Scope, Receive, Send], Awaitable[None]]
+
+
+async def _read_json(receive: Receive) -> Dict[str, Any]:
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body", False):
+            break
+    return json.loads(body or b"{}")
+
+
+def _headers(scope: Scope) -> Dict[str, str]:
+    return {k.decode("latin-1").lower(): v.decode("latin-1") for k, v in scope.get("headers", [])}
+
+
+def _query(scope: Scope) -> Dict[str, str]:
+    params = parse_qs(scope.get("query_string", b"").decode("latin-1"))
+    return {k: v[-1] for k, v in params.items()}
+
+
+async def _send_body(
+    send: Send, body: bytes, content_type: str, status: int = 200, headers: Dict[str, str] | None = None
+) -> None:
+    raw_headers = [(b"content-type", content_type.encode("latin-1")), (b"content-length", str(len(body)).encode())]
+    raw_headers += [(k.lower().encode("latin-1"), v.encode("latin-1")) for k, v in (headers or {}).items()]
+    await send({"type": "http.response.start", "status": status, "headers": raw_headers})
+    await send({"type": "http.response.body", "body": body})
+
+
+async def _send_json(
+    send: Send, payload: Any, status: int = 200, headers: Dict[str, str] | None = None
+) -> None:
+    await _send_body(send, json.dumps(payload).encode("utf-8"), "application/json", status, headers)
+
+
+async def _health(scope: Scope, receive: Receive, send: Send) -> None:
+    await _send_json(send, {"status": "ok"})
+
+
+async def _generate(scope: Scope, receive: Receive, send: Send) -> None:
+    data = await _read_json(receive)
+    user_prompt: str = data.get("prompt", "")
+    session_id: str = data.get("session_id", "default")
+
+    if data.get("async_diagram", settings.async_diagrams):
+        code = await generate_code(user_prompt)
+        analysis = analyze_code(code or "")
+        message_id = await asyncio.wrap_future(
+            await asyncio.to_thread(
+                submit_message,
+                session_id=session_id,
+                user_prompt=user_prompt,
+                generated_code=code,
+                diagram_base64=None,
+                analysis=analysis,
+            )
+        )
+        job_id = await asyncio.to_thread(submit_diagram_job, message_id, user_prompt, code)
+        await _send_json(
+            send,
+            {
+                "generated_code": code,
+                "diagram_base64": None,
+                "diagram_job_id": job_id,
+                "analysis": analysis,
+            },
+        )
+        return
+
+    code, diagram_b64, analysis = await run_generation(user_prompt)
+    # SQLite writes (or a full write-behind queue) block; keep them off the event loop, and wait
+    # for the write so a failed insert is an error rather than a 200 for a lost row
+    await asyncio.wrap_future(
+        await asyncio.to_thread(
+            submit_message,
+            session_id=session_id,
+            user_prompt=user_prompt,
+            generated_code=code,
+            diagram_base64=diagram_b64,
+            analysis=analysis,
+        )
+    )
+    await _send_json(
+        send,
+        {
+            "generated_code": code,
+            "diagram_base64": diagram_b64,
+            "analysis": analysis,
+        },
+    )
+
+
+async def _generate_stream(scope: Scope, receive: Receive, send: Send) -> None:
+    data = await _read_json(receive)
+    user_prompt: str = data.get("prompt", "")
+    session_id: str = data.get("session_id", "default")
+
+    await send(
+        {
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [
+                (b"content-type", b"text/event-stream"),
+                (b"cache-control", b"no-cache"),
+                (b"x-accel-buffering", b"no"),
+            ],
+        }
+    )
+
+    async def _emit(event: str, payload: Any) -> None:
+        chunk = _sse(event, payload).encode("utf-8")
+        await send({"type": "http.response.body", "body": chunk, "more_body": True})
+
+    try:
+        parts: list[str] = []
+        async for piece in generate_code_stream(user_prompt):
+            parts.append(piece)
+            await _emit("token", {"text": piece})
+        code = "".join(parts)
+        await _emit("code", {"generated_code": code})
+
+        analysis = analyze_code(code)
+        await _emit("analysis", analysis)
+
+        diagram_bytes = await generate_diagram(user_prompt, code)
+        diagram_b64 = HFInferenceClient.image_bytes_to_base64(diagram_bytes)
+        await _emit("diagram", {"diagram_base64": diagram_b64})
+
+        message_id = await asyncio.wrap_future(
+            await asyncio.to_thread(
+                submit_message,
+                session_id=session_id,
+                user_prompt=user_prompt,
+                generated_code=code,
+                diagram_base64=diagram_b64,
+                analysis=analysis,
+            )
+        )
+        await _emit("done", {"id": message_id})
+    except Exception as exc:
+        await _emit("error", {"error": str(exc)})
+    await send({"type": "http.response.body", "body": b""})
+
+
+async def _metrics(scope: Scope, receive: Receive, send: Send) -> None:
+    body, content_type = metrics_response(_query(scope))
+    await _send_body(send, body.encode("utf-8"), content_type)
+
+
+async def _history(scope: Scope, receive: Receive, send: Send) -> None:
+    try:
+        query = history_query(_query(scope))
+        items = await asyncio.to_thread(fetch_history, **query)
+    except ValueError as exc:
+        await _send_json(send, {"error": str(exc)}, status=400)
+        return
+    await _send_json(send, items, headers=history_headers(query, items))
+
+
+ROUTES: Dict[Tuple[str, str], Handler] = {
+    ("GET", "/api/health"): _health,
+    ("POST", "/api/generate"): _generate,
+    ("POST", "/api/generate/stream"): _generate_stream,
+    ("GET", "/api/history"): _history,
+    ("GET", "/metrics"): _metrics,
+}
+
+
+def create_asgi_app(flask_app: Flask | None = None) -> Handler:
+    """ASGI application serving the hot API routes natively on one event loop.
+
+    Routes without a native handler are delegated to the Flask app through a
+    WSGI bridge, so both servers expose the same API.
+    """
+    fallback = WSGIMiddleware(flask_app or create_app())
+
+    async def app(scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "lifespan":
+            while True:
+                message = await receive()
+                if message["type"] == "lifespan.startup":
+                    await send({"type": "lifespan.startup.complete"})
+                elif message["type"] == "lifespan.shutdown":
+                    await aclose_http_client()
+                    await send({"type": "lifespan.shutdown.complete"})
+                    return
+
+        handler = ROUTES.get((scope["method"], scope["path"]))
+        if handler is None:
+            # the Flask app records its own request metrics
+            await fallback(scope, receive, send)
+            return
+
+        route, status, started = scope["path"], 500, time.perf_counter()
+        headers = _headers(scope)
+        trace_scope = trace_request(
+            f"{scope['method']} {route}",
+            request_id=headers.get(REQUEST_ID_HEADER.lower()),
+            profile=wants_profile(headers, _query(scope)),
+            entrypoint="asgi",
+        )
+
+        async def _send(message: Dict[str, Any]) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                REQUEST_SECONDS.observe(time.perf_counter() - started, entrypoint="asgi", route=route)
+                if trace is not None:
+                    message = {
+                        **message,
+                        "headers": [*message.get("headers", []), (b"x-request-id", trace.request_id.encode())],
+                    }
+            await send(message)
+
+        REQUESTS_IN_FLIGHT.inc(entrypoint="asgi")
+        with trace_scope as trace:
+            try:
+                await handler(scope, receive, _send)
+            except json.JSONDecodeError:
+                await _send_json(_send, {"error": "invalid JSON body"}, status=400)
+            except Exception as exc:
+                await _send_json(_send, {"error": str(exc)}, status=500)
+            finally:
+                REQUESTS_IN_FLIGHT.dec(entrypoint="asgi")
+                REQUESTS.inc(entrypoint="asgi", route=route, status=str(status))
+
+    return app
+
+
+def main() -> None:
+    uvicorn.run(create_asgi_app(), host=settings.api_host, port=settings.api_port)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,48 +1,166 @@
 import asyncio
 import json
-from typing import Any, Dict
+import time
+from typing import Any, Dict, Iterator, List, Mapping, Tuple
 
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify, stream_with_context
 
 from app.config import settings
-from app.services.codegen import generate_code
+from app.metrics.metrics import (
+    PROMETHEUS_CONTENT_TYPE,
+    REQUEST_SECONDS,
+    REQUESTS,
+    REQUESTS_IN_FLIGHT,
+    registry,
+)
+from app.metrics.tracing import REQUEST_ID_HEADER, trace_request, wants_profile
+from app.services.codegen import generate_code, generate_code_stream
 from app.services.diagram import generate_diagram
 from app.services.analysis import analyze_code
-from app.storage.db import save_message, fetch_history
+from app.storage.blobs import sniff_content_type
+from app.storage.db import fetch_history, get_diagram_job, load_diagram, search_messages
+from app.storage.writer import submit_message
 from app.services.hf_clients import HFInferenceClient
+from app.services.jobs import submit_diagram_job
+from app.services.runtime import iterate_sync, run_sync, shutdown
+
+
+def _sse(event: str, data: Any) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+MAX_HISTORY_LIMIT = 200
+
+
+def history_query(args: Mapping[str, str]) -> Dict[str, Any]:
+    """Translate /api/history query parameters into `fetch_history` arguments."""
+    query: Dict[str, Any] = {
+        "session_id": args.get("session_id", "default"),
+        # SQLite treats a negative LIMIT as no limit, so clamp from below too
+        "limit": min(max(int(args.get("limit", 50)), 1), MAX_HISTORY_LIMIT),
+    }
+    for cursor in ("before_id", "after_id"):
+        if args.get(cursor):
+            query[cursor] = int(args[cursor])
+    if args.get("fields"):
+        fields = [f.strip() for f in args["fields"].split(",") if f.strip()]
+        # ids are the paging cursors, so always return them
+        query["fields"] = fields if "id" in fields else ["id", *fields]
+    return query
+
+
+def history_headers(query: Dict[str, Any], items: List[Dict[str, Any]]) -> Dict[str, str]:
+    # a full page means there may be more: point at the next cursors
+    if not items or len(items) < query["limit"]:
+        return {}
+    return {"X-Next-Before-Id": str(items[0]["id"]), "X-Next-After-Id": str(items[-1]["id"])}
+
+
+async def run_generation(user_prompt: str) -> Tuple[str, str, Dict[str, Any]]:
+    code_task = asyncio.create_task(generate_code(user_prompt))
+    # diagram can use code later; await code first for better context
+    code = await code_task
+    diagram_bytes = await generate_diagram(user_prompt, code)
+    diagram_b64 = HFInferenceClient.image_bytes_to_base64(diagram_bytes)
+    analysis = analyze_code(code or "")
+    return code, diagram_b64, analysis
+
+
+def metrics_response(args: Mapping[str, str]) -> Tuple[str, str]:
+    """Body and content type for /metrics: Prometheus text, or JSON with quantiles for ?format=json."""
+    if args.get("format") == "json":
+        return json.dumps(registry.snapshot()), "application/json"
+    return registry.render(), PROMETHEUS_CONTENT_TYPE
+
+
+def _instrument(app: Flask) -> None:
+    def _record(status: int) -> None:
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        REQUEST_SECONDS.observe(time.perf_counter() - g.request_started, entrypoint="flask", route=route)
+        REQUESTS.inc(entrypoint="flask", route=route, status=str(status))
+        g.request_recorded = True
+
+    @app.before_request
+    def _start() -> None:
+        g.request_started = time.perf_counter()
+        REQUESTS_IN_FLIGHT.inc(entrypoint="flask")
+        # the trace stays open until teardown, i.e. after a streamed body is sent
+        g.trace_scope = trace_request(
+            f"{request.method} {request.path}",
+            request_id=request.headers.get(REQUEST_ID_HEADER),
+            profile=wants_profile(request.headers, request.args),
+            entrypoint="flask",
+        )
+        g.trace = g.trace_scope.__enter__()
+
+    @app.after_request
+    def _finish(response: Response) -> Response:
+        _record(response.status_code)
+        if g.get("trace") is not None:
+            response.headers[REQUEST_ID_HEADER] = g.trace.request_id
+        return response
+
+    @app.teardown_request
+    def _teardown(exc: BaseException | None) -> None:
+        if "request_started" not in g:
+            return
+        if not g.get("request_recorded"):
+            # unhandled exceptions skip after_request
+            _record(500)
+        REQUESTS_IN_FLIGHT.dec(entrypoint="flask")
+        g.trace_scope.__exit__(type(exc) if exc else None, exc, exc.__traceback__ if exc else None)
 
 
 def create_app() -> Flask:
     app = Flask(__name__)
+    _instrument(app)
 
     @app.route("/api/health", methods=["GET"])
     def health() -> Any:
         return jsonify({"status": "ok"})
 
+    @app.route("/metrics", methods=["GET"])
+    def metrics() -> Any:
+        body, content_type = metrics_response(request.args)
+        return Response(body, content_type=content_type)
+
     @app.route("/api/generate", methods=["POST"])
     def generate() -> Any:
         data: Dict[str, Any] = request.get_json(force=True)
         user_prompt: str = data.get("prompt", "")
         session_id: str = data.get("session_id", "default")
 
-        async def _run():
-            code_task = asyncio.create_task(generate_code(user_prompt))
-            # diagram can use code later; await code first for better context
-            code = await code_task
-            diagram_bytes = await generate_diagram(user_prompt, code)
-            diagram_b64 = HFInferenceClient.image_bytes_to_base64(diagram_bytes)
+        if data.get("async_diagram", settings.async_diagrams):
+            # return code and analysis now; the diagram is rendered by the worker pool
+            code = run_sync(generate_code(user_prompt))
             analysis = analyze_code(code or "")
-            return code, diagram_b64, analysis
+            message_id = submit_message(
+                session_id=session_id,
+                user_prompt=user_prompt,
+                generated_code=code,
+                diagram_base64=None,
+                analysis=analysis,
+            ).result()
+            job_id = submit_diagram_job(message_id, user_prompt, code)
+            return jsonify(
+                {
+                    "generated_code": code,
+                    "diagram_base64": None,
+                    "diagram_job_id": job_id,
+                    "analysis": analysis,
+                }
+            )
 
-        code, diagram_b64, analysis = asyncio.run(_run())
+        code, diagram_b64, analysis = run_sync(run_generation(user_prompt))
 
-        save_message(
+        # wait for the write, so a failed insert is an error rather than a 200 for a lost row
+        submit_message(
             session_id=session_id,
             user_prompt=user_prompt,
             generated_code=code,
             diagram_base64=diagram_b64,
             analysis=analysis,
-        )
+        ).result()
 
         return jsonify(
             {
@@ -52,23 +170,96 @@ def create_app() -> Flask:
             }
         )
 
+    @app.route("/api/generate/stream", methods=["POST"])
+    def generate_stream() -> Any:
+        data: Dict[str, Any] = request.get_json(force=True)
+        user_prompt: str = data.get("prompt", "")
+        session_id: str = data.get("session_id", "default")
+
+        def _events() -> Iterator[str]:
+            try:
+                parts: list[str] = []
+                for piece in iterate_sync(generate_code_stream(user_prompt)):
+                    parts.append(piece)
+                    yield _sse("token", {"text": piece})
+                code = "".join(parts)
+                yield _sse("code", {"generated_code": code})
+
+                analysis = analyze_code(code)
+                yield _sse("analysis", analysis)
+
+                diagram_bytes = run_sync(generate_diagram(user_prompt, code))
+                diagram_b64 = HFInferenceClient.image_bytes_to_base64(diagram_bytes)
+                yield _sse("diagram", {"diagram_base64": diagram_b64})
+
+                message_id = submit_message(
+                    session_id=session_id,
+                    user_prompt=user_prompt,
+                    generated_code=code,
+                    diagram_base64=diagram_b64,
+                    analysis=analysis,
+                ).result()
+                yield _sse("done", {"id": message_id})
+            except Exception as exc:
+                yield _sse("error", {"error": str(exc)})
+
+        return Response(
+            stream_with_context(_events()),
+            mimetype="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+
+    @app.route("/api/jobs/<int:job_id>", methods=["GET"])
+    def job_status(job_id: int) -> Any:
+        job = get_diagram_job(job_id)
+        if job is None:
+            return jsonify({"error": "job not found"}), 404
+        return jsonify(job)
+
+    @app.route("/api/diagrams/<digest>", methods=["GET"])
+    def diagram(digest: str) -> Any:
+        etag = f'"{digest}"'
+        headers = {"ETag": etag, "Cache-Control": "public, max-age=31536000, immutable"}
+        # blobs are content-addressed, so a matching ETag never goes stale
+        if etag in request.headers.get("If-None-Match", ""):
+            return Response(status=304, headers=headers)
+        data = load_diagram(digest)
+        if data is None:
+            return jsonify({"error": "diagram not found"}), 404
+        return Response(data, mimetype=sniff_content_type(data), headers=headers)
+
+    @app.route("/api/search", methods=["GET"])
+    def search() -> Any:
+        q = request.args.get("q", "").strip()
+        if not q:
+            return jsonify({"error": "missing query parameter q"}), 400
+        try:
+            limit = min(max(int(request.args.get("limit", 20)), 1), MAX_HISTORY_LIMIT)
+            offset = max(int(request.args.get("offset", 0)), 0)
+        except ValueError as exc:
+            return jsonify({"error": str(exc)}), 400
+        results = search_messages(q, session_id=request.args.get("session_id"), limit=limit, offset=offset)
+        return jsonify({"query": q, "limit": limit, "offset": offset, "results": results})
+
     @app.route("/api/history", methods=["GET"])
     def history() -> Any:
-        session_id: str = request.args.get("session_id", "default")
-        items = fetch_history(session_id=session_id)
-        return jsonify(items)
+        try:
+            query = history_query(request.args)
+            items = fetch_history(**query)
+        except ValueError as exc:
+            return jsonify({"error": str(exc)}), 400
+        return jsonify(items), 200, history_headers(query, items)
 
     return app
 
 
 def main() -> None:
     app = create_app()
-    app.run(host=settings.api_host, port=settings.api_port)
+    try:
+        app.run(host=settings.api_host, port=settings.api_port)
+    finally:
+        shutdown()
 
 
 if __name__ == "__main__":
     main()
-
-
-
-
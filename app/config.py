@@ -2,6 +2,13 @@ import os
 from dataclasses import dataclass
 
 
+def _env_bool(name: str, default: bool = False) -> bool:
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
 @dataclass
 class Settings:
     hf_token: str = os.getenv("HF_TOKEN", "")
@@ -12,12 +19,71 @@ class Settings:
         "DIFFUSION_MODEL_ID", "stabilityai/stable-diffusion-2-1"
     )
     database_path: str = os.getenv("DATABASE_PATH", os.path.join("data", "app.db"))
+    # SQLite tuning and batched (write-behind) message inserts
+    sqlite_wal: bool = _env_bool("SQLITE_WAL", True)
+    sqlite_busy_timeout_ms: int = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", 5000))
+    write_behind: bool = _env_bool("WRITE_BEHIND")
+    write_behind_max_pending: int = int(os.getenv("WRITE_BEHIND_MAX_PENDING", 1000))
+    write_behind_batch_size: int = int(os.getenv("WRITE_BEHIND_BATCH_SIZE", 100))
+    # diagram blob store; defaults to a `blobs` directory next to the database
+    blob_dir: str = os.getenv("BLOB_DIR", "")
     api_host: str = os.getenv("API_HOST", "0.0.0.0")
     api_port: int = int(os.getenv("API_PORT", 8000))
+    # HF Inference API base URL; point it at eval/hf_stub.py for offline load tests
+    hf_api_url: str = os.getenv("HF_API_URL", "https://api-inference.huggingface.co/models").rstrip("/")
+    # live: call the API; record: call it and save responses to the cassette; replay: serve saved responses
+    hf_client_mode: str = os.getenv("HF_CLIENT_MODE", "live").strip().lower()
+    hf_cassette_dir: str = os.getenv("HF_CASSETTE_DIR", "")  # default: `cassettes` next to the database
+    # replayed calls wait this fraction of the recorded latency (0: answer at once, 1: as recorded)
+    hf_replay_latency_scale: float = float(os.getenv("HF_REPLAY_LATENCY_SCALE", 0.0))
+    # shared HTTP connection pool for the HF Inference API
+    hf_max_connections: int = int(os.getenv("HF_MAX_CONNECTIONS", 20))
+    hf_max_keepalive_connections: int = int(os.getenv("HF_MAX_KEEPALIVE_CONNECTIONS", 10))
+    hf_keepalive_expiry: float = float(os.getenv("HF_KEEPALIVE_EXPIRY", 30.0))
+    hf_http2: bool = _env_bool("HF_HTTP2")
+    # response cache for generate_code (memory LRU + SQLite table)
+    response_cache_enabled: bool = _env_bool("RESPONSE_CACHE_ENABLED", True)
+    response_cache_ttl: float = float(os.getenv("RESPONSE_CACHE_TTL", 86400))
+    response_cache_memory_entries: int = int(os.getenv("RESPONSE_CACHE_MEMORY_ENTRIES", 256))
+    response_cache_max_bytes: int = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+    # request tracing to rotating JSONL (default: traces.jsonl next to the database)
+    tracing_enabled: bool = _env_bool("TRACING_ENABLED")
+    trace_file: str = os.getenv("TRACE_FILE", "")
+    trace_max_bytes: int = int(os.getenv("TRACE_MAX_BYTES", 10 * 1024 * 1024))
+    trace_backup_count: int = int(os.getenv("TRACE_BACKUP_COUNT", 5))
+    # let clients request a profile per request (X-Profile: 1 or ?profile=1)
+    trace_allow_profile: bool = _env_bool("TRACE_ALLOW_PROFILE")
+    profile_interval_ms: float = float(os.getenv("PROFILE_INTERVAL_MS", 2))
+    # per-unit (top-level function/class) analysis cache; 0 disables it
+    analysis_cache_entries: int = int(os.getenv("ANALYSIS_CACHE_ENTRIES", 4096))
+    # codegen backend: "hf_api" (HF Inference API) or "local" (resident model, batched generate)
+    codegen_backend: str = os.getenv("CODEGEN_BACKEND", "hf_api")
+    local_base_model: str = os.getenv("LOCAL_BASE_MODEL", "bigcode/starcoder2-3b")
+    local_lora_dir: str = os.getenv("LOCAL_LORA_DIR", "")  # LoRA adapter on top of the base model, if any
+    local_quantize: str = os.getenv("LOCAL_QUANTIZE", "")  # "int8": dynamic int8 Linear layers (CPU)
+    local_max_batch_size: int = int(os.getenv("LOCAL_MAX_BATCH_SIZE", 8))
+    local_max_wait_ms: float = float(os.getenv("LOCAL_MAX_WAIT_MS", 20))
+    # prefilled key/value caches of shared prompt prefixes kept by the local backend (0 disables reuse)
+    local_prefix_cache_entries: int = int(os.getenv("LOCAL_PREFIX_CACHE_ENTRIES", 8))
+    # small model sharing the tokenizer for speculative decoding; empty disables it
+    local_draft_model: str = os.getenv("LOCAL_DRAFT_MODEL", "")
+    local_draft_lookahead: int = int(os.getenv("LOCAL_DRAFT_LOOKAHEAD", 5))  # draft tokens verified per step
+    # diagram backend: "stable_diffusion" (HF API) or "ast" (local graph of the generated code)
+    diagram_backend: str = os.getenv("DIAGRAM_BACKEND", "stable_diffusion")
+    diagram_format: str = os.getenv("DIAGRAM_FORMAT", "svg")  # ast backend only: svg | png
+    diagram_fallback_sd: bool = _env_bool("DIAGRAM_FALLBACK_SD", True)
+    # retrieval of similar past generations into the codegen prompt
+    retrieval_enabled: bool = _env_bool("RETRIEVAL_ENABLED")
+    retrieval_top_k: int = int(os.getenv("RETRIEVAL_TOP_K", 3))
+    retrieval_dim: int = int(os.getenv("RETRIEVAL_DIM", 512))
+    retrieval_min_score: float = float(os.getenv("RETRIEVAL_MIN_SCORE", 0.2))
+    retrieval_index_dir: str = os.getenv("RETRIEVAL_INDEX_DIR", "")  # default: next to the database
+    # background diagram generation
+    async_diagrams: bool = _env_bool("ASYNC_DIAGRAMS")
+    diagram_workers: int = int(os.getenv("DIAGRAM_WORKERS", 2))
+    diagram_job_max_attempts: int = int(os.getenv("DIAGRAM_JOB_MAX_ATTEMPTS", 3))
+    # a running job whose worker hasn't renewed it for this long is assumed crashed and requeued
+    diagram_job_lease_s: float = float(os.getenv("DIAGRAM_JOB_LEASE_S", 120))
 
 
 settings = Settings()
-
-
-
-
@@ -1,53 +1,137 @@
+import asyncio
 import base64
+import hashlib
+import io
 import json
-import asyncio
-from typing import Any, Dict, Tuple
+import os
+import tempfile
+from typing import Any, AsyncIterator, Dict, Tuple
 
 import gradio as gr
+from PIL import Image, UnidentifiedImageError
 
-from app.services.codegen import generate_code
+from app.services.codegen import generate_code, generate_code_stream
 from app.services.diagram import generate_diagram
 from app.services.analysis import analyze_code
-from app.metrics.metrics import timer
+from app.metrics.metrics import registry, request_timer, timer
+from app.metrics.tracing import trace_request
 from app.services.hf_clients import HFInferenceClient
-from app.storage.db import save_message, fetch_history
+from app.services.runtime import iterate_sync, run_sync
+from app.storage.blobs import sniff_content_type
+from app.storage.db import HISTORY_FIELDS, fetch_history
+from app.storage.writer import submit_message
+
+
+async def _save_message(**message: Any) -> None:
+    # the SQLite write (or a full write-behind queue) blocks, so keep it off the shared event
+    # loop; waiting on the future surfaces a failed insert instead of losing it
+    await asyncio.wrap_future(await asyncio.to_thread(submit_message, **message))
 
 
 async def orchestrate(prompt: str, session_id: str) -> Tuple[str, str, Dict[str, Any]]:
-    with timer() as (_, elapsed_total):
-        # code gen timing
-        with timer() as (_, elapsed_code):
-            code = await generate_code(prompt)
-        # diagram timing
-        with timer() as (_, elapsed_img):
-            diagram_bytes = await generate_diagram(prompt, code)
-        diagram_b64 = HFInferenceClient.image_bytes_to_base64(diagram_bytes)
-        # analysis timing
-        with timer() as (_, elapsed_ana):
-            analysis = analyze_code(code or "")
-        # attach basic latency metrics (ms)
-        analysis["latency_ms"] = {
-            "total": elapsed_total(),
-            "codegen": elapsed_code(),
-            "diagram": elapsed_img(),
-            "analysis": elapsed_ana(),
-        }
-    save_message(
-        session_id=session_id,
-        user_prompt=prompt,
-        generated_code=code,
-        diagram_base64=diagram_b64,
-        analysis=analysis,
-    )
+    with request_timer("gradio", "orchestrate"):
+        with timer() as (_, elapsed_total):
+            # code gen timing
+            with timer() as (_, elapsed_code):
+                code = await generate_code(prompt)
+            # diagram timing
+            with timer() as (_, elapsed_img):
+                diagram_bytes = await generate_diagram(prompt, code)
+            diagram_b64 = HFInferenceClient.image_bytes_to_base64(diagram_bytes)
+            # analysis timing
+            with timer() as (_, elapsed_ana):
+                analysis = analyze_code(code or "")
+            # attach basic latency metrics (ms); the metrics registry aggregates them per stage
+            analysis["latency_ms"] = {
+                "total": elapsed_total(),
+                "codegen": elapsed_code(),
+                "diagram": elapsed_img(),
+                "analysis": elapsed_ana(),
+            }
+        await _save_message(
+            session_id=session_id,
+            user_prompt=prompt,
+            generated_code=code,
+            diagram_base64=diagram_b64,
+            analysis=analysis,
+        )
     return code, diagram_b64, analysis
 
 
+async def orchestrate_stream(
+    prompt: str, session_id: str
+) -> AsyncIterator[Tuple[str, str | None, Dict[str, Any] | None]]:
+    """Streaming variant of `orchestrate`: yields partial results as they become available."""
+    with request_timer("gradio", "orchestrate_stream"):
+        with timer() as (_, elapsed_total):
+            parts: list[str] = []
+            with timer() as (_, elapsed_code):
+                async for piece in generate_code_stream(prompt):
+                    parts.append(piece)
+                    yield "".join(parts), None, None
+            code = "".join(parts)
+            with timer() as (_, elapsed_ana):
+                analysis = analyze_code(code)
+            yield code, None, analysis
+            with timer() as (_, elapsed_img):
+                diagram_bytes = await generate_diagram(prompt, code)
+            diagram_b64 = HFInferenceClient.image_bytes_to_base64(diagram_bytes)
+            analysis["latency_ms"] = {
+                "total": elapsed_total(),
+                "codegen": elapsed_code(),
+                "diagram": elapsed_img(),
+                "analysis": elapsed_ana(),
+            }
+        await _save_message(
+            session_id=session_id,
+            user_prompt=prompt,
+            generated_code=code,
+            diagram_base64=diagram_b64,
+            analysis=analysis,
+        )
+    yield code, diagram_b64, analysis
+
+
 def _orchestrate_sync(prompt: str, session_id: str):
-    return asyncio.run(orchestrate(prompt, session_id))
+    with trace_request("gradio orchestrate", entrypoint="gradio"):
+        return run_sync(orchestrate(prompt, session_id))
+
+
+def _orchestrate_stream_sync(prompt: str, session_id: str):
+    with trace_request("gradio orchestrate_stream", entrypoint="gradio"):
+        yield from iterate_sync(orchestrate_stream(prompt, session_id))
 
 
-def _history_sync(session_id: str):
-    return fetch_history(session_id)
+def _diagram_image(diagram_b64: str | None) -> Image.Image | str | None:
+    # gr.Image rejects raw bytes; hand it a decoded image (or nothing if the bytes aren't one)
+    if not diagram_b64:
+        return None
+    data = base64.b64decode(diagram_b64)
+    if sniff_content_type(data) == "image/svg+xml":
+        # PIL can't rasterise the ast backend's default SVG; gr.Image serves a .svg path as is
+        path = os.path.join(tempfile.gettempdir(), f"diagram-{hashlib.sha256(data).hexdigest()[:16]}.svg")
+        if not os.path.exists(path):
+            with open(path, "wb") as fh:
+                fh.write(data)
+        return path
+    try:
+        image = Image.open(io.BytesIO(data))
+        image.load()
+    except (UnidentifiedImageError, OSError):
+        return None
+    return image
+
+
+def _on_submit(prompt: str, session_id: str):
+    for code, diagram_b64, analysis in _orchestrate_stream_sync(prompt, session_id):
+        yield code, _diagram_image(diagram_b64), analysis
+
+
+def _history_sync(session_id: str, before_id: int | None = None, fields: list[str] | None = None):
+    if fields and "id" not in fields:
+        # ids are the paging cursors
+        fields = ["id", *fields]
+    return fetch_history(session_id, before_id=before_id, fields=fields)
 
 
 def build_interface() -> gr.Blocks:
@@ -71,20 +155,40 @@ Enter your request to generate code, architecture diagram, and analysis.
 
         with gr.Tab("History"):
             history_session = gr.Textbox(label="Session ID", value="default")
-            reload = gr.Button("Reload History")
+            history_fields = gr.CheckboxGroup(
+                choices=list(HISTORY_FIELDS),
+                value=[f for f in HISTORY_FIELDS if f != "diagram_base64"],
+                label="Fields",
+            )
+            history_before = gr.Number(label="Before ID (empty for newest)", precision=0, value=None)
+            with gr.Row():
+                reload = gr.Button("Reload History")
+                older = gr.Button("Older")
             history_json = gr.JSON(label="History")
 
-        def _on_submit(p: str, s: str):
-            code, diagram_b64, analysis = _orchestrate_sync(p, s)
-            img_bytes = base64.b64decode(diagram_b64)
-            return code, img_bytes, analysis
+        with gr.Tab("Metrics"):
+            refresh_metrics = gr.Button("Refresh")
+            metrics_json = gr.JSON(label="Latency (seconds: count, mean, p50/p95/p99) and counters")
 
         submit.click(_on_submit, inputs=[prompt, session], outputs=[code_out, image_out, analysis_out])
 
-        def _on_reload(s: str):
-            return _history_sync(s)
+        def _on_reload(s: str, before: float | None, fields: list[str]):
+            return _history_sync(s, int(before) if before else None, fields or None)
+
+        reload.click(_on_reload, inputs=[history_session, history_before, history_fields], outputs=[history_json])
+
+        def _on_older(s: str, items: list[dict] | None, fields: list[str]):
+            cursor = items[0]["id"] if items else None
+            page = _history_sync(s, cursor, fields or None) if cursor else []
+            return page, cursor
+
+        older.click(
+            _on_older,
+            inputs=[history_session, history_json, history_fields],
+            outputs=[history_json, history_before],
+        )
 
-        reload.click(_on_reload, inputs=[history_session], outputs=[history_json])
+        refresh_metrics.click(registry.snapshot, inputs=None, outputs=[metrics_json])
 
     return demo
 
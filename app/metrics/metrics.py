@@ -1,6 +1,11 @@
+import bisect
+import functools
+import inspect
+import math
+import threading
 import time
 from contextlib import contextmanager
-from typing import Dict, Any, Callable, Tuple
+from typing import Any, Callable, Dict, Iterator, List, Sequence, Tuple
 
 
 @contextmanager
@@ -17,6 +22,18 @@ def timer() -> Tuple[None, Callable[[], float]]:
 
 
 def with_timing(fn):
+    """Wrap `fn` to return (result, elapsed_ms); works for plain and async functions."""
+    if inspect.iscoroutinefunction(fn):
+
+        @functools.wraps(fn)
+        async def async_wrapper(*args, **kwargs):
+            t0 = time.perf_counter()
+            result = await fn(*args, **kwargs)
+            return result, (time.perf_counter() - t0) * 1000.0
+
+        return async_wrapper
+
+    @functools.wraps(fn)
     def wrapper(*args, **kwargs):
         t0 = time.perf_counter()
         result = fn(*args, **kwargs)
@@ -26,3 +43,316 @@ def with_timing(fn):
     return wrapper
 
 
+# seconds; covers cache hits (sub-ms) up to slow cold model loads
+DEFAULT_BUCKETS: Tuple[float, ...] = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0,
+)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", r"\\").replace("\n", r"\n").replace('"', r"\"")
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple[str, ...], Any] = {}
+
+    def _key(self, labels: Dict[str, Any]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[n]) for n in self.labelnames)
+
+    def _label_text(self, key: Tuple[str, ...], extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+        pairs = list(zip(self.labelnames, key)) + list(extra)
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{n}="{_escape(v)}"' for n, v in pairs) + "}"
+
+    def _items(self) -> List[Tuple[Tuple[str, ...], Any]]:
+        with self._lock:
+            return [(k, self._copy(v)) for k, v in sorted(self._values.items())]
+
+    def _copy(self, value: Any) -> Any:
+        return value
+
+    def clear(self) -> None:
+        with self._lock:
+            self._values.clear()
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1.0, **labels: Any) -> None:
+        if amount < 0:
+            raise ValueError("counters can only increase")
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels: Any) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0.0)
+
+    def samples(self) -> Iterator[str]:
+        for key, value in self._items():
+            yield f"{self.name}{self._label_text(key)} {_format_value(value)}"
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def inc(self, amount: float = 1.0, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels: Any) -> None:
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = float(value)
+
+    @contextmanager
+    def track_inprogress(self, **labels: Any) -> Iterator[None]:
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+
+class Histogram(_Metric):
+    """Fixed-bucket histogram; quantiles are estimated from the buckets like Prometheus does."""
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # per-bucket (non-cumulative) counts, the last one is +Inf; then sum
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][index] += 1
+            state[1] += value
+
+    @contextmanager
+    def time(self, **labels: Any) -> Iterator[None]:
+        """Observe the duration of the block in seconds; also usable inside async functions."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _copy(self, value: Any) -> Any:
+        return [list(value[0]), value[1]]
+
+    def count(self, **labels: Any) -> int:
+        with self._lock:
+            state = self._values.get(self._key(labels))
+            return sum(state[0]) if state else 0
+
+    def quantile(self, q: float, **labels: Any) -> float | None:
+        with self._lock:
+            state = self._values.get(self._key(labels))
+            counts = list(state[0]) if state else None
+        return self._quantile(q, counts) if counts else None
+
+    def _quantile(self, q: float, counts: List[int]) -> float | None:
+        total = sum(counts)
+        if total == 0:
+            return None
+        rank = q * total
+        seen = 0
+        for i, n in enumerate(counts):
+            if n and seen + n >= rank:
+                if i == len(self.buckets):
+                    # beyond the last finite bucket: its bound is the best estimate
+                    return self.buckets[-1]
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                return lower + (self.buckets[i] - lower) * (rank - seen) / n
+            seen += n
+        return self.buckets[-1]
+
+    def samples(self) -> Iterator[str]:
+        for key, (counts, total) in self._items():
+            cumulative = 0
+            for bound, n in zip(self.buckets + (math.inf,), counts):
+                cumulative += n
+                yield f"{self.name}_bucket{self._label_text(key, (('le', _format_value(bound)),))} {cumulative}"
+            yield f"{self.name}_sum{self._label_text(key)} {_format_value(total)}"
+            yield f"{self.name}_count{self._label_text(key)} {cumulative}"
+
+    def summaries(self) -> List[Dict[str, Any]]:
+        rows = []
+        for key, (counts, total) in self._items():
+            n = sum(counts)
+            rows.append(
+                {
+                    "labels": dict(zip(self.labelnames, key)),
+                    "count": n,
+                    "sum": total,
+                    "mean": total / n if n else None,
+                    **{f"p{int(q * 100)}": self._quantile(q, counts) for q in (0.5, 0.95, 0.99)},
+                }
+            )
+        return rows
+
+
+class MetricsRegistry:
+    """Process-wide set of named metrics, rendered in the Prometheus text format."""
+
+    def __init__(self) -> None:
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, cls: type, name: str, documentation: str, labelnames: Sequence[str], **kw: Any):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, documentation, labelnames, **kw)
+            elif type(metric) is not cls or metric.labelnames != tuple(labelnames):
+                raise ValueError(f"metric {name} already registered as a different {metric.kind}")
+            return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._get_or_create(Counter, name, documentation, labelnames)
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._get_or_create(Gauge, name, documentation, labelnames)
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        return self._get_or_create(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda m: m.name)
+        lines: List[str] = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {_escape(metric.documentation)}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self) -> Dict[str, Any]:
+        """JSON-friendly view: counter/gauge values and histogram count, mean, p50/p95/p99."""
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda m: m.name)
+        out: Dict[str, Any] = {}
+        for metric in metrics:
+            if isinstance(metric, Histogram):
+                out[metric.name] = metric.summaries()
+            else:
+                out[metric.name] = [
+                    {"labels": dict(zip(metric.labelnames, key)), "value": value} for key, value in metric._items()
+                ]
+        return out
+
+    def clear(self) -> None:
+        """Reset every value, keeping the registered metrics."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        for metric in metrics:
+            metric.clear()
+
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+registry = MetricsRegistry()
+
+STAGE_SECONDS = registry.histogram(
+    "app_stage_duration_seconds", "Duration of a pipeline stage", ("stage", "model")
+)
+STAGE_ERRORS = registry.counter("app_stage_errors_total", "Pipeline stage failures", ("stage", "model"))
+MODEL_REQUEST_SECONDS = registry.histogram(
+    "app_model_request_duration_seconds", "Duration of a Hugging Face Inference API call", ("model", "task")
+)
+MODEL_REQUEST_ERRORS = registry.counter(
+    "app_model_request_errors_total", "Failed Hugging Face Inference API calls", ("model", "task")
+)
+FIRST_TOKEN_SECONDS = registry.histogram(
+    "app_model_first_token_seconds", "Time to the first streamed token", ("model",)
+)
+RESPONSE_CACHE_LOOKUPS = registry.counter(
+    "app_response_cache_lookups_total", "generate_code response cache lookups", ("result",)
+)
+LOCAL_BATCH_SIZE = registry.histogram(
+    "app_local_batch_size", "Prompts per local model.generate call", buckets=(1, 2, 4, 8, 16, 32, 64)
+)
+REQUESTS = registry.counter("app_requests_total", "Handled requests", ("entrypoint", "route", "status"))
+REQUEST_SECONDS = registry.histogram(
+    "app_request_duration_seconds",
+    "Request latency (HTTP: up to the response headers)",
+    ("entrypoint", "route"),
+)
+REQUESTS_IN_FLIGHT = registry.gauge("app_requests_in_flight", "Requests being handled", ("entrypoint",))
+
+
+@contextmanager
+def track(histogram: Histogram, errors: Counter | None = None, **labels: Any) -> Iterator[None]:
+    """Observe the duration of the block, and count it in `errors` if it raises."""
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        if errors is not None:
+            errors.inc(**labels)
+        raise
+    finally:
+        histogram.observe(time.perf_counter() - start, **labels)
+
+
+def stage_timer(stage: str, model: str = "local"):
+    return track(STAGE_SECONDS, STAGE_ERRORS, stage=stage, model=model)
+
+
+def model_timer(model: str, task: str):
+    return track(MODEL_REQUEST_SECONDS, MODEL_REQUEST_ERRORS, model=model, task=task)
+
+
+@contextmanager
+def request_timer(entrypoint: str, route: str) -> Iterator[None]:
+    """Count, time and track one in-flight request; its status is "error" if the block raises."""
+    status = "error"
+    start = time.perf_counter()
+    REQUESTS_IN_FLIGHT.inc(entrypoint=entrypoint)
+    try:
+        yield
+        status = "ok"
+    finally:
+        REQUESTS_IN_FLIGHT.dec(entrypoint=entrypoint)
+        REQUEST_SECONDS.observe(time.perf_counter() - start, entrypoint=entrypoint, route=route)
+        REQUESTS.inc(entrypoint=entrypoint, route=route, status=status)
@@ -0,0 +1,232 @@
+import contextvars
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter as Tally
+from contextlib import contextmanager, nullcontext
+from datetime import datetime, timezone
+from logging.handlers import RotatingFileHandler
+from typing import Any, Dict, Iterator, List
+
+from app.config import settings
+
+
+REQUEST_ID_HEADER = "X-Request-Id"
+PROFILE_HEADER = "X-Profile"
+
+_trace: "contextvars.ContextVar[Trace | None]" = contextvars.ContextVar("trace", default=None)
+_span: "contextvars.ContextVar[Span | None]" = contextvars.ContextVar("span", default=None)
+_NULL_SPAN = nullcontext()
+
+
+class Span:
+    __slots__ = ("trace", "name", "span_id", "parent_id", "attrs", "start", "end", "error", "_parent")
+
+    def __init__(self, trace: "Trace", name: str, attrs: Dict[str, Any]) -> None:
+        self.trace = trace
+        self.name = name
+        self.attrs = attrs
+        self.span_id = trace.next_span_id()
+        self.parent_id: int | None = None
+        self.start = self.end = 0.0
+        self.error: str | None = None
+
+    def __enter__(self) -> "Span":
+        self._parent = _span.get()
+        self.parent_id = self._parent.span_id if self._parent is not None else None
+        _span.set(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.end = time.perf_counter()
+        if exc_type is not None and issubclass(exc_type, Exception):
+            self.error = f"{exc_type.__name__}: {exc}"
+        # set rather than reset: async generators may exit in a different context than they entered
+        _span.set(self._parent)
+        self.trace.spans.append(self)
+
+    def to_dict(self, origin: float) -> Dict[str, Any]:
+        return {
+            "id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start_ms": round((self.start - origin) * 1000, 3),
+            "duration_ms": round((self.end - self.start) * 1000, 3),
+            **({"attrs": self.attrs} if self.attrs else {}),
+            **({"error": self.error} if self.error else {}),
+        }
+
+
+class Trace:
+    """Spans of one request; finished spans are appended from whichever thread ran them."""
+
+    def __init__(self, name: str, request_id: str, attrs: Dict[str, Any]) -> None:
+        self.name = name
+        self.request_id = request_id
+        self.attrs = attrs
+        self.spans: List[Span] = []
+        self.started_at = datetime.now(timezone.utc)
+        self.start = time.perf_counter()
+        self.profile: List[Dict[str, Any]] | None = None
+        self._ids = iter(range(1, sys.maxsize))
+
+    def next_span_id(self) -> int:
+        return next(self._ids)
+
+    def to_dict(self, end: float, error: str | None) -> Dict[str, Any]:
+        record: Dict[str, Any] = {
+            "request_id": self.request_id,
+            "name": self.name,
+            "start": self.started_at.isoformat(),
+            "duration_ms": round((end - self.start) * 1000, 3),
+            "attrs": self.attrs,
+            "spans": [s.to_dict(self.start) for s in sorted(self.spans, key=lambda s: s.start)],
+        }
+        if error:
+            record["error"] = error
+        if self.profile is not None:
+            record["profile"] = self.profile
+        return record
+
+
+def span(name: str, **attrs: Any):
+    """Context manager timing `name` as a child of the current span; a no-op outside a trace."""
+    trace = _trace.get()
+    if trace is None:
+        return _NULL_SPAN
+    return Span(trace, name, attrs)
+
+
+class SamplingProfiler:
+    """Periodically samples the stacks of all threads and tallies functions, cProfile-style.
+
+    cProfile only sees the thread that enabled it, while the pipeline's awaits run on
+    the shared event loop thread, so stacks of every thread are sampled instead. Work
+    of other requests running concurrently shows up in the samples too.
+    """
+
+    def __init__(self, interval: float = 0.002, limit: int = 30) -> None:
+        self.interval = interval
+        self.limit = limit
+        self.samples = 0
+        self._self: Tally = Tally()
+        self._cumulative: Tally = Tally()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="trace-profiler", daemon=True)
+
+    def __enter__(self) -> "SamplingProfiler":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        me = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                self.samples += 1
+                seen = set()
+                first = True
+                while frame is not None:
+                    code = frame.f_code
+                    key = f"{code.co_filename}:{code.co_firstlineno}({code.co_name})"
+                    if first:
+                        self._self[key] += 1
+                        first = False
+                    if key not in seen:
+                        self._cumulative[key] += 1
+                        seen.add(key)
+                    frame = frame.f_back
+
+    def summary(self) -> List[Dict[str, Any]]:
+        """Top functions by cumulative time, with self time, as estimated from the samples."""
+        ms = self.interval * 1000
+        idle = ("threading.py", "selectors.py", "queue.py", "base_events.py")
+        rows = [
+            {"function": key, "tottime_ms": round(self._self[key] * ms, 1), "cumtime_ms": round(n * ms, 1)}
+            for key, n in self._cumulative.most_common()
+            if not any(f"{name}:" in key for name in idle)
+        ]
+        return rows[: self.limit]
+
+
+_logger = logging.getLogger("app.traces")
+_logger.setLevel(logging.INFO)
+_logger.propagate = False
+_logger_path: str | None = None
+_logger_lock = threading.Lock()
+
+
+def trace_path() -> str:
+    return settings.trace_file or os.path.join(os.path.dirname(settings.database_path), "traces.jsonl")
+
+
+def _trace_logger() -> logging.Logger:
+    global _logger_path
+    path = trace_path()
+    with _logger_lock:
+        if path != _logger_path:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            handler = RotatingFileHandler(
+                path, maxBytes=settings.trace_max_bytes, backupCount=settings.trace_backup_count, encoding="utf-8"
+            )
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            for old in _logger.handlers:
+                old.close()
+            _logger.handlers = [handler]
+            _logger_path = path
+    return _logger
+
+
+def export(record: Dict[str, Any]) -> None:
+    _trace_logger().info(json.dumps(record, default=str))
+
+
+def wants_profile(headers: Any, args: Any) -> bool:
+    """Whether the client asked for a profile (X-Profile header or ?profile=1) and it is allowed."""
+    if not settings.trace_allow_profile:
+        return False
+    value = headers.get(PROFILE_HEADER) or headers.get(PROFILE_HEADER.lower()) or args.get("profile") or ""
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+@contextmanager
+def trace_request(
+    name: str, request_id: str | None = None, profile: bool = False, **attrs: Any
+) -> Iterator[Trace | None]:
+    """Collect spans for one request and export them as a JSONL record when it ends.
+
+    Yields None (and records nothing) when tracing is off and no profile was asked for.
+    """
+    if not (settings.tracing_enabled or profile):
+        yield None
+        return
+    trace = Trace(name, request_id or uuid.uuid4().hex, attrs)
+    previous = _trace.get()
+    _trace.set(trace)
+    profiler = SamplingProfiler(settings.profile_interval_ms / 1000) if profile else None
+    error = None
+    try:
+        if profiler is not None:
+            with profiler:
+                yield trace
+        else:
+            yield trace
+    except Exception as exc:
+        error = f"{type(exc).__name__}: {exc}"
+        raise
+    finally:
+        end = time.perf_counter()
+        _trace.set(previous)
+        if profiler is not None:
+            trace.profile = profiler.summary()
+        export(trace.to_dict(end, error))
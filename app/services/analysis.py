@@ -1,11 +1,65 @@
-from typing import Dict, Any
+from typing import Dict, Any, FrozenSet, Iterable, Iterator, List, Tuple
+import ast
+import hashlib
+import itertools
+import multiprocessing
+import os
 import re
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
 
-import nltk
-from radon.complexity import cc_visit
+from app.config import settings
+from app.metrics.metrics import stage_timer
+from app.metrics.tracing import span
+
+
+# Naive tokenization: identifiers, keywords, symbols
+TOKEN_RE = re.compile(r"[A-Za-z_][A-Za-z0-9_]*|\S")
+
+# pattern names in reporting order
+PATTERN_NAMES: tuple[str, ...] = (
+    "class_definition",
+    "function_definition",
+    "for_loop",
+    "while_loop",
+    "try_block",
+    "except_block",
+    "if_statement",
+)
+
+# textual fallback for code that is not valid Python (e.g. Java snippets)
+PATTERN_REGEXES: tuple[tuple[re.Pattern[str], str], ...] = (
+    (re.compile(r"class\s+\w+", re.MULTILINE), "class_definition"),
+    (re.compile(r"def\s+\w+\s*\(", re.MULTILINE), "function_definition"),
+    (re.compile(r"for\s+.+:\s*$", re.MULTILINE), "for_loop"),
+    (re.compile(r"while\s+.+:\s*$", re.MULTILINE), "while_loop"),
+    (re.compile(r"try:\s*$", re.MULTILINE), "try_block"),
+    (re.compile(r"except\s+.+:\s*$", re.MULTILINE), "except_block"),
+    (re.compile(r"if\s+.+:\s*$", re.MULTILINE), "if_statement"),
+)
+
+_NODE_PATTERNS: Dict[type, str] = {
+    ast.ClassDef: "class_definition",
+    ast.FunctionDef: "function_definition",
+    ast.AsyncFunctionDef: "function_definition",
+    ast.For: "for_loop",
+    ast.AsyncFor: "for_loop",
+    ast.While: "while_loop",
+    ast.Try: "try_block",
+    ast.If: "if_statement",
+}
+if hasattr(ast, "TryStar"):
+    _NODE_PATTERNS[ast.TryStar] = "try_block"
+
+_DEFS = (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)
+_MATCH = getattr(ast, "Match", None)
 
 
 def ensure_nltk() -> None:
+    # Kept for callers that want NLTK tokenizers; analysis itself does not need them.
+    import nltk
+
     try:
         nltk.data.find("tokenizers/punkt")
     except LookupError:
@@ -13,49 +67,293 @@ def ensure_nltk() -> None:
 
 
 def tokenize_code(code: str) -> list[str]:
-    ensure_nltk()
-    # Naive tokenization: identifiers, keywords, symbols
-    tokens = re.findall(r"[A-Za-z_][A-Za-z0-9_]*|\S", code)
-    return tokens
+    return TOKEN_RE.findall(code)
 
 
-def cyclomatic_complexity(code: str) -> float:
+def _parse(code: str) -> ast.Module | None:
     try:
-        results = cc_visit(code)
-        if not results:
-            return 0.0
-        return float(sum(r.complexity for r in results) / len(results))
-    except Exception:
-        return 0.0
+        return ast.parse(code)
+    except (SyntaxError, ValueError):
+        return None
+
+
+def _walk(nodes: list[ast.AST], found: set[str]) -> tuple[int, list[ast.AST]]:
+    """Count decision points below `nodes` and note patterns, in one iterative pass.
+
+    Counting follows radon's ComplexityVisitor, so results match `cc_visit`.
+    Nested functions and classes are not entered; they are returned so the
+    caller can score them as blocks of their own.
+    """
+    decisions = 0
+    nested: list[ast.AST] = []
+    stack = list(nodes)
+    while stack:
+        node = stack.pop()
+        kind = type(node)
+        pattern = _NODE_PATTERNS.get(kind)
+        if pattern is not None:
+            found.add(pattern)
+        if kind in _DEFS:
+            nested.append(node)
+            continue
+        if kind is ast.If or kind is ast.IfExp:
+            decisions += 1
+        elif kind is ast.BoolOp:
+            decisions += len(node.values) - 1
+        elif kind is ast.For or kind is ast.While or kind is ast.AsyncFor:
+            decisions += 1 + bool(node.orelse)
+        elif kind is ast.Try:
+            decisions += len(node.handlers) + bool(node.orelse)
+        elif kind is ast.comprehension:
+            decisions += 1 + len(node.ifs)
+        elif kind is ast.ExceptHandler:
+            if node.type is not None:
+                found.add("except_block")
+        elif kind is ast.Assert:
+            # radon counts asserts as one and does not look inside them
+            decisions += 1
+            continue
+        elif kind is _MATCH:
+            wildcard = any(getattr(case.pattern, "pattern", False) is None for case in node.cases)
+            decisions += max(0, len(node.cases) - wildcard)
+        for field in node._fields:
+            value = getattr(node, field, None)
+            if isinstance(value, list):
+                stack.extend(v for v in value if isinstance(v, ast.AST))
+            elif isinstance(value, ast.AST):
+                stack.append(value)
+    return decisions, nested
+
+
+def _score_block(node: ast.AST, found: set[str], blocks: list[int] | None) -> int:
+    """Complexity of a function or class; appended to `blocks` when it is reported."""
+    decisions, nested = _walk(node.body, found)
+    if isinstance(node, ast.ClassDef):
+        methods = []
+        for child in nested:
+            if isinstance(child, ast.ClassDef):
+                _score_block(child, found, None)  # inner classes are not reported
+            else:
+                methods.append(_score_block(child, found, None))
+        complexity = 1 + decisions + sum(methods)
+        if blocks is not None:
+            # radon reports a class by its per-method average (+1 with several methods)
+            n = len(methods)
+            blocks.append(int(complexity / n) + (n > 1) if n else complexity)
+            blocks.extend(methods)
+        return complexity
+    for child in nested:
+        _score_block(child, found, None)  # closures are not reported
+    if blocks is not None:
+        blocks.append(1 + decisions)
+    return 1 + decisions
+
+
+def _scan(tree: ast.Module) -> tuple[list[int], set[str]]:
+    """Block complexities (functions, classes, methods) and patterns of a module."""
+    found: set[str] = set()
+    blocks: list[int] = []
+    _, nested = _walk(tree.body, found)
+    for node in nested:
+        _score_block(node, found, blocks)
+    return blocks, found
+
+
+def _ordered(found: set[str] | FrozenSet[str]) -> list[str]:
+    return [name for name in PATTERN_NAMES if name in found]
+
+
+def _average(blocks: list[int]) -> float:
+    return float(sum(blocks) / len(blocks)) if blocks else 0.0
+
+
+def _patterns_from_text(code: str) -> list[str]:
+    return [name for regex, name in PATTERN_REGEXES if regex.search(code)]
+
+
+# a top-level unit starts at a column-0 decorator, def or class line
+_UNIT_START_RE = re.compile(r"^(?:@|def\s|async\s+def\s|class\s)", re.MULTILINE)
+_BLANK_OR_COMMENT_RE = re.compile(r"^\s*(?:#.*)?$")
+
+UnitResult = Tuple[Tuple[int, ...], FrozenSet[str]]
+
+
+def split_units(code: str) -> list[str]:
+    """Split source into top-level units: the preamble, then one chunk per function/class.
+
+    Decorators stay with the definition they decorate, and module-level statements
+    after a definition stay in its chunk. This is a textual split, so a match inside
+    a multi-line string or bracket can cut a statement in half; such a chunk does not
+    parse and the caller falls back to analysing the whole file.
+    """
+    starts = [0]
+    decorated = False
+    for match in _UNIT_START_RE.finditer(code):
+        is_decorator = match.group().startswith("@")
+        if decorated:
+            decorated = is_decorator
+            continue
+        if match.start() > 0:
+            starts.append(match.start())
+        decorated = is_decorator
+    starts.append(len(code))
+    return [code[a:b] for a, b in zip(starts, starts[1:]) if a < b]
+
+
+def unit_key(unit: str) -> bytes:
+    """Hash of a unit with blank lines, comment lines and trailing whitespace dropped."""
+    lines = [line.rstrip() for line in unit.splitlines() if not _BLANK_OR_COMMENT_RE.match(line)]
+    return hashlib.blake2b("\n".join(lines).encode("utf-8"), digest_size=16).digest()
+
+
+class AnalysisCache:
+    """Bounded LRU of per-unit analysis results, keyed by `unit_key`."""
+
+    def __init__(self, max_entries: int = 4096) -> None:
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[bytes, UnitResult]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def get(self, key: bytes) -> UnitResult | None:
+        with self._lock:
+            result = self._entries.get(key)
+            if result is None:
+                self._stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+            return result
+
+    def put(self, key: bytes, result: UnitResult) -> None:
+        with self._lock:
+            self._entries[key] = result
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {**self._stats, "entries": len(self._entries)}
+
+
+unit_cache = AnalysisCache(max_entries=settings.analysis_cache_entries)
+
+
+def _scan_units(code: str) -> tuple[list[int], set[str]] | None:
+    """Merge cached per-unit results, parsing only the units not seen before.
+
+    Complexity blocks and patterns of a module are the concatenation/union of those
+    of its top-level statements, so the merge equals a whole-file scan. Returns None
+    when a unit does not parse on its own.
+    """
+    blocks: list[int] = []
+    found: set[str] = set()
+    for unit in split_units(code):
+        key = unit_key(unit)
+        result = unit_cache.get(key)
+        if result is None:
+            tree = _parse(unit)
+            if tree is None:
+                return None
+            unit_blocks, unit_found = _scan(tree)
+            result = (tuple(unit_blocks), frozenset(unit_found))
+            unit_cache.put(key, result)
+        blocks.extend(result[0])
+        found.update(result[1])
+    return blocks, found
+
+
+def _analyze(code: str) -> tuple[float, list[str]]:
+    if settings.analysis_cache_entries > 0:
+        merged = _scan_units(code)
+        if merged is not None:
+            return _average(merged[0]), _ordered(merged[1])
+    tree = _parse(code)
+    if tree is None:
+        return 0.0, _patterns_from_text(code)
+    blocks, found = _scan(tree)
+    return _average(blocks), _ordered(found)
+
+
+def cyclomatic_complexity(code: str) -> float:
+    return _analyze(code)[0]
 
 
 def detect_patterns(code: str) -> list[str]:
-    patterns: list[tuple[str, str]] = [
-        (r"class\s+\w+", "class_definition"),
-        (r"def\s+\w+\s*\(", "function_definition"),
-        (r"for\s+.+:\s*$", "for_loop"),
-        (r"while\s+.+:\s*$", "while_loop"),
-        (r"try:\s*$", "try_block"),
-        (r"except\s+.+:\s*$", "except_block"),
-        (r"if\s+.+:\s*$", "if_statement"),
-    ]
-    found: list[str] = []
-    for regex, name in patterns:
-        if re.search(regex, code, flags=re.MULTILINE):
-            found.append(name)
-    return found
+    return _analyze(code)[1]
 
 
 def analyze_code(code: str) -> Dict[str, Any]:
-    tokens = tokenize_code(code)
-    complexity = cyclomatic_complexity(code)
-    patterns = detect_patterns(code)
+    # complexity and patterns come from one traversal, reused per unchanged function/class
+    with stage_timer("analysis"), span("analyze_code", chars=len(code)):
+        complexity, patterns = _analyze(code)
     return {
-        "token_count": len(tokens),
+        "token_count": len(TOKEN_RE.findall(code)),
         "avg_cyclomatic_complexity": complexity,
         "patterns": patterns,
     }
 
 
+def _chunked(items: Iterable[Tuple[Any, str]], size: int) -> Iterator[List[Tuple[Any, str]]]:
+    it = iter(items)
+    while chunk := list(itertools.islice(it, size)):
+        yield chunk
+
+
+def _analyze_chunk(chunk: List[Tuple[Any, str]]) -> List[Tuple[Any, Dict[str, Any]]]:
+    return [(key, analyze_code(code)) for key, code in chunk]
+
+
+def analyze_many(
+    items: Iterable[Tuple[Any, str]],
+    workers: int | None = None,
+    chunksize: int = 64,
+    ordered: bool = True,
+    max_pending: int | None = None,
+) -> Iterator[Tuple[Any, Dict[str, Any]]]:
+    """Analyse (key, code) pairs on a process pool, yielding (key, result) pairs.
+
+    `items` is consumed lazily in chunks of `chunksize`; at most `max_pending`
+    chunks (default: two per worker) are in flight, so memory stays bounded for
+    any input size. With `ordered=False` results come back as chunks finish.
+    `workers=1` analyses in this process.
+    """
+    workers = workers or os.cpu_count() or 1
+    chunks = _chunked(items, chunksize)
+    if workers <= 1:
+        for chunk in chunks:
+            yield from _analyze_chunk(chunk)
+        return
+    max_pending = max_pending or 2 * workers
+    # spawn: callers (servers, the write-behind queue) may have threads running
+    pool = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn"))
+    pending: "deque[Future[List[Tuple[Any, Dict[str, Any]]]]]" = deque()
+    try:
+        for chunk in chunks:
+            while len(pending) >= max_pending:
+                yield from _drain(pending, ordered)
+            pending.append(pool.submit(_analyze_chunk, chunk))
+        while pending:
+            yield from _drain(pending, ordered)
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
 
 
+def _drain(
+    pending: "deque[Future[List[Tuple[Any, Dict[str, Any]]]]]", ordered: bool
+) -> Iterator[Tuple[Any, Dict[str, Any]]]:
+    """Yield the results of the oldest chunk (ordered) or of every finished chunk."""
+    if ordered:
+        yield from pending.popleft().result()
+        return
+    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+    for future in done:
+        pending.remove(future)
+    for future in done:
+        yield from future.result()
@@ -0,0 +1,190 @@
+import ast
+import importlib.util
+import io
+from html import escape
+from typing import Dict, Tuple
+
+import networkx as nx
+
+
+# column of each node kind in the rendered diagram, left to right
+KIND_COLUMNS: Dict[str, int] = {"import": 0, "module": 1, "class": 2, "function": 3, "method": 3}
+KIND_COLORS: Dict[str, str] = {
+    "import": "#e8eaf6",
+    "module": "#fff3e0",
+    "class": "#e3f2fd",
+    "function": "#e8f5e9",
+    "method": "#f1f8e9",
+}
+EDGE_STYLES: Dict[str, str] = {
+    "imports": "stroke:#7986cb;stroke-dasharray:4 3",
+    "defines": "stroke:#9e9e9e",
+    "inherits": "stroke:#1e88e5;stroke-width:2",
+    "calls": "stroke:#43a047",
+}
+
+BOX_W, BOX_H, COL_GAP, ROW_GAP, MARGIN = 180, 34, 70, 14, 20
+
+
+class _GraphBuilder(ast.NodeVisitor):
+    def __init__(self) -> None:
+        self.graph = nx.DiGraph()
+        self.graph.add_node("module", kind="module", label="module")
+        self._scope: list[str] = ["module"]
+        self._class: list[str] = []
+        self._calls: list[Tuple[str, str, str | None]] = []
+
+    def _add(self, node_id: str, kind: str, label: str, parent: str, edge: str = "defines") -> None:
+        self.graph.add_node(node_id, kind=kind, label=label)
+        self.graph.add_edge(parent, node_id, kind=edge)
+
+    def visit_Import(self, node: ast.Import) -> None:
+        for alias in node.names:
+            name = alias.name
+            self.graph.add_node(f"import:{name}", kind="import", label=name)
+            self.graph.add_edge("module", f"import:{name}", kind="imports")
+
+    def visit_ImportFrom(self, node: ast.ImportFrom) -> None:
+        name = "." * node.level + (node.module or "")
+        self.graph.add_node(f"import:{name}", kind="import", label=name)
+        self.graph.add_edge("module", f"import:{name}", kind="imports")
+
+    def visit_ClassDef(self, node: ast.ClassDef) -> None:
+        node_id = f"class:{node.name}"
+        self._add(node_id, "class", node.name, self._scope[-1])
+        for base in node.bases:
+            if isinstance(base, ast.Name):
+                self._calls.append((node_id, base.id, None))
+        self._scope.append(node_id)
+        self._class.append(node.name)
+        self.generic_visit(node)
+        self._class.pop()
+        self._scope.pop()
+
+    def _visit_function(self, node: ast.FunctionDef | ast.AsyncFunctionDef) -> None:
+        parent = self._scope[-1]
+        if parent.startswith("class:"):
+            node_id, kind, label = f"method:{self._class[-1]}.{node.name}", "method", f"{self._class[-1]}.{node.name}"
+        else:
+            node_id, kind, label = f"function:{node.name}", "function", f"{node.name}()"
+        self._add(node_id, kind, label, parent)
+        self._scope.append(node_id)
+        self.generic_visit(node)
+        self._scope.pop()
+
+    visit_FunctionDef = _visit_function
+    visit_AsyncFunctionDef = _visit_function
+
+    def visit_Call(self, node: ast.Call) -> None:
+        func = node.func
+        owner = self._class[-1] if self._class else None
+        if isinstance(func, ast.Name):
+            self._calls.append((self._scope[-1], func.id, None))
+        elif isinstance(func, ast.Attribute) and isinstance(func.value, ast.Name) and func.value.id == "self":
+            self._calls.append((self._scope[-1], func.attr, owner))
+        self.generic_visit(node)
+
+    def build(self, tree: ast.AST) -> nx.DiGraph:
+        self.visit(tree)
+        for caller, name, owner in self._calls:
+            candidates = [f"method:{owner}.{name}"] if owner else []
+            candidates += [f"function:{name}", f"class:{name}"]
+            target = next((c for c in candidates if c in self.graph), None)
+            if target is None or target == caller:
+                continue
+            kind = "inherits" if caller.startswith("class:") and target.startswith("class:") else "calls"
+            if not self.graph.has_edge(caller, target):
+                self.graph.add_edge(caller, target, kind=kind)
+        return self.graph
+
+
+def build_code_graph(code: str) -> nx.DiGraph:
+    """Parse Python source into a graph of imports, classes, functions and calls.
+
+    Raises SyntaxError when `code` is not valid Python.
+    """
+    return _GraphBuilder().build(ast.parse(code))
+
+
+def layout(graph: nx.DiGraph) -> Dict[str, Tuple[float, float]]:
+    """Deterministic column layout: one column per node kind, rows in source order."""
+    rows: Dict[int, int] = {}
+    pos: Dict[str, Tuple[float, float]] = {}
+    for node_id, data in graph.nodes(data=True):
+        col = KIND_COLUMNS[data["kind"]]
+        row = rows.get(col, 0)
+        rows[col] = row + 1
+        pos[node_id] = (MARGIN + col * (BOX_W + COL_GAP), MARGIN + row * (BOX_H + ROW_GAP))
+    return pos
+
+
+def render_svg(graph: nx.DiGraph) -> bytes:
+    pos = layout(graph)
+    width = max((x for x, _ in pos.values()), default=0) + BOX_W + MARGIN
+    height = max((y for _, y in pos.values()), default=0) + BOX_H + MARGIN
+    out = io.StringIO()
+    out.write(
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{width:.0f}" height="{height:.0f}" '
+        'font-family="monospace" font-size="12">'
+        '<defs><marker id="arrow" viewBox="0 0 10 10" refX="10" refY="5" markerWidth="7" '
+        'markerHeight="7" orient="auto"><path d="M0,0 L10,5 L0,10 z" fill="#616161"/></marker></defs>'
+        '<rect width="100%" height="100%" fill="white"/>'
+    )
+    for src, dst, data in graph.edges(data=True):
+        (x1, y1), (x2, y2) = pos[src], pos[dst]
+        if x2 > x1:
+            x1, x2 = x1 + BOX_W, x2
+        elif x2 < x1:
+            x1, x2 = x1, x2 + BOX_W
+        else:
+            # same column: route along the right-hand side
+            x1 = x2 = x1 + BOX_W
+        out.write(
+            f'<line x1="{x1:.0f}" y1="{y1 + BOX_H / 2:.0f}" x2="{x2:.0f}" y2="{y2 + BOX_H / 2:.0f}" '
+            f'style="{EDGE_STYLES[data["kind"]]}" marker-end="url(#arrow)"/>'
+        )
+    for node_id, data in graph.nodes(data=True):
+        x, y = pos[node_id]
+        label = escape(data["label"] if len(data["label"]) <= 24 else data["label"][:23] + "…")
+        out.write(
+            f'<rect x="{x:.0f}" y="{y:.0f}" width="{BOX_W}" height="{BOX_H}" rx="5" '
+            f'fill="{KIND_COLORS[data["kind"]]}" stroke="#424242"/>'
+            f'<text x="{x + BOX_W / 2:.0f}" y="{y + BOX_H / 2 + 4:.0f}" text-anchor="middle">{label}</text>'
+        )
+    out.write("</svg>")
+    return out.getvalue().encode("utf-8")
+
+
+def render_png(graph: nx.DiGraph) -> bytes:
+    # matplotlib is optional; only needed when DIAGRAM_FORMAT=png
+    if importlib.util.find_spec("matplotlib") is None:
+        raise RuntimeError("PNG diagrams require matplotlib; install it or set DIAGRAM_FORMAT=svg")
+    import matplotlib
+
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    pos = {n: (x, -y) for n, (x, y) in layout(graph).items()}
+    kinds = nx.get_node_attributes(graph, "kind")
+    fig, ax = plt.subplots(figsize=(2 + 2.5 * len(set(kinds.values())), 1 + 0.5 * graph.number_of_nodes()))
+    nx.draw_networkx(
+        graph,
+        pos,
+        ax=ax,
+        labels=nx.get_node_attributes(graph, "label"),
+        node_color=[KIND_COLORS[kinds[n]] for n in graph.nodes],
+        node_shape="s",
+        node_size=2500,
+        font_size=8,
+        edge_color="#616161",
+    )
+    ax.set_axis_off()
+    buf = io.BytesIO()
+    fig.savefig(buf, format="png", bbox_inches="tight")
+    plt.close(fig)
+    return buf.getvalue()
+
+
+def render_code_diagram(code: str, fmt: str = "svg") -> bytes:
+    graph = build_code_graph(code)
+    return render_png(graph) if fmt == "png" else render_svg(graph)
@@ -0,0 +1,95 @@
+import argparse
+import json
+import sys
+import time
+from typing import Any, Dict, Iterator, List, Tuple
+
+from app.services.analysis import analyze_many
+
+
+def iter_db_code(batch_size: int = 1000, missing_only: bool = False) -> Iterator[Tuple[int, str]]:
+    """(id, generated_code) of every stored message, paged by id."""
+    from app.storage import db
+
+    last_id = 0
+    while True:
+        rows = db.fetch_code_since(last_id, batch_size, missing_analysis=missing_only)
+        if not rows:
+            return
+        yield from rows
+        last_id = rows[-1][0]
+
+
+def iter_jsonl_code(path: str, code_field: str = "code", id_field: str | None = None) -> Iterator[Tuple[Any, str]]:
+    """(id, code) of each JSONL record that has a string `code_field`; ids default to line numbers."""
+    with open(path, encoding="utf-8") as fh:
+        for lineno, line in enumerate(fh, start=1):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            code = record.get(code_field)
+            if isinstance(code, str):
+                yield (record.get(id_field, lineno) if id_field else lineno), code
+
+
+def main(argv: List[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="Analyse stored or exported code in bulk on a process pool.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--db", action="store_true", help="read generated_code from the chat history database")
+    source.add_argument("--jsonl", help="read code from this JSONL file")
+    parser.add_argument("--code-field", default="code", help="JSONL field holding the code")
+    parser.add_argument("--id-field", help="JSONL field used as the result id (default: line number)")
+    parser.add_argument("--missing-only", action="store_true", help="with --db, skip rows that already have analysis")
+    parser.add_argument("--write", action="store_true", help="with --db, store results in analysis_json")
+    parser.add_argument("--write-batch", type=int, default=500, help="rows per write-back transaction")
+    parser.add_argument("--output", help="write {id, analysis} JSONL here ('-' for stdout)")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: CPU count)")
+    parser.add_argument("--chunksize", type=int, default=64)
+    parser.add_argument("--unordered", action="store_true", help="emit results as chunks finish")
+    args = parser.parse_args(argv)
+    if args.write and not args.db:
+        parser.error("--write needs --db")
+
+    if args.db:
+        items: Iterator[Tuple[Any, str]] = iter_db_code(missing_only=args.missing_only)
+    else:
+        items = iter_jsonl_code(args.jsonl, args.code_field, args.id_field)
+    output_path = args.output or (None if args.write else "-")
+    out = None if output_path is None else sys.stdout if output_path == "-" else open(output_path, "w", encoding="utf-8")
+
+    analysed = written = 0
+    batch: List[Tuple[int, Dict[str, Any]]] = []
+    t0 = time.perf_counter()
+    try:
+        for key, analysis in analyze_many(
+            items, workers=args.workers, chunksize=args.chunksize, ordered=not args.unordered
+        ):
+            analysed += 1
+            if out is not None:
+                out.write(json.dumps({"id": key, "analysis": analysis}) + "\n")
+            if args.write:
+                batch.append((key, analysis))
+                if len(batch) >= args.write_batch:
+                    written += _write(batch)
+        if batch:
+            written += _write(batch)
+    finally:
+        if out is not None and out is not sys.stdout:
+            out.close()
+    seconds = time.perf_counter() - t0
+    summary = {"analysed": analysed, "written": written, "seconds": round(seconds, 3)}
+    if seconds > 0:
+        summary["per_second"] = round(analysed / seconds, 1)
+    print(json.dumps(summary), file=sys.stderr if output_path == "-" else sys.stdout)
+
+
+def _write(batch: List[Tuple[int, Dict[str, Any]]]) -> int:
+    from app.storage import db
+
+    count = db.update_analyses(batch)
+    batch.clear()
+    return count
+
+
+if __name__ == "__main__":
+    main()
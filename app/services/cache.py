@@ -0,0 +1,117 @@
+import asyncio
+import hashlib
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Tuple
+
+from app.config import settings
+from app.storage import db
+
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def normalize_prompt(prompt: str) -> str:
+    return _WHITESPACE_RE.sub(" ", prompt).strip()
+
+
+def make_cache_key(model_id: str, prompt: str, parameters: Dict[str, Any]) -> str:
+    material = json.dumps(
+        {"model": model_id, "prompt": normalize_prompt(prompt), "parameters": parameters},
+        sort_keys=True,
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """Two-tier cache for model responses: in-memory LRU in front of a SQLite table."""
+
+    def __init__(
+        self,
+        max_memory_entries: int = 256,
+        ttl_seconds: float = 86400.0,
+        max_disk_bytes: int = 64 * 1024 * 1024,
+        persistent: bool = True,
+    ) -> None:
+        self.max_memory_entries = max_memory_entries
+        self.ttl_seconds = ttl_seconds
+        self.max_disk_bytes = max_disk_bytes
+        self.persistent = persistent
+        self._memory: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0}
+
+    def get(self, key: str) -> str | None:
+        value = self._memory_get(key)
+        return value if value is not None else self._disk_get(key)
+
+    def put(self, key: str, model_id: str, value: str) -> None:
+        with self._lock:
+            self._remember(key, value, time.monotonic())
+        if self.persistent:
+            db.cache_put(key, model_id, value, self.max_disk_bytes)
+
+    async def aget(self, key: str) -> str | None:
+        """`get` for coroutines: the memory tier inline, the SQLite tier on a worker thread."""
+        value = self._memory_get(key)
+        if value is not None or not self.persistent:
+            return value if value is not None else self._disk_get(key)
+        return await asyncio.to_thread(self._disk_get, key)
+
+    async def aput(self, key: str, model_id: str, value: str) -> None:
+        with self._lock:
+            self._remember(key, value, time.monotonic())
+        if self.persistent:
+            await asyncio.to_thread(db.cache_put, key, model_id, value, self.max_disk_bytes)
+
+    def _memory_get(self, key: str) -> str | None:
+        with self._lock:
+            item = self._memory.get(key)
+            if item is not None:
+                value, stored_at = item
+                if time.monotonic() - stored_at <= self.ttl_seconds:
+                    self._memory.move_to_end(key)
+                    self._stats["memory_hits"] += 1
+                    return value
+                del self._memory[key]
+        return None
+
+    def _disk_get(self, key: str) -> str | None:
+        hit = db.cache_get(key, self.ttl_seconds) if self.persistent else None
+        with self._lock:
+            if hit is None:
+                self._stats["misses"] += 1
+                return None
+            value, age = hit
+            self._stats["disk_hits"] += 1
+            # promote with the entry's original write time so it still expires on schedule
+            self._remember(key, value, time.monotonic() - age)
+        return value
+
+    def _remember(self, key: str, value: str, stored_at: float) -> None:
+        self._memory[key] = (value, stored_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+            self._stats["evictions"] += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._memory.clear()
+        if self.persistent:
+            db.cache_clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {**self._stats, "memory_entries": len(self._memory)}
+
+
+response_cache = ResponseCache(
+    max_memory_entries=settings.response_cache_memory_entries,
+    ttl_seconds=settings.response_cache_ttl,
+    max_disk_bytes=settings.response_cache_max_bytes,
+)
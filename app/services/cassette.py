@@ -0,0 +1,166 @@
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List
+
+from app.config import settings
+from app.storage.blobs import BlobStore
+
+
+MODES = ("live", "record", "replay")
+
+
+class CassetteMiss(LookupError):
+    """Replay mode found no recording for a request."""
+
+
+def request_key(task: str, model_id: str, request: Any) -> str:
+    material = json.dumps(
+        {"task": task, "model": model_id, "request": request}, sort_keys=True, separators=(",", ":")
+    )
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+class Cassette:
+    """Recorded HF Inference API responses in a directory.
+
+    `interactions.jsonl` holds one line per recorded call: JSON responses inline,
+    streamed pieces with their arrival offsets, and image bytes as digests into a
+    content-addressed `blobs/` store. A key recorded twice keeps its latest line.
+    Replay sleeps for the recorded latency times `latency_scale` (0 = no waiting).
+    """
+
+    def __init__(self, root: str, latency_scale: float = 0.0) -> None:
+        self.root = root
+        self.latency_scale = latency_scale
+        self.index_path = os.path.join(root, "interactions.jsonl")
+        self.blobs = BlobStore(os.path.join(root, "blobs"))
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Dict[str, Any]] | None = None
+
+    def _load(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            if self._entries is None:
+                entries: Dict[str, Dict[str, Any]] = {}
+                if os.path.exists(self.index_path):
+                    with open(self.index_path, encoding="utf-8") as fh:
+                        for line in fh:
+                            if line.strip():
+                                entry = json.loads(line)
+                                entries[entry["key"]] = entry
+                self._entries = entries
+            return self._entries
+
+    def __len__(self) -> int:
+        return len(self._load())
+
+    def get(self, key: str) -> Dict[str, Any] | None:
+        return self._load().get(key)
+
+    def _append(self, entry: Dict[str, Any]) -> None:
+        entries = self._load()
+        line = json.dumps(entry, separators=(",", ":"))
+        with self._lock:
+            os.makedirs(self.root, exist_ok=True)
+            with open(self.index_path, "a", encoding="utf-8") as fh:
+                fh.write(line + "\n")
+            entries[entry["key"]] = entry
+
+    def _entry(self, key: str, task: str, model_id: str, latency: float, **response: Any) -> Dict[str, Any]:
+        return {"key": key, "task": task, "model": model_id, "latency_ms": round(latency * 1000, 3), **response}
+
+    def _lookup(self, key: str, task: str, model_id: str) -> Dict[str, Any]:
+        entry = self.get(key)
+        if entry is None:
+            raise CassetteMiss(
+                f"no recorded {task} response for {model_id} in {self.root}; record it with HF_CLIENT_MODE=record"
+            )
+        return entry
+
+    # file reads and writes run on worker threads, never on the caller's event loop
+
+    async def _lookup_async(self, key: str, task: str, model_id: str) -> Dict[str, Any]:
+        return await asyncio.to_thread(self._lookup, key, task, model_id)
+
+    async def _append_async(self, entry: Dict[str, Any]) -> None:
+        await asyncio.to_thread(self._append, entry)
+
+    async def _wait(self, ms: float) -> None:
+        if self.latency_scale > 0 and ms > 0:
+            await asyncio.sleep(ms * self.latency_scale / 1000)
+
+    async def record_json(
+        self, task: str, model_id: str, request: Any, call: Callable[[], Awaitable[Any]]
+    ) -> Any:
+        key = request_key(task, model_id, request)
+        start = time.perf_counter()
+        result = await call()
+        await self._append_async(self._entry(key, task, model_id, time.perf_counter() - start, json=result))
+        return result
+
+    async def replay_json(self, task: str, model_id: str, request: Any) -> Any:
+        entry = await self._lookup_async(request_key(task, model_id, request), task, model_id)
+        await self._wait(entry["latency_ms"])
+        return entry["json"]
+
+    async def record_bytes(
+        self, task: str, model_id: str, request: Any, call: Callable[[], Awaitable[bytes]]
+    ) -> bytes:
+        key = request_key(task, model_id, request)
+        start = time.perf_counter()
+        data = await call()
+        latency = time.perf_counter() - start
+        digest = await asyncio.to_thread(self.blobs.put, data)
+        await self._append_async(self._entry(key, task, model_id, latency, blob=digest))
+        return data
+
+    async def replay_bytes(self, task: str, model_id: str, request: Any) -> bytes:
+        entry = await self._lookup_async(request_key(task, model_id, request), task, model_id)
+        data = await asyncio.to_thread(self.blobs.get, entry["blob"])
+        if data is None:
+            raise CassetteMiss(f"blob {entry['blob']} of a recorded {task} response is missing from {self.root}")
+        await self._wait(entry["latency_ms"])
+        return data
+
+    async def record_stream(
+        self, task: str, model_id: str, request: Any, stream: AsyncIterator[str]
+    ) -> AsyncIterator[str]:
+        key = request_key(task, model_id, request)
+        start = time.perf_counter()
+        chunks: List[List[Any]] = []
+        async for piece in stream:
+            chunks.append([round((time.perf_counter() - start) * 1000, 3), piece])
+            yield piece
+        # only complete streams are recorded
+        await self._append_async(self._entry(key, task, model_id, time.perf_counter() - start, chunks=chunks))
+
+    async def replay_stream(self, task: str, model_id: str, request: Any) -> AsyncIterator[str]:
+        entry = await self._lookup_async(request_key(task, model_id, request), task, model_id)
+        elapsed = 0.0
+        for offset, piece in entry["chunks"]:
+            await self._wait(offset - elapsed)
+            elapsed = offset
+            yield piece
+        await self._wait(entry["latency_ms"] - elapsed)
+
+
+_cassette: Cassette | None = None
+_cassette_lock = threading.Lock()
+
+
+def cassette_dir() -> str:
+    return settings.hf_cassette_dir or os.path.join(os.path.dirname(settings.database_path), "cassettes")
+
+
+def get_cassette() -> Cassette:
+    """The shared cassette at HF_CASSETTE_DIR (default: `cassettes` next to the database)."""
+    global _cassette
+    root = cassette_dir()
+    with _cassette_lock:
+        if _cassette is None or _cassette.root != root:
+            _cassette = Cassette(root)
+        _cassette.latency_scale = settings.hf_replay_latency_scale
+        return _cassette
@@ -1,30 +1,56 @@
-from typing import Dict, Any
+import asyncio
+from typing import AsyncIterator, Dict, Any, Sequence
 
 from app.config import settings
+from app.metrics.metrics import RESPONSE_CACHE_LOOKUPS, stage_timer
+from app.metrics.tracing import span
+from app.services.cache import make_cache_key, response_cache
 from app.services.hf_clients import HFInferenceClient
+from app.services.local_inference import local_model_id, local_text_generation, register_prompt_prefix
+from app.services.retrieval import get_retriever
+from app.services.singleflight import SingleFlight
 
 
 SYSTEM_PROMPT = (
     "You are a code generation assistant. Generate clean, runnable code with brief comments."
 )
 
+GENERATION_PARAMETERS: Dict[str, Any] = {
+    "max_new_tokens": 512,
+    "temperature": 0.2,
+    "top_p": 0.9,
+    "return_full_text": False,
+}
 
-def build_codegen_prompt(user_prompt: str) -> str:
-    return f"{SYSTEM_PROMPT}\n\nUser request:\n{user_prompt}\n\nProvide only code when appropriate."
+EXAMPLES_HEADER = "Relevant examples from earlier requests:\n"
+REQUEST_HEADER = "User request:\n"
 
+# every codegen prompt starts with one of these; the local backend prefills them once
+register_prompt_prefix(
+    f"{SYSTEM_PROMPT}\n\n",
+    f"{SYSTEM_PROMPT}\n\n{EXAMPLES_HEADER}",
+    f"{SYSTEM_PROMPT}\n\n{REQUEST_HEADER}",
+)
 
-async def generate_code(user_prompt: str) -> str:
-    client = HFInferenceClient()
-    payload: Dict[str, Any] = {
-        "inputs": build_codegen_prompt(user_prompt),
-        "parameters": {
-            "max_new_tokens": 512,
-            "temperature": 0.2,
-            "top_p": 0.9,
-            "return_full_text": False,
-        },
-    }
-    result = await client.text_generation(settings.code_model_id, payload)
+_inflight = SingleFlight()
+
+
+def build_codegen_prompt(user_prompt: str, examples: Sequence[str] | None = None) -> str:
+    context = ""
+    if examples:
+        blocks = "\n\n".join(f"```\n{e.strip()}\n```" for e in examples)
+        context = f"{EXAMPLES_HEADER}{blocks}\n\n"
+    return f"{SYSTEM_PROMPT}\n\n{context}{REQUEST_HEADER}{user_prompt}\n\nProvide only code when appropriate."
+
+
+async def _retrieve_examples(user_prompt: str) -> list[str]:
+    if not settings.retrieval_enabled:
+        return []
+    # index search and the snippet lookup are blocking; keep them off the shared event loop
+    return await asyncio.to_thread(lambda: get_retriever().retrieve(user_prompt, settings.retrieval_top_k))
+
+
+def extract_generated_text(result: Any) -> str:
     # HF text generation response may vary; handle common structures
     if isinstance(result, list) and result and "generated_text" in result[0]:
         return result[0]["generated_text"]
@@ -34,5 +60,73 @@ async def generate_code(user_prompt: str) -> str:
     return str(result)
 
 
+def codegen_model_id() -> str:
+    """Model of the configured backend; part of cache keys and metric labels."""
+    return local_model_id() if settings.codegen_backend == "local" else settings.code_model_id
+
+
+async def _request_code(prompt: str, key: str) -> str:
+    if settings.codegen_backend == "local":
+        code = await local_text_generation(prompt, GENERATION_PARAMETERS)
+    else:
+        client = HFInferenceClient()
+        payload: Dict[str, Any] = {
+            "inputs": prompt,
+            "parameters": dict(GENERATION_PARAMETERS),
+        }
+        result = await client.text_generation(settings.code_model_id, payload)
+        code = extract_generated_text(result)
+    if settings.response_cache_enabled:
+        await response_cache.aput(key, codegen_model_id(), code)
+    return code
+
+
+async def _cached(key: str) -> str | None:
+    if not settings.response_cache_enabled:
+        return None
+    cached = await response_cache.aget(key)
+    RESPONSE_CACHE_LOOKUPS.inc(result="miss" if cached is None else "hit")
+    return cached
+
+
+async def generate_code(user_prompt: str) -> str:
+    model_id = codegen_model_id()
+    with stage_timer("codegen", model_id), span("generate_code", model=model_id):
+        prompt = build_codegen_prompt(user_prompt, await _retrieve_examples(user_prompt))
+        key = make_cache_key(model_id, prompt, GENERATION_PARAMETERS)
+        cached = await _cached(key)
+        if cached is not None:
+            return cached
+
+        # identical prompts submitted concurrently share one upstream call
+        return await _inflight.do(key, lambda: _request_code(prompt, key))
+
+
+async def generate_code_stream(user_prompt: str) -> AsyncIterator[str]:
+    """Like `generate_code`, but yields text pieces as they arrive from the API.
 
+    The local backend generates in batches, so it yields the whole completion at once.
+    """
+    model_id = codegen_model_id()
+    with stage_timer("codegen", model_id), span("generate_code_stream", model=model_id):
+        prompt = build_codegen_prompt(user_prompt, await _retrieve_examples(user_prompt))
+        key = make_cache_key(model_id, prompt, GENERATION_PARAMETERS)
+        cached = await _cached(key)
+        if cached is not None:
+            yield cached
+            return
+        if settings.codegen_backend == "local":
+            yield await _inflight.do(key, lambda: _request_code(prompt, key))
+            return
 
+        client = HFInferenceClient()
+        payload: Dict[str, Any] = {
+            "inputs": prompt,
+            "parameters": dict(GENERATION_PARAMETERS),
+        }
+        parts: list[str] = []
+        async for piece in client.text_generation_stream(settings.code_model_id, payload):
+            parts.append(piece)
+            yield piece
+        if settings.response_cache_enabled:
+            await response_cache.aput(key, settings.code_model_id, "".join(parts))
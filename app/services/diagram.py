@@ -1,5 +1,13 @@
 from app.config import settings
+from app.metrics.metrics import stage_timer
+from app.metrics.tracing import span
+from app.services.ast_diagram import render_code_diagram
+from app.services.cache import make_cache_key
 from app.services.hf_clients import HFInferenceClient
+from app.services.singleflight import SingleFlight
+
+
+_inflight = SingleFlight()
 
 
 def build_diagram_prompt(user_prompt: str, generated_code: str | None) -> str:
@@ -12,12 +20,35 @@ def build_diagram_prompt(user_prompt: str, generated_code: str | None) -> str:
     )
 
 
-async def generate_diagram(user_prompt: str, generated_code: str | None) -> bytes:
+async def _request_diagram(prompt: str) -> bytes:
     client = HFInferenceClient()
-    prompt = build_diagram_prompt(user_prompt, generated_code)
-    image_bytes = await client.text_to_image(settings.diffusion_model_id, prompt)
-    return image_bytes
+    return await client.text_to_image(settings.diffusion_model_id, prompt)
 
 
+def _render_local(generated_code: str | None) -> bytes | None:
+    if not generated_code:
+        return None
+    try:
+        return render_code_diagram(generated_code, settings.diagram_format)
+    except SyntaxError:
+        # not Python (or truncated output): nothing to parse
+        return None
 
 
+async def generate_diagram(user_prompt: str, generated_code: str | None) -> bytes:
+    if settings.diagram_backend == "ast":
+        with stage_timer("diagram", "ast"), span("generate_diagram", backend="ast"):
+            local = _render_local(generated_code)
+            if local is None and not settings.diagram_fallback_sd:
+                # an empty module diagram instead of a Stable Diffusion call
+                local = render_code_diagram("", settings.diagram_format)
+        if local is not None:
+            return local
+
+    with stage_timer("diagram", settings.diffusion_model_id), span(
+        "generate_diagram", model=settings.diffusion_model_id
+    ):
+        prompt = build_diagram_prompt(user_prompt, generated_code)
+        key = make_cache_key(settings.diffusion_model_id, prompt, {})
+        image_bytes = await _inflight.do(key, lambda: _request_diagram(prompt))
+        return image_bytes
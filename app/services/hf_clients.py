@@ -1,36 +1,151 @@
+import asyncio
 import base64
-from typing import Dict, Any
+import importlib.util
+import json
+import time
+import weakref
+from typing import AsyncIterator, Dict, Any
 import httpx
 
 from app.config import settings
+from app.metrics.metrics import FIRST_TOKEN_SECONDS, model_timer
+from app.metrics.tracing import span
+from app.services.cassette import MODES, Cassette, get_cassette
 
 
-HF_API_URL = "https://api-inference.huggingface.co/models"
+HF_API_URL = settings.hf_api_url
+
+# One pooled client per event loop: httpx connections cannot be shared across loops.
+_http_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def _http2_enabled() -> bool:
+    # HTTP/2 needs the optional `h2` package (httpx[http2]); fall back to HTTP/1.1 without it
+    return settings.hf_http2 and importlib.util.find_spec("h2") is not None
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """Return the process-wide pooled client for the running event loop."""
+    loop = asyncio.get_running_loop()
+    client = _http_clients.get(loop)
+    if client is None or client.is_closed:
+        limits = httpx.Limits(
+            max_connections=settings.hf_max_connections,
+            max_keepalive_connections=settings.hf_max_keepalive_connections,
+            keepalive_expiry=settings.hf_keepalive_expiry,
+        )
+        client = httpx.AsyncClient(limits=limits, http2=_http2_enabled(), timeout=60)
+        _http_clients[loop] = client
+    return client
+
+
+async def aclose_http_client() -> None:
+    """Close the pooled client of the running event loop, if any."""
+    client = _http_clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
 
 
 class HFInferenceClient:
-    def __init__(self, token: str | None = None) -> None:
+    """Client for the HF Inference API.
+
+    `mode` (default HF_CLIENT_MODE) is "live", "record" (call the API and save each
+    response to the cassette) or "replay" (answer from the cassette, no network).
+    """
+
+    def __init__(
+        self,
+        token: str | None = None,
+        client: httpx.AsyncClient | None = None,
+        base_url: str | None = None,
+        mode: str | None = None,
+        cassette: Cassette | None = None,
+    ) -> None:
         self.token = token or settings.hf_token
         self.headers = {"Authorization": f"Bearer {self.token}"} if self.token else {}
+        self.base_url = (base_url or settings.hf_api_url).rstrip("/")
+        self.mode = mode or settings.hf_client_mode
+        if self.mode not in MODES:
+            raise ValueError(f"HF client mode must be one of {', '.join(MODES)}, got {self.mode!r}")
+        if cassette is None and self.mode != "live":
+            cassette = get_cassette()
+        self.cassette = cassette
+        self._client = client
+
+    @property
+    def http(self) -> httpx.AsyncClient:
+        return self._client or get_http_client()
 
     async def text_generation(self, model_id: str, payload: Dict[str, Any]) -> Dict[str, Any]:
-        url = f"{HF_API_URL}/{model_id}"
-        async with httpx.AsyncClient(timeout=60) as client:
-            resp = await client.post(url, headers=self.headers, json=payload)
+        task = "text-generation"
+        with model_timer(model_id, task), span(f"hf.{task}", model=model_id):
+            if self.mode == "replay":
+                return await self.cassette.replay_json(task, model_id, payload)
+            if self.mode == "record":
+                return await self.cassette.record_json(
+                    task, model_id, payload, lambda: self._post_json(model_id, payload)
+                )
+            return await self._post_json(model_id, payload)
+
+    async def _post_json(self, model_id: str, payload: Dict[str, Any]) -> Any:
+        resp = await self.http.post(f"{self.base_url}/{model_id}", headers=self.headers, json=payload, timeout=60)
+        resp.raise_for_status()
+        return resp.json()
+
+    async def text_generation_stream(self, model_id: str, payload: Dict[str, Any]) -> AsyncIterator[str]:
+        """Yield generated text pieces as the API emits them (server-sent events)."""
+        task = "text-generation-stream"
+        start = time.perf_counter()
+        first = True
+        with model_timer(model_id, task), span(f"hf.{task}", model=model_id):
+            if self.mode == "replay":
+                pieces = self.cassette.replay_stream(task, model_id, payload)
+            else:
+                pieces = self._stream_live(model_id, payload)
+                if self.mode == "record":
+                    pieces = self.cassette.record_stream(task, model_id, payload, pieces)
+            async for text in pieces:
+                if first:
+                    FIRST_TOKEN_SECONDS.observe(time.perf_counter() - start, model=model_id)
+                    first = False
+                yield text
+
+    async def _stream_live(self, model_id: str, payload: Dict[str, Any]) -> AsyncIterator[str]:
+        async with self.http.stream(
+            "POST", f"{self.base_url}/{model_id}", headers=self.headers, json={**payload, "stream": True}, timeout=60
+        ) as resp:
             resp.raise_for_status()
-            return resp.json()
+            async for line in resp.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                event = json.loads(line[len("data:"):])
+                if "error" in event:
+                    raise httpx.HTTPError(str(event["error"]))
+                token = event.get("token") or {}
+                if token.get("special"):
+                    continue
+                text = token.get("text")
+                if text:
+                    yield text
 
     async def text_to_image(self, model_id: str, prompt: str) -> bytes:
-        url = f"{HF_API_URL}/{model_id}"
-        async with httpx.AsyncClient(timeout=120) as client:
-            resp = await client.post(url, headers=self.headers, data=prompt)
-            resp.raise_for_status()
-            return resp.content
+        task = "text-to-image"
+        with model_timer(model_id, task), span(f"hf.{task}", model=model_id):
+            if self.mode == "replay":
+                return await self.cassette.replay_bytes(task, model_id, prompt)
+            if self.mode == "record":
+                return await self.cassette.record_bytes(
+                    task, model_id, prompt, lambda: self._post_image(model_id, prompt)
+                )
+            return await self._post_image(model_id, prompt)
+
+    async def _post_image(self, model_id: str, prompt: str) -> bytes:
+        resp = await self.http.post(f"{self.base_url}/{model_id}", headers=self.headers, content=prompt, timeout=120)
+        resp.raise_for_status()
+        return resp.content
 
     @staticmethod
     def image_bytes_to_base64(image_bytes: bytes) -> str:
         return base64.b64encode(image_bytes).decode("utf-8")
-
-
-
-
@@ -0,0 +1,126 @@
+import atexit
+import logging
+import threading
+
+from app.config import settings
+from app.services.diagram import generate_diagram
+from app.services.hf_clients import HFInferenceClient
+from app.services.runtime import run_sync
+from app.storage.db import (
+    claim_diagram_job,
+    complete_diagram_job,
+    enqueue_diagram_job,
+    fail_diagram_job,
+    heartbeat_diagram_jobs,
+    requeue_running_jobs,
+)
+
+
+_logger = logging.getLogger(__name__)
+
+
+class DiagramWorkerPool:
+    """Worker threads that drain the SQLite-backed `diagram_jobs` queue.
+
+    Jobs survive restarts and are safe to share between processes: a claim is a
+    lease that a heartbeat thread renews while the job runs, and a `running` job
+    whose lease has lapsed (its worker crashed) is requeued on start and every
+    heartbeat, so jobs still running elsewhere are left alone.
+    """
+
+    def __init__(
+        self, workers: int = 2, poll_interval: float = 1.0, max_attempts: int = 3, lease_seconds: float = 120.0
+    ) -> None:
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.lease_seconds = lease_seconds
+        self._threads: list[threading.Thread] = []
+        self._heartbeat: threading.Thread | None = None
+        self._running: set[int] = set()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+
+    def start(self) -> None:
+        """Start the workers, replacing any that have died; a no-op while all are running."""
+        with self._lock:
+            if not self._threads:
+                self._stopping.clear()
+                requeue_running_jobs(self.lease_seconds)
+            self._threads = [t for t in self._threads if t.is_alive()]
+            for i in range(len(self._threads), self.workers):
+                thread = threading.Thread(target=self._work, name=f"diagram-worker-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            if self._heartbeat is None or not self._heartbeat.is_alive():
+                self._heartbeat = threading.Thread(target=self._beat, name="diagram-heartbeat", daemon=True)
+                self._heartbeat.start()
+
+    def stop(self, timeout: float = 5.0) -> None:
+        with self._lock:
+            threads, self._threads = self._threads, []
+            if self._heartbeat is not None:
+                threads.append(self._heartbeat)
+                self._heartbeat = None
+        self._stopping.set()
+        self._wakeup.set()
+        for thread in threads:
+            thread.join(timeout)
+
+    def notify(self) -> None:
+        self._wakeup.set()
+
+    def run_once(self) -> bool:
+        """Process one queued job; return False when the queue is empty."""
+        job = claim_diagram_job()
+        if job is None:
+            return False
+        with self._lock:
+            self._running.add(job["id"])
+        try:
+            diagram_bytes = run_sync(generate_diagram(job["user_prompt"], job["generated_code"]))
+            complete_diagram_job(job["id"], HFInferenceClient.image_bytes_to_base64(diagram_bytes))
+        except Exception as exc:
+            fail_diagram_job(job["id"], str(exc), self.max_attempts)
+        finally:
+            with self._lock:
+                self._running.discard(job["id"])
+        return True
+
+    def _work(self) -> None:
+        while not self._stopping.is_set():
+            try:
+                if self.run_once():
+                    continue
+            except Exception:
+                # e.g. "database is locked" while claiming; back off and keep the worker alive
+                _logger.exception("diagram worker iteration failed")
+            self._wakeup.wait(self.poll_interval)
+            self._wakeup.clear()
+
+    def _beat(self) -> None:
+        while not self._stopping.wait(self.lease_seconds / 3):
+            try:
+                with self._lock:
+                    running = list(self._running)
+                heartbeat_diagram_jobs(running)
+                if requeue_running_jobs(self.lease_seconds):
+                    self._wakeup.set()
+            except Exception:
+                _logger.exception("diagram job heartbeat failed")
+
+
+pool = DiagramWorkerPool(
+    workers=settings.diagram_workers,
+    max_attempts=settings.diagram_job_max_attempts,
+    lease_seconds=settings.diagram_job_lease_s,
+)
+atexit.register(pool.stop)
+
+
+def submit_diagram_job(message_id: int, user_prompt: str, generated_code: str | None) -> int:
+    job_id = enqueue_diagram_job(message_id, user_prompt, generated_code)
+    pool.start()
+    pool.notify()
+    return job_id
@@ -0,0 +1,404 @@
+import asyncio
+import atexit
+import json
+import queue
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future, InvalidStateError
+from typing import Any, Callable, Dict, List, Protocol, Sequence, Tuple
+
+from app.config import settings
+from app.metrics.metrics import LOCAL_BATCH_SIZE, stage_timer
+from app.metrics.tracing import span
+
+
+# generate() keyword arguments understood by the local runners
+_GENERATE_KEYS = ("max_new_tokens", "temperature", "top_p")
+
+
+class BatchRunner(Protocol):
+    def generate(self, prompts: Sequence[str], **parameters: Any) -> List[str]:
+        """Completions (without the prompt) for a batch of prompts sharing `parameters`."""
+        ...
+
+
+# prompt beginnings shared by many requests (system prompt, task templates), see register_prompt_prefix
+_PROMPT_PREFIXES: List[str] = []
+
+
+def register_prompt_prefix(*prefixes: str) -> None:
+    """Mark prompt beginnings whose key/value cache is worth computing once and reusing."""
+    for prefix in prefixes:
+        if prefix and prefix not in _PROMPT_PREFIXES:
+            _PROMPT_PREFIXES.append(prefix)
+
+
+def shared_prefix(prompts: Sequence[str], prefixes: Sequence[str]) -> str | None:
+    """The longest of `prefixes` that every prompt starts with and continues past, if any."""
+    best = None
+    for prefix in prefixes:
+        if (best is None or len(prefix) > len(best)) and all(
+            len(p) > len(prefix) and p.startswith(prefix) for p in prompts
+        ):
+            best = prefix
+    return best
+
+
+def common_prefix_length(a: Sequence[int], b: Sequence[int]) -> int:
+    n = 0
+    for x, y in zip(a, b):
+        if x != y:
+            break
+        n += 1
+    return n
+
+
+def prefix_layout(
+    prefix_ids: Sequence[int], prompt_ids: Sequence[Sequence[int]], pad_token_id: int
+) -> Tuple[List[List[int]], List[List[int]]] | None:
+    """Batch rows (and attention masks) that continue a cached `prefix_ids`, or None if they cannot.
+
+    Every prompt's own tokenization must start with `prefix_ids` and go on past
+    them. The prefix sits at the same positions in every row, so padding goes
+    between it and each suffix; masked pads do not advance the position ids
+    generate() derives from the mask.
+    """
+    k = len(prefix_ids)
+    if not k or any(len(ids) <= k or list(ids[:k]) != list(prefix_ids) for ids in prompt_ids):
+        return None
+    width = max(len(ids) for ids in prompt_ids) - k
+    rows, masks = [], []
+    for ids in prompt_ids:
+        pad = width - (len(ids) - k)
+        rows.append([*prefix_ids, *[pad_token_id] * pad, *ids[k:]])
+        masks.append([1] * k + [0] * pad + [1] * (len(ids) - k))
+    return rows, masks
+
+
+class PrefixCache:
+    """A bounded LRU of prefilled prompt prefixes (token ids and the model's key/value cache).
+
+    Only the scheduler's worker thread touches it, so it takes no lock.
+    """
+
+    def __init__(self, max_entries: int = 8) -> None:
+        self.max_entries = max_entries
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+        self._entries: "OrderedDict[str, Any]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, prefix: str, compute: Callable[[str], Any]) -> Any:
+        if prefix in self._entries:
+            self.stats["hits"] += 1
+            self._entries.move_to_end(prefix)
+            return self._entries[prefix]
+        self.stats["misses"] += 1
+        value = compute(prefix)
+        if self.max_entries > 0:
+            self._entries[prefix] = value
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.stats["evictions"] += 1
+        return value
+
+
+class TransformersRunner:
+    """A causal LM (with an optional LoRA adapter) kept resident for batched `model.generate`.
+
+    The adapter is merged into the base weights at load, so forward passes carry
+    no adapter overhead. `quantize="int8"` applies dynamic int8 quantization to the
+    Linear layers for CPU serving. torch, transformers and peft are imported here
+    only, so the app runs without them unless the local backend is selected.
+
+    When every prompt of a batch starts with a registered prefix (the codegen
+    system prompt and templates), the prefix is prefilled once, kept in a
+    `PrefixCache` of `prefix_cache_entries` entries, and only the rest of each
+    prompt is run through the model. `prefix_cache_entries=0` turns this off.
+
+    With a `draft_model` (a small model sharing the tokenizer), decoding is
+    speculative: the draft proposes `draft_lookahead` tokens and the main model
+    verifies them in one forward pass. Greedy outputs are unchanged. Assisted
+    generation takes one sequence at a time, so batches then run row by row.
+    """
+
+    def __init__(
+        self,
+        base_model: str,
+        lora_dir: str | None = None,
+        quantize: str | None = None,
+        prefix_cache_entries: int = 8,
+        draft_model: str | None = None,
+        draft_lookahead: int = 5,
+    ) -> None:
+        import torch
+        from transformers import AutoModelForCausalLM, AutoTokenizer
+
+        if quantize not in (None, "", "int8"):
+            raise ValueError(f"unsupported LOCAL_QUANTIZE {quantize!r}; use int8 or leave it empty")
+        self.torch = torch
+        self.tokenizer = AutoTokenizer.from_pretrained(lora_dir or base_model)
+        if self.tokenizer.pad_token is None:
+            self.tokenizer.pad_token = self.tokenizer.eos_token
+        # decoder-only models continue from the last position: pad on the left
+        self.tokenizer.padding_side = "left"
+        half = torch.cuda.is_available() and not quantize
+        model = AutoModelForCausalLM.from_pretrained(base_model, torch_dtype=torch.float16 if half else torch.float32)
+        if lora_dir:
+            from peft import PeftModel
+
+            model = PeftModel.from_pretrained(model, lora_dir).merge_and_unload()
+        if quantize == "int8":
+            # quantized kernels are CPU-only
+            self.device = "cpu"
+            model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        else:
+            self.device = "cuda" if torch.cuda.is_available() else "cpu"
+        self.model = model.to(self.device).eval()
+        self.draft = None
+        if draft_model:
+            draft = AutoModelForCausalLM.from_pretrained(draft_model, torch_dtype=self.model.dtype)
+            # a fixed lookahead, rather than transformers' adaptive default
+            draft.generation_config.num_assistant_tokens = draft_lookahead
+            draft.generation_config.num_assistant_tokens_schedule = "constant"
+            self.draft = draft.to(self.device).eval()
+        self.prefix_cache = PrefixCache(prefix_cache_entries) if prefix_cache_entries > 0 else None
+
+    def generate(self, prompts: Sequence[str], **parameters: Any) -> List[str]:
+        if self.draft is not None:
+            texts: List[str] = []
+            for prompt in prompts:
+                inputs = self.tokenizer(prompt, return_tensors="pt").to(self.device)
+                texts += self._generate(inputs["input_ids"], inputs["attention_mask"], None, parameters, self.draft)
+            return texts
+        prefix = shared_prefix(prompts, _PROMPT_PREFIXES) if self.prefix_cache is not None else None
+        if prefix is not None:
+            texts = self._generate_after_prefix(prefix, prompts, parameters)
+            if texts is not None:
+                return texts
+        inputs = self.tokenizer(list(prompts), return_tensors="pt", padding=True).to(self.device)
+        return self._generate(inputs["input_ids"], inputs["attention_mask"], None, parameters)
+
+    def _prefill(self, prefix: str, prompt_ids: Sequence[int]) -> Tuple[List[int], Any]:
+        # byte-level BPE merges differently at the end of a prefix alone ("\n\n" is one token there, but
+        # "\n", "\n" before text), so keep only the leading tokens a full prompt's tokenization shares
+        ids = self.tokenizer(prefix)["input_ids"]
+        ids = ids[:common_prefix_length(ids, prompt_ids)]
+        if not ids:
+            return ids, None
+        with self.torch.inference_mode():
+            past = self.model(input_ids=self.torch.tensor([ids], device=self.device), use_cache=True).past_key_values
+        # stored as plain tensors; every batch gets its own expanded copy, as generate() appends to it
+        return ids, past.to_legacy_cache() if hasattr(past, "to_legacy_cache") else past
+
+    def _generate_after_prefix(self, prefix: str, prompts: Sequence[str], parameters: Dict[str, Any]):
+        from transformers import DynamicCache
+
+        torch = self.torch
+        prompt_ids = self.tokenizer(list(prompts))["input_ids"]
+        prefix_ids, past = self.prefix_cache.get(prefix, lambda p: self._prefill(p, prompt_ids[0]))
+        layout = prefix_layout(prefix_ids, prompt_ids, self.tokenizer.pad_token_id)
+        if layout is None:
+            return None
+        rows, masks = layout
+        n = len(prompts)
+        cache = DynamicCache.from_legacy_cache(
+            tuple((k.expand(n, -1, -1, -1).contiguous(), v.expand(n, -1, -1, -1).contiguous()) for k, v in past)
+        )
+        input_ids = torch.tensor(rows, device=self.device)
+        return self._generate(input_ids, torch.tensor(masks, device=self.device), cache, parameters)
+
+    def _generate(
+        self, input_ids, attention_mask, past_key_values, parameters: Dict[str, Any], assistant_model=None
+    ) -> List[str]:
+        temperature = parameters.get("temperature") or 0.0
+        with self.torch.inference_mode():
+            outputs = self.model.generate(
+                input_ids=input_ids,
+                attention_mask=attention_mask,
+                past_key_values=past_key_values,
+                max_new_tokens=parameters.get("max_new_tokens", 256),
+                do_sample=temperature > 0,
+                temperature=temperature or None,
+                top_p=parameters.get("top_p") if temperature > 0 else None,
+                pad_token_id=self.tokenizer.pad_token_id,
+                assistant_model=assistant_model,
+            )
+        # every row's prompt ends at the same column
+        completions = outputs[:, input_ids.shape[1]:]
+        return self.tokenizer.batch_decode(completions, skip_special_tokens=True)
+
+
+_Request = Tuple[str, Dict[str, Any], "Future[str]"]
+
+
+class BatchScheduler:
+    """Collect concurrent generation requests into batches for one `runner.generate` call.
+
+    A single worker thread owns the model. It takes the first waiting request,
+    then keeps collecting requests with the same generation parameters until the
+    batch holds `max_batch_size` prompts or `max_wait` seconds have passed since
+    the first one arrived. Requests with other parameters wait for a later batch.
+
+    `runner` may also be a zero-argument callable that builds the runner; it is
+    then called on the worker thread before the first batch, so loading a model
+    never blocks the caller. If it fails, every request fails with that error.
+    """
+
+    def __init__(
+        self,
+        runner: "BatchRunner | Callable[[], BatchRunner]",
+        max_batch_size: int = 8,
+        max_wait: float = 0.02,
+    ) -> None:
+        # a class (e.g. TransformersRunner) or function is a factory; an instance is the runner
+        factory = isinstance(runner, type) or not hasattr(runner, "generate")
+        self.runner: BatchRunner | None = None if factory else runner
+        self._runner_factory = runner if factory else None
+        self._load_error: BaseException | None = None
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.stats = {"requests": 0, "batches": 0}
+        self._queue: "queue.Queue[_Request | None]" = queue.Queue()
+        self._deferred: "deque[_Request]" = deque()
+        self._thread: threading.Thread | None = None
+        self._lock = threading.Lock()
+
+    def start(self) -> None:
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="local-inference", daemon=True)
+                self._thread.start()
+
+    def submit(self, prompt: str, parameters: Dict[str, Any] | None = None) -> "Future[str]":
+        self.start()
+        future: "Future[str]" = Future()
+        self._queue.put((prompt, dict(parameters or {}), future))
+        return future
+
+    async def generate(self, prompt: str, parameters: Dict[str, Any] | None = None) -> str:
+        return await asyncio.wrap_future(self.submit(prompt, parameters))
+
+    def close(self) -> None:
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is None or not thread.is_alive():
+            return
+        self._queue.put(None)
+        thread.join()
+
+    def _next(self, timeout: float | None) -> "_Request | None":
+        if self._deferred:
+            return self._deferred.popleft()
+        return self._queue.get(timeout=timeout)
+
+    def _run(self) -> None:
+        while True:
+            first = self._next(None)
+            if first is None:
+                return
+            key = json.dumps(first[1], sort_keys=True, default=str)
+            batch = [first]
+            deadline = time.monotonic() + self.max_wait
+            skipped: List[_Request] = []
+            stop = False
+            while len(batch) < self.max_batch_size:
+                try:
+                    nxt = self._next(max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if nxt is None:
+                    stop = True
+                    break
+                if json.dumps(nxt[1], sort_keys=True, default=str) == key:
+                    batch.append(nxt)
+                else:
+                    skipped.append(nxt)
+            # keep arrival order for the requests that did not fit this batch
+            self._deferred.extendleft(reversed(skipped))
+            self._generate(batch)
+            if stop:
+                for _, _, future in self._deferred:
+                    _resolve(future, exception=RuntimeError("local inference scheduler closed"))
+                self._deferred.clear()
+                return
+
+    def _load(self) -> BatchRunner:
+        if self.runner is None:
+            if self._load_error is None:
+                try:
+                    self.runner = self._runner_factory()
+                except Exception as exc:
+                    self._load_error = exc
+            if self._load_error is not None:
+                raise RuntimeError(f"local model failed to load: {self._load_error}") from self._load_error
+        return self.runner
+
+    def _generate(self, batch: List[_Request]) -> None:
+        # requests cancelled while queued (the caller went away) are not generated at all
+        batch = [request for request in batch if request[2].set_running_or_notify_cancel()]
+        if not batch:
+            return
+        prompts = [prompt for prompt, _, _ in batch]
+        parameters = {k: v for k, v in batch[0][1].items() if k in _GENERATE_KEYS}
+        self.stats["requests"] += len(batch)
+        self.stats["batches"] += 1
+        LOCAL_BATCH_SIZE.observe(len(batch))
+        try:
+            runner = self._load()
+            with stage_timer("local_generate", settings.local_base_model):
+                texts = runner.generate(prompts, **parameters)
+        except Exception as exc:
+            for _, _, future in batch:
+                _resolve(future, exception=exc)
+            return
+        for (_, _, future), text in zip(batch, texts):
+            _resolve(future, result=text)
+
+
+def _resolve(future: "Future[str]", result: str | None = None, exception: BaseException | None = None) -> None:
+    try:
+        if exception is not None:
+            future.set_exception(exception)
+        else:
+            future.set_result(result)
+    except InvalidStateError:
+        # cancelled or resolved elsewhere; never let one future stop the scheduler thread
+        pass
+
+
+_scheduler: BatchScheduler | None = None
+_scheduler_lock = threading.Lock()
+
+
+def _load_runner() -> TransformersRunner:
+    return TransformersRunner(
+        settings.local_base_model,
+        settings.local_lora_dir or None,
+        settings.local_quantize or None,
+        settings.local_prefix_cache_entries,
+        settings.local_draft_model or None,
+        settings.local_draft_lookahead,
+    )
+
+
+def get_scheduler() -> BatchScheduler:
+    """The process-wide scheduler; the model is loaded by its worker thread on first use and stays resident."""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = BatchScheduler(_load_runner, settings.local_max_batch_size, settings.local_max_wait_ms / 1000)
+            atexit.register(_scheduler.close)
+        return _scheduler
+
+
+def local_model_id() -> str:
+    model_id = f"local:{settings.local_base_model}" + (f"+{settings.local_lora_dir}" if settings.local_lora_dir else "")
+    return model_id + (f":{settings.local_quantize}" if settings.local_quantize else "")
+
+
+async def local_text_generation(prompt: str, parameters: Dict[str, Any]) -> str:
+    with span("local.text-generation", model=local_model_id()):
+        return await get_scheduler().generate(prompt, parameters)
@@ -0,0 +1,257 @@
+import argparse
+import json
+import logging
+import os
+import re
+import threading
+import time
+import zlib
+from typing import List, Sequence, Tuple
+
+import numpy as np
+
+from app.config import settings
+from app.storage import db
+
+
+_logger = logging.getLogger(__name__)
+
+_IDENT_RE = re.compile(r"[A-Za-z]+|\d+")
+_CAMEL_RE = re.compile(r"[A-Z]?[a-z]+|[A-Z]+(?![a-z])|\d+")
+
+
+def tokenize(text: str) -> List[str]:
+    """Lower-cased word pieces; snake_case and camelCase identifiers are split."""
+    tokens: List[str] = []
+    for word in _IDENT_RE.findall(text):
+        tokens.extend(piece.lower() for piece in _CAMEL_RE.findall(word))
+    return tokens
+
+
+class HashingEmbedder:
+    """Stateless hashed bag of unigrams and bigrams, L2-normalised.
+
+    crc32 keeps the hashing stable across processes, so persisted vectors stay
+    comparable with freshly embedded queries.
+    """
+
+    def __init__(self, dim: int = 512) -> None:
+        self.dim = dim
+
+    def embed(self, text: str) -> np.ndarray:
+        vec = np.zeros(self.dim, dtype=np.float32)
+        tokens = tokenize(text)
+        features = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+        for feature in features:
+            h = zlib.crc32(feature.encode("utf-8"))
+            vec[h % self.dim] += 1.0 if (h >> 31) & 1 else -1.0
+        # sublinear term frequency, then unit length so dot product == cosine
+        np.copysign(np.log1p(np.abs(vec)), vec, out=vec)
+        norm = float(np.linalg.norm(vec))
+        if norm > 0:
+            vec /= norm
+        return vec
+
+    def embed_many(self, texts: Sequence[str]) -> np.ndarray:
+        if not texts:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        return np.stack([self.embed(t) for t in texts])
+
+
+class VectorIndex:
+    """Append-only matrix of unit vectors in a memory-mapped .npy file, with row ids alongside."""
+
+    SEARCH_CHUNK_ROWS = 65536
+
+    def __init__(self, directory: str, dim: int = 512, initial_capacity: int = 1024) -> None:
+        self.directory = directory
+        self.dim = dim
+        self._meta_path = os.path.join(directory, "meta.json")
+        self._vectors_path = os.path.join(directory, "vectors.npy")
+        self._ids_path = os.path.join(directory, "ids.npy")
+        os.makedirs(directory, exist_ok=True)
+        if os.path.exists(self._meta_path):
+            with open(self._meta_path) as fh:
+                meta = json.load(fh)
+            if meta["dim"] != dim:
+                raise ValueError(f"index at {directory} has dim {meta['dim']}, expected {dim}")
+            self.count, self.last_id = meta["count"], meta["last_id"]
+            self._vectors = np.load(self._vectors_path, mmap_mode="r+")
+            self._ids = np.load(self._ids_path, mmap_mode="r+")
+        else:
+            self.count, self.last_id = 0, 0
+            self._allocate(initial_capacity)
+            self._save_meta()
+
+    @property
+    def capacity(self) -> int:
+        return self._ids.shape[0]
+
+    def _allocate(self, capacity: int) -> None:
+        old_vectors = getattr(self, "_vectors", None)
+        old_ids = getattr(self, "_ids", None)
+        tmp_vectors, tmp_ids = self._vectors_path + ".tmp", self._ids_path + ".tmp"
+        vectors = np.lib.format.open_memmap(tmp_vectors, mode="w+", dtype=np.float32, shape=(capacity, self.dim))
+        ids = np.lib.format.open_memmap(tmp_ids, mode="w+", dtype=np.int64, shape=(capacity,))
+        if old_vectors is not None:
+            vectors[: self.count] = old_vectors[: self.count]
+            ids[: self.count] = old_ids[: self.count]
+        vectors.flush()
+        ids.flush()
+        del old_vectors, old_ids, vectors, ids
+        self._vectors = self._ids = None
+        os.replace(tmp_vectors, self._vectors_path)
+        os.replace(tmp_ids, self._ids_path)
+        self._vectors = np.load(self._vectors_path, mmap_mode="r+")
+        self._ids = np.load(self._ids_path, mmap_mode="r+")
+
+    def _save_meta(self) -> None:
+        tmp = self._meta_path + ".tmp"
+        with open(tmp, "w") as fh:
+            json.dump({"dim": self.dim, "count": self.count, "last_id": self.last_id}, fh)
+        os.replace(tmp, self._meta_path)
+
+    def add(self, ids: Sequence[int], vectors: np.ndarray) -> None:
+        n = len(ids)
+        if n == 0:
+            return
+        if self.count + n > self.capacity:
+            capacity = self.capacity
+            while capacity < self.count + n:
+                capacity *= 2
+            self._allocate(capacity)
+        self._vectors[self.count : self.count + n] = vectors
+        self._ids[self.count : self.count + n] = ids
+        self._vectors.flush()
+        self._ids.flush()
+        self.count += n
+        self.last_id = max(self.last_id, int(max(ids)))
+        self._save_meta()
+
+    def search(self, query: np.ndarray, k: int) -> List[Tuple[int, float]]:
+        """Top-k (id, cosine) pairs, scanning the matrix in fixed-size chunks."""
+        if self.count == 0 or k <= 0:
+            return []
+        best_scores = np.empty(0, dtype=np.float32)
+        best_rows = np.empty(0, dtype=np.int64)
+        for start in range(0, self.count, self.SEARCH_CHUNK_ROWS):
+            stop = min(start + self.SEARCH_CHUNK_ROWS, self.count)
+            scores = self._vectors[start:stop] @ query
+            if len(scores) > k:
+                top = np.argpartition(scores, -k)[-k:]
+            else:
+                top = np.arange(len(scores))
+            best_scores = np.concatenate([best_scores, scores[top]])
+            best_rows = np.concatenate([best_rows, top + start])
+            if len(best_scores) > k:
+                keep = np.argpartition(best_scores, -k)[-k:]
+                best_scores, best_rows = best_scores[keep], best_rows[keep]
+        order = np.argsort(-best_scores)
+        return [(int(self._ids[best_rows[i]]), float(best_scores[i])) for i in order]
+
+
+class Retriever:
+    """Keeps a VectorIndex in step with chat_messages.generated_code and serves similar snippets.
+
+    Searches never index inline: a stale index is refreshed on a background
+    thread while searches keep using what is already indexed.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        dim: int = 512,
+        min_score: float = 0.2,
+        refresh_interval: float = 30.0,
+        max_snippet_chars: int = 1200,
+    ) -> None:
+        self.embedder = HashingEmbedder(dim)
+        self.index = VectorIndex(directory, dim)
+        self.min_score = min_score
+        self.refresh_interval = refresh_interval
+        self.max_snippet_chars = max_snippet_chars
+        self._lock = threading.Lock()  # guards the index
+        self._refresh_lock = threading.Lock()  # one refresh at a time
+        self._refresher: threading.Thread | None = None
+        self._refreshed_at = float("-inf")
+
+    def refresh(self, batch_size: int = 1000) -> int:
+        """Embed messages added since the last refresh; return how many were indexed."""
+        added = 0
+        with self._refresh_lock:
+            while True:
+                rows = db.fetch_code_since(self.index.last_id, batch_size)
+                if not rows:
+                    break
+                vectors = self.embedder.embed_many([r[1] for r in rows])
+                with self._lock:
+                    self.index.add([r[0] for r in rows], vectors)
+                added += len(rows)
+            self._refreshed_at = time.monotonic()
+        return added
+
+    def refresh_in_background(self) -> threading.Thread | None:
+        """Start a refresh thread if the index is older than `refresh_interval` and none is running."""
+        with self._lock:
+            if time.monotonic() - self._refreshed_at <= self.refresh_interval:
+                return None
+            if self._refresher is None or not self._refresher.is_alive():
+                self._refresher = threading.Thread(
+                    target=self._background_refresh, name="retrieval-refresh", daemon=True
+                )
+                self._refresher.start()
+            return self._refresher
+
+    def _background_refresh(self) -> None:
+        try:
+            self.refresh()
+        except Exception:
+            _logger.exception("retrieval index refresh failed")
+            # try again after refresh_interval, not on every search
+            self._refreshed_at = time.monotonic()
+
+    def search(self, text: str, k: int) -> List[Tuple[int, float]]:
+        self.refresh_in_background()
+        query = self.embedder.embed(text)
+        with self._lock:
+            hits = self.index.search(query, k)
+        return [(i, s) for i, s in hits if s >= self.min_score]
+
+    def retrieve(self, text: str, k: int) -> List[str]:
+        hits = self.search(text, k)
+        code = db.fetch_code([i for i, _ in hits])
+        return [code[i][: self.max_snippet_chars] for i, _ in hits if code.get(i)]
+
+
+_retriever: Retriever | None = None
+_retriever_lock = threading.Lock()
+
+
+def get_retriever() -> Retriever:
+    global _retriever
+    with _retriever_lock:
+        if _retriever is None:
+            directory = settings.retrieval_index_dir or os.path.join(
+                os.path.dirname(settings.database_path), "retrieval"
+            )
+            _retriever = Retriever(directory, dim=settings.retrieval_dim, min_score=settings.retrieval_min_score)
+        return _retriever
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Build or query the local code retrieval index.")
+    parser.add_argument("--query", help="print the top-k snippets for this text after refreshing")
+    parser.add_argument("-k", type=int, default=settings.retrieval_top_k)
+    args = parser.parse_args()
+
+    retriever = get_retriever()
+    t0 = time.perf_counter()
+    added = retriever.refresh()
+    print(json.dumps({"indexed": added, "total": retriever.index.count, "seconds": time.perf_counter() - t0}))
+    if args.query:
+        for message_id, score in retriever.search(args.query, args.k):
+            print(json.dumps({"id": message_id, "score": round(score, 4)}))
+
+
+if __name__ == "__main__":
+    main()
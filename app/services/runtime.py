@@ -0,0 +1,82 @@
+import asyncio
+import atexit
+import contextvars
+import threading
+from typing import Any, AsyncIterator, Coroutine, Iterator, TypeVar
+
+from app.services.hf_clients import aclose_http_client
+
+
+T = TypeVar("T")
+
+_loop: asyncio.AbstractEventLoop | None = None
+_thread: threading.Thread | None = None
+_lock = threading.Lock()
+
+
+def get_loop() -> asyncio.AbstractEventLoop:
+    """Return the long-lived background event loop, starting it on first use.
+
+    Sync entry points (Flask handlers, Gradio callbacks) submit their coroutines
+    here instead of calling `asyncio.run`, so pooled connections survive between
+    requests.
+    """
+    global _loop, _thread
+    with _lock:
+        if _loop is None or _loop.is_closed():
+            _loop = asyncio.new_event_loop()
+            _thread = threading.Thread(target=_loop.run_forever, name="app-event-loop", daemon=True)
+            _thread.start()
+    return _loop
+
+
+def run_sync(coro: Coroutine[Any, Any, T], timeout: float | None = None) -> T:
+    """Run `coro` on the background loop and block until it finishes."""
+    return asyncio.run_coroutine_threadsafe(coro, get_loop()).result(timeout)
+
+
+def iterate_sync(agen: AsyncIterator[T]) -> Iterator[T]:
+    """Drive an async iterator on the background loop from synchronous code.
+
+    Every step runs with the context of the first one, so context variables (such
+    as the current trace) stay visible even if later steps come from other threads.
+    """
+    loop = get_loop()
+    context = contextvars.copy_context()
+
+    async def _next() -> T:
+        return await agen.__anext__()
+
+    async def _close() -> None:
+        aclose = getattr(agen, "aclose", None)
+        if aclose is not None:
+            await aclose()
+
+    try:
+        while True:
+            try:
+                yield context.run(asyncio.run_coroutine_threadsafe, _next(), loop).result()
+            except StopAsyncIteration:
+                return
+    finally:
+        context.run(asyncio.run_coroutine_threadsafe, _close(), loop).result()
+
+
+def shutdown() -> None:
+    """Close pooled connections and stop the background loop."""
+    global _loop, _thread
+    with _lock:
+        loop, thread = _loop, _thread
+        _loop, _thread = None, None
+    if loop is None or loop.is_closed():
+        return
+    try:
+        asyncio.run_coroutine_threadsafe(aclose_http_client(), loop).result(5)
+    finally:
+        loop.call_soon_threadsafe(loop.stop)
+        if thread is not None:
+            thread.join(5)
+        loop.close()
+
+
+atexit.register(shutdown)
@@ -0,0 +1,56 @@
+import hashlib
+import os
+import re
+import tempfile
+
+
+_DIGEST_RE = re.compile(r"^[0-9a-f]{64}$")
+
+
+def sniff_content_type(data: bytes) -> str:
+    if data.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if data.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    if data.lstrip()[:4] in (b"<svg", b"<?xm"):
+        return "image/svg+xml"
+    return "application/octet-stream"
+
+
+class BlobStore:
+    """Content-addressed files on disk: each blob is stored once under its sha256."""
+
+    def __init__(self, root: str) -> None:
+        self.root = root
+
+    def path(self, digest: str) -> str:
+        if not _DIGEST_RE.match(digest):
+            raise ValueError(f"invalid blob digest: {digest!r}")
+        return os.path.join(self.root, digest[:2], digest)
+
+    def put(self, data: bytes) -> str:
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.path(digest)
+        if os.path.exists(path):
+            return digest
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # write to a temp file and rename so readers never see a partial blob
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as fh:
+                fh.write(data)
+            os.replace(tmp, path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        return digest
+
+    def get(self, digest: str) -> bytes | None:
+        try:
+            with open(self.path(digest), "rb") as fh:
+                return fh.read()
+        except (FileNotFoundError, ValueError):
+            return None
@@ -1,23 +1,109 @@
+import base64
 import json
 import os
+import re
 from contextlib import contextmanager
-from typing import Iterable, List, Dict, Any
+from datetime import datetime, timedelta
+from typing import List, Dict, Any, Sequence, Tuple
 
-from sqlalchemy import create_engine, select
+from sqlalchemy import and_, create_engine, event, inspect, or_, select, delete, func, text, update
+from sqlalchemy.exc import OperationalError
 from sqlalchemy.orm import Session
 
 from app.config import settings
-from app.storage.models import Base, ChatMessage
+from app.metrics.tracing import span
+from app.storage.blobs import BlobStore
+from app.storage.models import Base, ChatMessage, DiagramJob, ResponseCacheEntry
+
+
+def sqlite_pragmas() -> List[str]:
+    pragmas = [
+        f"PRAGMA busy_timeout={settings.sqlite_busy_timeout_ms}",
+        "PRAGMA temp_store=MEMORY",
+        "PRAGMA cache_size=-20000",  # KiB, i.e. ~20 MB page cache per connection
+        "PRAGMA mmap_size=268435456",
+    ]
+    if settings.sqlite_wal:
+        # readers no longer block the writer; NORMAL sync is durable enough in WAL mode
+        pragmas += ["PRAGMA journal_mode=WAL", "PRAGMA synchronous=NORMAL"]
+    return pragmas
 
 
 def get_engine():
     os.makedirs(os.path.dirname(settings.database_path), exist_ok=True)
     url = f"sqlite:///{settings.database_path}"
-    return create_engine(url, connect_args={"check_same_thread": False})
+    engine = create_engine(url, connect_args={"check_same_thread": False})
+
+    @event.listens_for(engine, "connect")
+    def _apply_pragmas(dbapi_conn, _record) -> None:
+        cursor = dbapi_conn.cursor()
+        for pragma in sqlite_pragmas():
+            cursor.execute(pragma)
+        cursor.close()
+
+    return engine
+
+
+FTS_DDL = [
+    # external-content index over chat_messages; '_' keeps identifiers as one token
+    """CREATE VIRTUAL TABLE chat_messages_fts USING fts5(
+        user_prompt, generated_code,
+        content='chat_messages', content_rowid='id',
+        tokenize="unicode61 tokenchars '_'"
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS chat_messages_fts_ai AFTER INSERT ON chat_messages BEGIN
+        INSERT INTO chat_messages_fts(rowid, user_prompt, generated_code)
+        VALUES (new.id, new.user_prompt, new.generated_code);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS chat_messages_fts_ad AFTER DELETE ON chat_messages BEGIN
+        INSERT INTO chat_messages_fts(chat_messages_fts, rowid, user_prompt, generated_code)
+        VALUES ('delete', old.id, old.user_prompt, old.generated_code);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS chat_messages_fts_au AFTER UPDATE OF user_prompt, generated_code
+    ON chat_messages BEGIN
+        INSERT INTO chat_messages_fts(chat_messages_fts, rowid, user_prompt, generated_code)
+        VALUES ('delete', old.id, old.user_prompt, old.generated_code);
+        INSERT INTO chat_messages_fts(rowid, user_prompt, generated_code)
+        VALUES (new.id, new.user_prompt, new.generated_code);
+    END""",
+]
+
+
+def _migrate(engine) -> bool:
+    """Bring an existing database up to date; return whether full-text search is available."""
+    # create_all only creates missing tables; add columns introduced since
+    columns = {c["name"] for c in inspect(engine).get_columns("chat_messages")}
+    with engine.begin() as conn:
+        if "diagram_ref" not in columns:
+            conn.execute(text("ALTER TABLE chat_messages ADD COLUMN diagram_ref VARCHAR(64)"))
+        # superseded by the (session_id, created_at) index
+        conn.execute(text("DROP INDEX IF EXISTS ix_chat_messages_session_id"))
+        conn.execute(
+            text(
+                "CREATE INDEX IF NOT EXISTS ix_chat_messages_session_created "
+                "ON chat_messages (session_id, created_at)"
+            )
+        )
+    try:
+        with engine.begin() as conn:
+            exists = conn.execute(
+                text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'chat_messages_fts'")
+            ).first()
+            if exists is None:
+                for ddl in FTS_DDL:
+                    conn.execute(text(ddl))
+                # backfill rows written before the index existed
+                conn.execute(text("INSERT INTO chat_messages_fts(chat_messages_fts) VALUES ('rebuild')"))
+    except OperationalError:
+        # SQLite built without FTS5
+        return False
+    return True
 
 
 engine = get_engine()
 Base.metadata.create_all(engine)
+fts_available = _migrate(engine)
+blob_store = BlobStore(settings.blob_dir or os.path.join(os.path.dirname(settings.database_path), "blobs"))
 
 
 @contextmanager
@@ -33,6 +119,37 @@ def session_scope():
         session.close()
 
 
+def store_diagram(diagram_base64: str | None) -> str | None:
+    """Move a base64 diagram into the blob store and return its digest."""
+    if not diagram_base64:
+        return None
+    return blob_store.put(base64.b64decode(diagram_base64))
+
+
+def load_diagram(digest: str) -> bytes | None:
+    return blob_store.get(digest)
+
+
+def diagram_url(digest: str | None) -> str | None:
+    return f"/api/diagrams/{digest}" if digest else None
+
+
+def _message_row(
+    session_id: str,
+    user_prompt: str,
+    generated_code: str | None,
+    diagram_base64: str | None,
+    analysis: Dict[str, Any] | None,
+) -> ChatMessage:
+    return ChatMessage(
+        session_id=session_id,
+        user_prompt=user_prompt,
+        generated_code=generated_code,
+        diagram_ref=store_diagram(diagram_base64),
+        analysis_json=json.dumps(analysis) if analysis else None,
+    )
+
+
 def save_message(
     session_id: str,
     user_prompt: str,
@@ -40,43 +157,369 @@ def save_message(
     diagram_base64: str | None,
     analysis: Dict[str, Any] | None,
 ) -> int:
-    with session_scope() as s:
-        msg = ChatMessage(
-            session_id=session_id,
-            user_prompt=user_prompt,
-            generated_code=generated_code,
-            diagram_base64=diagram_base64,
-            analysis_json=json.dumps(analysis) if analysis else None,
-        )
-        s.add(msg)
-        s.flush()
-        return msg.id
+    with span("save_message"):
+        msg = _message_row(session_id, user_prompt, generated_code, diagram_base64, analysis)
+        with session_scope() as s:
+            s.add(msg)
+            s.flush()
+            return msg.id
+
 
+def save_messages(messages: Sequence[Dict[str, Any]]) -> List[int]:
+    """Insert several messages (save_message keyword arguments) in one transaction."""
+    with span("save_messages", count=len(messages)):
+        rows = [_message_row(**m) for m in messages]
+        with session_scope() as s:
+            s.add_all(rows)
+            s.flush()
+            return [r.id for r in rows]
 
-def fetch_history(session_id: str, limit: int = 50) -> List[Dict[str, Any]]:
+
+def fetch_code_since(last_id: int, limit: int = 1000, missing_analysis: bool = False) -> List[tuple[int, str]]:
+    """(id, generated_code) of messages with id > last_id, oldest first."""
     with session_scope() as s:
         stmt = (
-            select(ChatMessage)
-            .where(ChatMessage.session_id == session_id)
-            .order_by(ChatMessage.created_at.desc())
+            select(ChatMessage.id, ChatMessage.generated_code)
+            .where(ChatMessage.id > last_id, ChatMessage.generated_code.is_not(None))
+            .order_by(ChatMessage.id)
             .limit(limit)
         )
-        rows: Iterable[ChatMessage] = s.execute(stmt).scalars().all()
-        history: List[Dict[str, Any]] = []
-        for r in rows:
-            history.append(
-                {
-                    "id": r.id,
-                    "session_id": r.session_id,
-                    "user_prompt": r.user_prompt,
-                    "generated_code": r.generated_code,
-                    "diagram_base64": r.diagram_base64,
-                    "analysis_json": r.analysis_json,
-                    "created_at": r.created_at.isoformat(),
-                }
+        if missing_analysis:
+            stmt = stmt.where(ChatMessage.analysis_json.is_(None))
+        return [(r[0], r[1]) for r in s.execute(stmt)]
+
+
+def update_analyses(results: Sequence[tuple[int, Dict[str, Any]]]) -> int:
+    """Overwrite analysis_json for several messages in one executemany transaction."""
+    if not results:
+        return 0
+    with session_scope() as s:
+        s.execute(
+            update(ChatMessage),
+            [{"id": message_id, "analysis_json": json.dumps(analysis)} for message_id, analysis in results],
+        )
+    return len(results)
+
+
+def fetch_code(ids: Sequence[int]) -> Dict[int, str]:
+    if not ids:
+        return {}
+    with session_scope() as s:
+        stmt = select(ChatMessage.id, ChatMessage.generated_code).where(ChatMessage.id.in_(list(ids)))
+        return {r[0]: r[1] for r in s.execute(stmt)}
+
+
+HISTORY_FIELDS = (
+    "id",
+    "session_id",
+    "user_prompt",
+    "generated_code",
+    "diagram_base64",
+    "diagram_ref",
+    "diagram_url",
+    "analysis_json",
+    "created_at",
+)
+
+
+def fetch_history(
+    session_id: str,
+    limit: int = 50,
+    before_id: int | None = None,
+    after_id: int | None = None,
+    fields: Sequence[str] | None = None,
+) -> List[Dict[str, Any]]:
+    """Return up to `limit` messages of a session in chronological order.
+
+    Without a cursor the newest messages are returned. `before_id` pages towards
+    older messages and `after_id` towards newer ones (keyset pagination on
+    (created_at, id)). `fields` limits the returned keys, so large columns such
+    as `diagram_base64` or `generated_code` are not read at all.
+    """
+    wanted = list(fields) if fields else list(HISTORY_FIELDS)
+    unknown = set(wanted) - set(HISTORY_FIELDS)
+    if unknown:
+        raise ValueError(f"unknown history fields: {', '.join(sorted(unknown))}")
+    column_names = {"diagram_ref" if f == "diagram_url" else f for f in wanted} | {"id"}
+    columns = [getattr(ChatMessage, name) for name in HISTORY_FIELDS if name in column_names]
+
+    with session_scope() as s:
+        stmt = select(*columns).where(ChatMessage.session_id == session_id)
+        cursor_id = after_id if after_id is not None else before_id
+        if cursor_id is not None:
+            cursor_created = s.execute(
+                select(ChatMessage.created_at).where(ChatMessage.id == cursor_id)
+            ).scalar_one_or_none()
+            if cursor_created is None:
+                return []
+            if after_id is not None:
+                stmt = stmt.where(
+                    or_(
+                        ChatMessage.created_at > cursor_created,
+                        and_(ChatMessage.created_at == cursor_created, ChatMessage.id > cursor_id),
+                    )
+                )
+            else:
+                stmt = stmt.where(
+                    or_(
+                        ChatMessage.created_at < cursor_created,
+                        and_(ChatMessage.created_at == cursor_created, ChatMessage.id < cursor_id),
+                    )
+                )
+        if after_id is not None:
+            stmt = stmt.order_by(ChatMessage.created_at.asc(), ChatMessage.id.asc())
+        else:
+            stmt = stmt.order_by(ChatMessage.created_at.desc(), ChatMessage.id.desc())
+        rows = s.execute(stmt.limit(limit)).mappings().all()
+
+    history: List[Dict[str, Any]] = []
+    for r in rows:
+        item: Dict[str, Any] = {}
+        for name in wanted:
+            if name == "diagram_url":
+                item[name] = diagram_url(r["diagram_ref"])
+            elif name == "created_at":
+                item[name] = r["created_at"].isoformat()
+            else:
+                item[name] = r[name]
+        history.append(item)
+    return history if after_id is not None else list(reversed(history))
+
+
+def cache_get(key: str, ttl_seconds: float) -> Tuple[str, float] | None:
+    """Return a live entry's response and its age in seconds, so callers can keep its expiry."""
+    with session_scope() as s:
+        entry = s.get(ResponseCacheEntry, key)
+        if entry is None:
+            return None
+        now = datetime.utcnow()
+        if now - entry.created_at > timedelta(seconds=ttl_seconds):
+            s.delete(entry)
+            return None
+        entry.last_accessed_at = now
+        return entry.response, (now - entry.created_at).total_seconds()
+
+
+def cache_put(key: str, model_id: str, response: str, max_bytes: int) -> None:
+    size = len(response.encode("utf-8"))
+    with session_scope() as s:
+        s.merge(
+            ResponseCacheEntry(
+                key=key,
+                model_id=model_id,
+                response=response,
+                size_bytes=size,
+                created_at=datetime.utcnow(),
+                last_accessed_at=datetime.utcnow(),
             )
-        return list(reversed(history))
+        )
+        s.flush()
+        total = s.execute(select(func.coalesce(func.sum(ResponseCacheEntry.size_bytes), 0))).scalar_one()
+        if total <= max_bytes:
+            return
+        # evict least recently used entries until we are back under budget
+        stmt = select(ResponseCacheEntry.key, ResponseCacheEntry.size_bytes).order_by(
+            ResponseCacheEntry.last_accessed_at.asc()
+        )
+        evict: List[str] = []
+        for k, entry_size in s.execute(stmt):
+            if total <= max_bytes:
+                break
+            evict.append(k)
+            total -= entry_size
+        s.execute(delete(ResponseCacheEntry).where(ResponseCacheEntry.key.in_(evict)))
+
+
+def cache_clear() -> None:
+    with session_scope() as s:
+        s.execute(delete(ResponseCacheEntry))
+
+
+def enqueue_diagram_job(message_id: int, user_prompt: str, generated_code: str | None) -> int:
+    with session_scope() as s:
+        job = DiagramJob(message_id=message_id, user_prompt=user_prompt, generated_code=generated_code)
+        s.add(job)
+        s.flush()
+        return job.id
+
+
+def claim_diagram_job() -> Dict[str, Any] | None:
+    """Atomically move the oldest queued job to `running` and return it."""
+    while True:
+        with session_scope() as s:
+            job_id = s.execute(
+                select(DiagramJob.id).where(DiagramJob.status == "queued").order_by(DiagramJob.id).limit(1)
+            ).scalar_one_or_none()
+            if job_id is None:
+                return None
+            claimed = s.execute(
+                update(DiagramJob)
+                .where(DiagramJob.id == job_id, DiagramJob.status == "queued")
+                .values(status="running", attempts=DiagramJob.attempts + 1, updated_at=datetime.utcnow())
+            ).rowcount
+            if not claimed:
+                # another worker won the race; try the next job
+                continue
+            job = s.get(DiagramJob, job_id)
+            return {
+                "id": job.id,
+                "message_id": job.message_id,
+                "user_prompt": job.user_prompt,
+                "generated_code": job.generated_code,
+                "attempts": job.attempts,
+            }
+
+
+def complete_diagram_job(job_id: int, diagram_base64: str) -> None:
+    diagram_ref = store_diagram(diagram_base64)
+    with session_scope() as s:
+        job = s.get(DiagramJob, job_id)
+        if job is None:
+            return
+        job.status = "done"
+        job.error = None
+        job.updated_at = datetime.utcnow()
+        s.execute(
+            update(ChatMessage).where(ChatMessage.id == job.message_id).values(diagram_ref=diagram_ref)
+        )
+
+
+def fail_diagram_job(job_id: int, error: str, max_attempts: int) -> None:
+    with session_scope() as s:
+        job = s.get(DiagramJob, job_id)
+        if job is None:
+            return
+        job.status = "queued" if job.attempts < max_attempts else "failed"
+        job.error = error
+        job.updated_at = datetime.utcnow()
+
+
+def heartbeat_diagram_jobs(job_ids: Sequence[int]) -> None:
+    """Renew the lease (`updated_at`) of jobs the caller is still running."""
+    if not job_ids:
+        return
+    with session_scope() as s:
+        s.execute(
+            update(DiagramJob)
+            .where(DiagramJob.id.in_(job_ids), DiagramJob.status == "running")
+            .values(updated_at=datetime.utcnow())
+        )
+
+
+def requeue_running_jobs(lease_seconds: float = 0.0) -> int:
+    """Put `running` jobs whose lease is older than `lease_seconds` back on the queue.
+
+    A running job's `updated_at` is its claim time, renewed by `heartbeat_diagram_jobs`;
+    a lapsed lease means the worker (in this or another process) crashed.
+    """
+    cutoff = datetime.utcnow() - timedelta(seconds=lease_seconds)
+    with session_scope() as s:
+        return s.execute(
+            update(DiagramJob)
+            .where(DiagramJob.status == "running", DiagramJob.updated_at <= cutoff)
+            .values(status="queued")
+        ).rowcount
+
+
+def get_diagram_job(job_id: int) -> Dict[str, Any] | None:
+    with session_scope() as s:
+        job = s.get(DiagramJob, job_id)
+        if job is None:
+            return None
+        diagram_ref = None
+        if job.status == "done":
+            diagram_ref = s.execute(
+                select(ChatMessage.diagram_ref).where(ChatMessage.id == job.message_id)
+            ).scalar_one_or_none()
+        data = load_diagram(diagram_ref) if diagram_ref else None
+        return {
+            "id": job.id,
+            "message_id": job.message_id,
+            "status": job.status,
+            "attempts": job.attempts,
+            "error": job.error,
+            "diagram_base64": base64.b64encode(data).decode("utf-8") if data else None,
+            "diagram_ref": diagram_ref,
+            "diagram_url": diagram_url(diagram_ref),
+            "created_at": job.created_at.isoformat(),
+            "updated_at": job.updated_at.isoformat(),
+        }
+
+
+def migrate_legacy_diagrams(batch_size: int = 100) -> int:
+    """Move inline base64 diagrams of older rows into the blob store.
+
+    Run VACUUM afterwards to return the freed pages to the filesystem.
+    """
+    moved = 0
+    while True:
+        with session_scope() as s:
+            rows = s.execute(
+                select(ChatMessage.id, ChatMessage.diagram_base64)
+                .where(ChatMessage.diagram_base64.is_not(None))
+                .limit(batch_size)
+            ).all()
+            if not rows:
+                return moved
+            for message_id, diagram_base64 in rows:
+                s.execute(
+                    update(ChatMessage)
+                    .where(ChatMessage.id == message_id)
+                    .values(diagram_ref=store_diagram(diagram_base64), diagram_base64=None)
+                )
+            moved += len(rows)
+
+
+_FTS_TOKEN_RE = re.compile(r"\w+\*?")
+
+
+def _fts_query(query: str) -> str:
+    # quote every term so user input cannot inject FTS5 syntax; keep trailing * as prefix search
+    terms = []
+    for token in _FTS_TOKEN_RE.findall(query):
+        prefix = token.endswith("*")
+        terms.append(f'"{token.rstrip("*")}"' + ("*" if prefix else ""))
+    return " ".join(terms)
 
 
+def search_messages(
+    query: str, session_id: str | None = None, limit: int = 20, offset: int = 0
+) -> List[Dict[str, Any]]:
+    """Rank messages matching `query` (all terms) by BM25 and return highlighted snippets."""
+    if not fts_available:
+        raise RuntimeError("full-text search requires SQLite with FTS5")
+    match = _fts_query(query)
+    if not match:
+        return []
+    sql = """
+        SELECT m.id, m.session_id, m.created_at,
+               snippet(chat_messages_fts, 0, '[', ']', '…', 12) AS prompt_snippet,
+               snippet(chat_messages_fts, 1, '[', ']', '…', 16) AS code_snippet,
+               bm25(chat_messages_fts) AS rank
+        FROM chat_messages_fts
+        JOIN chat_messages AS m ON m.id = chat_messages_fts.rowid
+        WHERE chat_messages_fts MATCH :match
+    """
+    params: Dict[str, Any] = {"match": match, "limit": limit, "offset": offset}
+    if session_id is not None:
+        sql += " AND m.session_id = :session_id"
+        params["session_id"] = session_id
+    sql += " ORDER BY rank LIMIT :limit OFFSET :offset"
+    with engine.connect() as conn:
+        rows = conn.execute(text(sql), params).mappings().all()
+    return [
+        {
+            "id": r["id"],
+            "session_id": r["session_id"],
+            "created_at": r["created_at"],
+            "prompt_snippet": r["prompt_snippet"],
+            "code_snippet": r["code_snippet"],
+            "score": -r["rank"],
+        }
+        for r in rows
+    ]
 
 
+def rebuild_search_index() -> None:
+    with engine.begin() as conn:
+        conn.execute(text("INSERT INTO chat_messages_fts(chat_messages_fts) VALUES ('rebuild')"))
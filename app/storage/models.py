@@ -1,7 +1,7 @@
 from datetime import datetime
 from typing import Optional
 
-from sqlalchemy import String, Text, DateTime, Integer
+from sqlalchemy import String, Text, DateTime, Integer, Index
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column
 
 
@@ -11,15 +11,45 @@ class Base(DeclarativeBase):
 
 class ChatMessage(Base):
     __tablename__ = "chat_messages"
+    # history is always read per session, newest first
+    __table_args__ = (Index("ix_chat_messages_session_created", "session_id", "created_at"),)
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
-    session_id: Mapped[str] = mapped_column(String(64), index=True)
+    session_id: Mapped[str] = mapped_column(String(64))
     user_prompt: Mapped[str] = mapped_column(Text)
     generated_code: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+    # legacy inline diagrams; new rows reference the blob store via diagram_ref
     diagram_base64: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+    diagram_ref: Mapped[Optional[str]] = mapped_column(String(64), nullable=True)
     analysis_json: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
 
 
 
 
+
+
+class ResponseCacheEntry(Base):
+    __tablename__ = "response_cache"
+
+    key: Mapped[str] = mapped_column(String(64), primary_key=True)
+    model_id: Mapped[str] = mapped_column(String(128))
+    response: Mapped[str] = mapped_column(Text)
+    size_bytes: Mapped[int] = mapped_column(Integer)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    last_accessed_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, index=True)
+
+
+class DiagramJob(Base):
+    __tablename__ = "diagram_jobs"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    message_id: Mapped[int] = mapped_column(Integer, index=True)
+    user_prompt: Mapped[str] = mapped_column(Text)
+    generated_code: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+    # queued -> running -> done | failed (failed runs are requeued until attempts run out)
+    status: Mapped[str] = mapped_column(String(16), index=True, default="queued")
+    attempts: Mapped[int] = mapped_column(Integer, default=0)
+    error: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
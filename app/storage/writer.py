@@ -0,0 +1,127 @@
+import atexit
+import queue
+import threading
+import time
+from concurrent.futures import Future, InvalidStateError
+from typing import Any, Dict, List, Tuple
+
+from app.config import settings
+from app.metrics.tracing import span
+from app.storage import db
+
+
+class WriteBehindQueue:
+    """Buffer `save_message` calls and insert them in batched transactions.
+
+    A single writer thread drains the queue, so request threads never wait on
+    SQLite's write lock. The queue is bounded: when it is full, `submit` blocks
+    until the writer catches up.
+    """
+
+    def __init__(self, max_pending: int = 1000, batch_size: int = 100, max_delay: float = 0.05) -> None:
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self._queue: "queue.Queue[Tuple[Dict[str, Any], Future[int]] | None]" = queue.Queue(maxsize=max_pending)
+        self._thread: threading.Thread | None = None
+        self._lock = threading.Lock()
+
+    def start(self) -> None:
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+                self._thread.start()
+
+    def submit(self, **message: Any) -> "Future[int]":
+        """Queue a message (save_message keyword arguments); the future resolves to its id."""
+        self.start()
+        future: "Future[int]" = Future()
+        self._queue.put((message, future))
+        return future
+
+    def flush(self) -> None:
+        """Block until everything submitted so far has been written."""
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.join()
+
+    def close(self) -> None:
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is None or not thread.is_alive():
+            return
+        self._queue.put(None)
+        thread.join()
+
+    def _run(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is None:
+                self._queue.task_done()
+                return
+            batch = [item]
+            deadline = time.monotonic() + self.max_delay
+            stop = False
+            while len(batch) < self.batch_size:
+                try:
+                    nxt = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if nxt is None:
+                    stop = True
+                    break
+                batch.append(nxt)
+            try:
+                self._write(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+            if stop:
+                self._queue.task_done()
+                return
+
+    def _write(self, batch: List[Tuple[Dict[str, Any], "Future[int]"]]) -> None:
+        # a caller awaiting through asyncio.wrap_future may have cancelled (client gone); the
+        # message is still written, only its future is left alone
+        live = [future.set_running_or_notify_cancel() for _, future in batch]
+        try:
+            ids = db.save_messages([message for message, _ in batch])
+        except Exception as exc:
+            for (_, future), running in zip(batch, live):
+                if running:
+                    _resolve(future, exception=exc)
+            return
+        for (_, future), running, message_id in zip(batch, live, ids):
+            if running:
+                _resolve(future, result=message_id)
+
+
+def _resolve(future: "Future[int]", result: int | None = None, exception: BaseException | None = None) -> None:
+    try:
+        if exception is not None:
+            future.set_exception(exception)
+        else:
+            future.set_result(result)
+    except InvalidStateError:
+        # already resolved elsewhere; never let one future stop the writer thread
+        pass
+
+
+writer = WriteBehindQueue(
+    max_pending=settings.write_behind_max_pending,
+    batch_size=settings.write_behind_batch_size,
+)
+atexit.register(writer.close)
+
+
+def submit_message(**message: Any) -> "Future[int]":
+    """Persist a chat message, through the write-behind queue when it is enabled.
+
+    Returns a future for the new row id; callers that do not need the id can
+    ignore it.
+    """
+    if settings.write_behind:
+        # the insert itself happens on the writer thread, outside the request's trace
+        with span("submit_message", write_behind=True):
+            return writer.submit(**message)
+    future: "Future[int]" = Future()
+    future.set_result(db.save_message(**message))
+    return future
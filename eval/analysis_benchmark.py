@@ -0,0 +1,133 @@
+import argparse
+import json
+import re
+import time
+from typing import Any, Callable, Dict, List
+
+from radon.complexity import cc_visit
+
+from app.config import settings
+from app.services.analysis import analyze_code, unit_cache
+
+
+FUNCTION_TEMPLATE = '''def handler_{i}(items, limit={i}):
+    """Process a batch of items."""
+    total = 0
+    for item in items:
+        if item > limit:
+            total += item
+        elif item < 0:
+            continue
+    try:
+        return total / len(items)
+    except ZeroDivisionError:
+        return 0
+'''
+
+
+def synthetic_code(lines: int) -> str:
+    """Python source of roughly `lines` lines made of small functions and classes."""
+    parts: List[str] = ["import math\n"]
+    i = 0
+    while sum(p.count("\n") for p in parts) < lines:
+        if i % 5 == 4:
+            parts.append(f"class Worker{i}:\n    def run(self):\n        while self.busy():\n            pass\n")
+        else:
+            parts.append(FUNCTION_TEMPLATE.format(i=i))
+        i += 1
+    return "\n".join(parts)
+
+
+def legacy_analyze_code(code: str) -> Dict[str, Any]:
+    """The previous multi-pass analyzer, kept here as the comparison baseline."""
+    try:
+        import nltk
+
+        nltk.data.find("tokenizers/punkt")
+    except Exception:
+        pass
+    tokens = re.findall(r"[A-Za-z_][A-Za-z0-9_]*|\S", code)
+    try:
+        results = cc_visit(code)
+        complexity = float(sum(r.complexity for r in results) / len(results)) if results else 0.0
+    except Exception:
+        complexity = 0.0
+    patterns = [
+        (r"class\s+\w+", "class_definition"),
+        (r"def\s+\w+\s*\(", "function_definition"),
+        (r"for\s+.+:\s*$", "for_loop"),
+        (r"while\s+.+:\s*$", "while_loop"),
+        (r"try:\s*$", "try_block"),
+        (r"except\s+.+:\s*$", "except_block"),
+        (r"if\s+.+:\s*$", "if_statement"),
+    ]
+    found = [name for regex, name in patterns if re.search(regex, code, flags=re.MULTILINE)]
+    return {"token_count": len(tokens), "avg_cyclomatic_complexity": complexity, "patterns": found}
+
+
+def time_per_call(fn: Callable[[str], Any], code: str, min_seconds: float = 0.2) -> float:
+    """Mean microseconds per call, repeating until at least `min_seconds` elapsed."""
+    fn(code)  # warm-up
+    calls, start = 0, time.perf_counter()
+    while True:
+        fn(code)
+        calls += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_seconds:
+            return elapsed / calls * 1e6
+
+
+def uncached_analyze_code(code: str) -> Dict[str, Any]:
+    unit_cache.clear()
+    return analyze_code(code)
+
+
+def time_one_edit(code: str, min_seconds: float = 0.2) -> float:
+    """Mean microseconds to re-analyse `code` after changing one function, with the rest cached."""
+    analyze_code(code)
+    marker = "total = 0"
+    calls, start = 0, time.perf_counter()
+    while True:
+        # each call sees a body the cache has not seen yet, in the first function only
+        analyze_code(code.replace(marker, f"total = {calls + 1}", 1))
+        calls += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_seconds:
+            return elapsed / calls * 1e6
+
+
+def run(sizes: List[int], min_seconds: float) -> List[Dict[str, Any]]:
+    rows = []
+    cache_entries = settings.analysis_cache_entries
+    settings.analysis_cache_entries = max(cache_entries, 1 << 16)
+    try:
+        for lines in sizes:
+            code = synthetic_code(lines)
+            current = time_per_call(uncached_analyze_code, code, min_seconds)
+            edited = time_one_edit(code, min_seconds)
+            legacy = time_per_call(legacy_analyze_code, code, min_seconds)
+            rows.append(
+                {
+                    "lines": code.count("\n") + 1,
+                    "analyze_code_us": round(current, 1),
+                    "one_edit_us": round(edited, 1),
+                    "legacy_us": round(legacy, 1),
+                    "speedup": round(legacy / current, 2),
+                    "one_edit_speedup": round(legacy / edited, 2),
+                }
+            )
+    finally:
+        settings.analysis_cache_entries = cache_entries
+    return rows
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Micro-benchmark analyze_code on synthetic inputs.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000, 10000])
+    parser.add_argument("--min-seconds", type=float, default=0.2)
+    args = parser.parse_args()
+    print(json.dumps(run(args.sizes, args.min_seconds), indent=2))
+
+
+if __name__ == "__main__":
+    main()
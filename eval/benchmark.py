@@ -1,7 +1,8 @@
+import argparse
 import json
 import time
 from dataclasses import dataclass
-from typing import List, Dict, Any
+from typing import Callable, List, Dict, Any, Tuple
 
 from eval.metrics import bleu_score, rouge_l_f1, precision_recall_at_k
 
@@ -45,23 +46,78 @@ def run_benchmark(
     }
 
 
+def load_examples(path: str) -> List[Example]:
+    """JSONL with `prompt`, `reference_code` and optionally `relevant_snippets` per line."""
+    examples = []
+    with open(path, encoding="utf-8") as fh:
+        for line in fh:
+            if line.strip():
+                record = json.loads(line)
+                examples.append(
+                    Example(record["prompt"], record["reference_code"], record.get("relevant_snippets", []))
+                )
+    return examples
+
+
+def pipeline_generator(with_diagrams: bool = False) -> Callable[[str], Tuple[str, List[str]]]:
+    """Generator running the app's own codegen (and diagram) path.
+
+    It goes through HFInferenceClient, so HF_CLIENT_MODE=record/replay applies:
+    record once against the API, then replay offline to time only our code.
+    """
+    from app.config import settings
+    from app.services.codegen import generate_code
+    from app.services.diagram import generate_diagram
+    from app.services.retrieval import get_retriever
+    from app.services.runtime import run_sync
+
+    def generate(prompt: str) -> Tuple[str, List[str]]:
+        code = run_sync(generate_code(prompt))
+        if with_diagrams:
+            run_sync(generate_diagram(prompt, code))
+        retrieved = get_retriever().retrieve(prompt, 5) if settings.retrieval_enabled else []
+        return code, retrieved
+
+    return generate
+
+
 def main() -> None:
-    # Placeholder: simple echo generator; replace with actual model invocations
+    parser = argparse.ArgumentParser(description="Score generated code against references.")
+    parser.add_argument("--examples", help="JSONL of prompt/reference_code/relevant_snippets (default: one demo)")
+    parser.add_argument("--pipeline", action="store_true", help="generate with the app instead of the echo placeholder")
+    parser.add_argument("--diagrams", action="store_true", help="with --pipeline, also generate a diagram per prompt")
+    parser.add_argument("--mode", choices=["live", "record", "replay"], help="HF client mode (default: HF_CLIENT_MODE)")
+    parser.add_argument("--cassette", help="cassette directory (default: HF_CASSETTE_DIR)")
+    args = parser.parse_args()
+
+    if args.mode or args.cassette:
+        from app.config import settings
+
+        settings.hf_client_mode = args.mode or settings.hf_client_mode
+        settings.hf_cassette_dir = args.cassette or settings.hf_cassette_dir
+    if args.pipeline:
+        from app.config import settings
+
+        if settings.hf_client_mode != "live":
+            # retrieved examples come from the local history DB and are part of the prompt, so they
+            # would change the recorded request keys whenever that DB differs between record and replay
+            settings.retrieval_enabled = False
+
+    # Placeholder: simple echo generator; pass --pipeline for actual model invocations
     def fake_generator(prompt: str):
         return "print('demo')\n", ["snippet1", "snippet2"]
 
-    examples = [
+    examples = load_examples(args.examples) if args.examples else [
         Example(
             prompt="Write a function to add two integers in Python",
             reference_code="def add(a,b):\n    return a+b\n",
             relevant_snippets=["addition", "math"],
         )
     ]
-    report = run_benchmark(examples, fake_generator)
+    generator = pipeline_generator(args.diagrams) if args.pipeline else fake_generator
+    report = run_benchmark(examples, generator)
     print(json.dumps(report, indent=2))
 
 
 if __name__ == "__main__":
     main()
-
-
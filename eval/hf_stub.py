@@ -0,0 +1,183 @@
+import argparse
+import asyncio
+import json
+import random
+import struct
+import zlib
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict
+
+import uvicorn
+
+
+Scope = Dict[str, Any]
+Receive = Callable[[], Awaitable[Dict[str, Any]]]
+Send = Callable[[Dict[str, Any]], Awaitable[None]]
+
+STUB_CODE = (
+    "def fibonacci(n):\n"
+    "    a, b = 0, 1\n"
+    "    for _ in range(n):\n"
+    "        a, b = b, a + b\n"
+    "    return a\n"
+)
+
+
+def _tiny_png() -> bytes:
+    """A valid 1x1 grey PNG, so clients can decode the stub's images."""
+
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xFFFFFFFF)
+
+    header = struct.pack(">IIBBBBB", 1, 1, 8, 0, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"IDAT", zlib.compress(b"\x00\x80")) + chunk(b"IEND", b"")
+
+
+STUB_IMAGE = _tiny_png()
+
+
+@dataclass
+class Latency:
+    """Latency distribution in milliseconds.
+
+    `fixed` always waits `mean_ms`; `uniform` draws from mean_ms +/- jitter_ms;
+    `exponential` has mean `mean_ms`; `lognormal` has median `mean_ms` and shape
+    `sigma` (long tails, like a queueing upstream).
+    """
+
+    mean_ms: float = 0.0
+    dist: str = "fixed"
+    jitter_ms: float = 0.0
+    sigma: float = 0.5
+
+    def sample(self, rng: random.Random) -> float:
+        if self.mean_ms <= 0:
+            return 0.0
+        if self.dist == "uniform":
+            return max(0.0, rng.uniform(self.mean_ms - self.jitter_ms, self.mean_ms + self.jitter_ms))
+        if self.dist == "exponential":
+            return rng.expovariate(1.0 / self.mean_ms)
+        if self.dist == "lognormal":
+            return rng.lognormvariate(0.0, self.sigma) * self.mean_ms
+        return self.mean_ms
+
+
+@dataclass
+class StubConfig:
+    text_latency: Latency = field(default_factory=Latency)
+    image_latency: Latency = field(default_factory=Latency)
+    token_interval_ms: float = 0.0
+    failure_rate: float = 0.0
+    failure_status: int = 503
+    code: str = STUB_CODE
+    seed: int | None = None
+
+
+def create_stub_app(config: StubConfig | None = None):
+    """ASGI app answering like the HF Inference API at /models/<model id>.
+
+    JSON bodies are text generation (`"stream": true` answers with server-sent
+    events, one token per line of `config.code`); any other body is text-to-image
+    and gets a PNG. A `config.failure_rate` share of requests fail with
+    `config.failure_status` after the sampled latency.
+    """
+    config = config or StubConfig()
+    rng = random.Random(config.seed)
+    stats = {"requests": 0, "failures": 0}
+
+    async def _respond(send: Send, status: int, body: bytes, content_type: str) -> None:
+        headers = [(b"content-type", content_type.encode()), (b"content-length", str(len(body)).encode())]
+        await send({"type": "http.response.start", "status": status, "headers": headers})
+        await send({"type": "http.response.body", "body": body})
+
+    async def _stream(send: Send) -> None:
+        await send(
+            {"type": "http.response.start", "status": 200, "headers": [(b"content-type", b"text/event-stream")]}
+        )
+        pieces = config.code.splitlines(keepends=True)
+        for i, piece in enumerate(pieces):
+            if config.token_interval_ms > 0 and i:
+                await asyncio.sleep(config.token_interval_ms / 1000)
+            event = {"token": {"id": i, "text": piece, "special": False}}
+            await send({"type": "http.response.body", "body": f"data:{json.dumps(event)}\n\n".encode(), "more_body": True})
+        final = {"token": {"id": len(pieces), "text": "</s>", "special": True}, "generated_text": config.code}
+        await send({"type": "http.response.body", "body": f"data:{json.dumps(final)}\n\n".encode()})
+
+    async def app(scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "lifespan":
+            while True:
+                message = await receive()
+                if message["type"] == "lifespan.startup":
+                    await send({"type": "lifespan.startup.complete"})
+                elif message["type"] == "lifespan.shutdown":
+                    await send({"type": "lifespan.shutdown.complete"})
+                    return
+        if scope["path"] == "/stats":
+            await _respond(send, 200, json.dumps(stats).encode(), "application/json")
+            return
+        if scope["method"] != "POST" or not scope["path"].startswith("/models/"):
+            await _respond(send, 404, b'{"error": "not found"}', "application/json")
+            return
+
+        body = b""
+        while True:
+            message = await receive()
+            body += message.get("body", b"")
+            if not message.get("more_body", False):
+                break
+        headers = dict(scope.get("headers", []))
+        is_json = headers.get(b"content-type", b"").startswith(b"application/json")
+        payload = json.loads(body or b"{}") if is_json else None
+
+        stats["requests"] += 1
+        latency = config.text_latency if is_json else config.image_latency
+        await asyncio.sleep(latency.sample(rng) / 1000)
+        if rng.random() < config.failure_rate:
+            stats["failures"] += 1
+            error = {"error": "Model is currently loading", "estimated_time": 20.0}
+            await _respond(send, config.failure_status, json.dumps(error).encode(), "application/json")
+            return
+
+        if payload is None:
+            await _respond(send, 200, STUB_IMAGE, "image/png")
+        elif payload.get("stream"):
+            await _stream(send)
+        else:
+            await _respond(send, 200, json.dumps([{"generated_text": config.code}]).encode(), "application/json")
+
+    app.stats = stats  # type: ignore[attr-defined]
+    return app
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Local stand-in for the HF Inference API (set HF_API_URL to it).")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--dist", choices=["fixed", "uniform", "exponential", "lognormal"], default="lognormal")
+    parser.add_argument("--text-latency-ms", type=float, default=800.0)
+    parser.add_argument("--image-latency-ms", type=float, default=3000.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="half-width for --dist uniform")
+    parser.add_argument("--sigma", type=float, default=0.5, help="shape for --dist lognormal")
+    parser.add_argument("--token-interval-ms", type=float, default=20.0, help="delay between streamed tokens")
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--failure-status", type=int, default=503)
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    def latency(mean_ms: float) -> Latency:
+        return Latency(mean_ms, args.dist, args.jitter_ms, args.sigma)
+
+    config = StubConfig(
+        text_latency=latency(args.text_latency_ms),
+        image_latency=latency(args.image_latency_ms),
+        token_interval_ms=args.token_interval_ms,
+        failure_rate=args.failure_rate,
+        failure_status=args.failure_status,
+        seed=args.seed,
+    )
+    print(f"HF stub on http://{args.host}:{args.port}; export HF_API_URL=http://{args.host}:{args.port}/models")
+    uvicorn.run(create_stub_app(config), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,299 @@
+import argparse
+import asyncio
+import itertools
+import json
+import math
+import random
+import time
+from collections import Counter, defaultdict
+from dataclasses import dataclass
+from typing import Any, Dict, Iterator, List, Sequence
+
+import httpx
+
+
+ENDPOINTS = ("generate", "stream", "history", "search", "health")
+
+
+@dataclass
+class WorkItem:
+    endpoint: str
+    prompt: str
+    session_id: str
+
+
+@dataclass
+class Result:
+    endpoint: str
+    ok: bool
+    latency: float
+    status: int | None = None
+    ttfb: float | None = None
+    error: str | None = None
+
+
+def load_workload(path: str, prompt_field: str | None = None) -> List[Dict[str, Any]]:
+    """Records of a JSONL workload; each needs a prompt (`prompt`, else `body`, else `title`)."""
+    records = []
+    with open(path, encoding="utf-8") as fh:
+        for line in fh:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            fields = [prompt_field] if prompt_field else ["prompt", "body", "title"]
+            prompt = next((record[f] for f in fields if isinstance(record.get(f), str)), None)
+            if prompt is not None:
+                records.append({**record, "prompt": prompt})
+    if not records:
+        raise ValueError(f"no prompts found in {path}")
+    return records
+
+
+def parse_mix(spec: str) -> Dict[str, float]:
+    """'generate=3,stream=1' -> endpoint weights."""
+    mix: Dict[str, float] = {}
+    for part in spec.split(","):
+        name, _, weight = part.strip().partition("=")
+        if name not in ENDPOINTS:
+            raise ValueError(f"unknown endpoint {name!r}; choose from {', '.join(ENDPOINTS)}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def work_items(records: Sequence[Dict[str, Any]], mix: Dict[str, float], sessions: int, seed: int | None) -> Iterator[WorkItem]:
+    """Endless stream of requests: records cycle in order, endpoints are drawn from `mix`
+    unless a record names its own `endpoint`."""
+    rng = random.Random(seed)
+    names, weights = list(mix), list(mix.values())
+    for i, record in enumerate(itertools.cycle(records)):
+        endpoint = record.get("endpoint") or rng.choices(names, weights)[0]
+        session_id = record.get("session_id") or f"load-{i % max(1, sessions)}"
+        yield WorkItem(endpoint, record["prompt"], session_id)
+
+
+async def send_request(client: httpx.AsyncClient, item: WorkItem) -> Result:
+    start = time.perf_counter()
+    try:
+        if item.endpoint == "stream":
+            return await _send_stream(client, item, start)
+        if item.endpoint == "generate":
+            resp = await client.post("/api/generate", json={"prompt": item.prompt, "session_id": item.session_id})
+        elif item.endpoint == "history":
+            resp = await client.get("/api/history", params={"session_id": item.session_id, "limit": 20})
+        elif item.endpoint == "search":
+            resp = await client.get("/api/search", params={"q": " ".join(item.prompt.split()[:3]) or "code"})
+        else:
+            resp = await client.get("/api/health")
+        await resp.aread()
+        latency = time.perf_counter() - start
+        ok = resp.is_success
+        return Result(item.endpoint, ok, latency, resp.status_code, error=None if ok else resp.text[:200])
+    except Exception as exc:
+        return Result(item.endpoint, False, time.perf_counter() - start, error=f"{type(exc).__name__}: {exc}")
+
+
+async def _send_stream(client: httpx.AsyncClient, item: WorkItem, start: float) -> Result:
+    ttfb = None
+    event = None
+    error = None
+    payload = {"prompt": item.prompt, "session_id": item.session_id}
+    async with client.stream("POST", "/api/generate/stream", json=payload) as resp:
+        async for line in resp.aiter_lines():
+            if line.startswith("event:"):
+                event = line[len("event:"):].strip()
+                if event == "token" and ttfb is None:
+                    ttfb = time.perf_counter() - start
+            elif line.startswith("data:") and event == "error":
+                error = line[len("data:"):].strip()
+        status = resp.status_code
+    ok = resp.is_success and error is None and event == "done"
+    if not ok and error is None:
+        error = f"stream ended after {event!r}"
+    return Result(item.endpoint, ok, time.perf_counter() - start, status, ttfb, error)
+
+
+def percentile(sorted_values: Sequence[float], q: float) -> float | None:
+    """Nearest-rank percentile of already sorted values."""
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(q * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def _latency_summary(values: List[float]) -> Dict[str, float | None]:
+    values = sorted(values)
+    ms = lambda v: None if v is None else round(v * 1000, 1)  # noqa: E731
+    return {
+        "mean_ms": ms(sum(values) / len(values)) if values else None,
+        "p50_ms": ms(percentile(values, 0.50)),
+        "p95_ms": ms(percentile(values, 0.95)),
+        "p99_ms": ms(percentile(values, 0.99)),
+        "max_ms": ms(values[-1]) if values else None,
+    }
+
+
+def summarize(results: Sequence[Result], duration: float, dropped: int = 0) -> Dict[str, Any]:
+    """Throughput, error rate and latency percentiles, overall and per endpoint."""
+    by_endpoint: Dict[str, List[Result]] = defaultdict(list)
+    for r in results:
+        by_endpoint[r.endpoint].append(r)
+
+    def _block(rs: Sequence[Result]) -> Dict[str, Any]:
+        errors = [r for r in rs if not r.ok]
+        block = {
+            "requests": len(rs),
+            "errors": len(errors),
+            "error_rate": round(len(errors) / len(rs), 4) if rs else 0.0,
+            "throughput_rps": round(len(rs) / duration, 2) if duration > 0 else None,
+            **_latency_summary([r.latency for r in rs]),
+            "status": dict(Counter(str(r.status) for r in rs)),
+        }
+        ttfb = [r.ttfb for r in rs if r.ttfb is not None]
+        if ttfb:
+            block["ttfb"] = _latency_summary(ttfb)
+        if errors:
+            block["sample_errors"] = list(dict.fromkeys(r.error for r in errors))[:3]
+        return block
+
+    report = {"duration_s": round(duration, 3), "dropped": dropped, "total": _block(results)}
+    report["endpoints"] = {name: _block(rs) for name, rs in sorted(by_endpoint.items())}
+    return report
+
+
+async def run_closed_loop(
+    client: httpx.AsyncClient, items: Iterator[WorkItem], concurrency: int, total: int | None, duration: float | None
+) -> List[Result]:
+    """`concurrency` virtual users, each sending its next request as soon as the last one finishes."""
+    results: List[Result] = []
+    deadline = time.perf_counter() + duration if duration else math.inf
+    issued = itertools.count()
+
+    async def _user() -> None:
+        while time.perf_counter() < deadline:
+            if total is not None and next(issued) >= total:
+                return
+            results.append(await send_request(client, next(items)))
+
+    await asyncio.gather(*(_user() for _ in range(concurrency)))
+    return results
+
+
+async def run_open_loop(
+    client: httpx.AsyncClient,
+    items: Iterator[WorkItem],
+    rate: float,
+    total: int | None,
+    duration: float | None,
+    max_in_flight: int,
+    poisson: bool = True,
+    seed: int | None = None,
+) -> tuple[List[Result], int]:
+    """Requests arrive at `rate` per second whether or not earlier ones finished.
+
+    Arrivals beyond `max_in_flight` outstanding requests are dropped and counted,
+    which shows the point where the server stops keeping up.
+    """
+    rng = random.Random(seed)
+    results: List[Result] = []
+    tasks: set[asyncio.Task] = set()
+    dropped = 0
+    start = time.perf_counter()
+    next_at = start
+    sent = 0
+    while (total is None or sent + dropped < total) and (duration is None or next_at - start < duration):
+        delay = next_at - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if len(tasks) >= max_in_flight:
+            dropped += 1
+        else:
+            task = asyncio.create_task(send_request(client, next(items)))
+            task.add_done_callback(lambda t: (tasks.discard(t), results.append(t.result())))
+            tasks.add(task)
+            sent += 1
+        next_at += rng.expovariate(rate) if poisson else 1.0 / rate
+    if tasks:
+        await asyncio.gather(*list(tasks))
+    return results, dropped
+
+
+async def run_load(
+    base_url: str,
+    records: Sequence[Dict[str, Any]],
+    mix: Dict[str, float],
+    concurrency: int = 8,
+    rate: float | None = None,
+    total: int | None = None,
+    duration: float | None = None,
+    max_in_flight: int = 1000,
+    poisson: bool = True,
+    sessions: int = 16,
+    seed: int | None = None,
+    timeout: float = 300.0,
+    transport: httpx.AsyncBaseTransport | None = None,
+) -> Dict[str, Any]:
+    if total is None and duration is None:
+        raise ValueError("give a request count or a duration")
+    items = work_items(records, mix, sessions, seed)
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=max(concurrency, 100))
+    async with httpx.AsyncClient(base_url=base_url, timeout=timeout, limits=limits, transport=transport) as client:
+        start = time.perf_counter()
+        if rate:
+            results, dropped = await run_open_loop(
+                client, items, rate, total, duration, max_in_flight, poisson, seed
+            )
+        else:
+            results, dropped = await run_closed_loop(client, items, concurrency, total, duration), 0
+        elapsed = time.perf_counter() - start
+    report = summarize(results, elapsed, dropped)
+    report["config"] = {
+        "base_url": base_url,
+        "mode": "open" if rate else "closed",
+        **({"rate": rate, "arrivals": "poisson" if poisson else "uniform"} if rate else {"concurrency": concurrency}),
+        "mix": mix,
+    }
+    return report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Replay a JSONL workload against the API at a concurrency or rate.")
+    parser.add_argument("workload", help="JSONL file; prompts come from `prompt`, `body` or `title`")
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--prompt-field", default=None)
+    parser.add_argument("--mix", default="generate=1", help=f"endpoint weights, e.g. generate=3,stream=1 ({', '.join(ENDPOINTS)})")
+    load = parser.add_mutually_exclusive_group()
+    load.add_argument("--concurrency", type=int, default=8, help="closed loop: simultaneous virtual users")
+    load.add_argument("--rate", type=float, help="open loop: arrivals per second")
+    parser.add_argument("--uniform-arrivals", action="store_true", help="with --rate, evenly spaced instead of Poisson")
+    parser.add_argument("--max-in-flight", type=int, default=1000, help="with --rate, drop arrivals beyond this")
+    parser.add_argument("--requests", type=int, help="stop after this many requests")
+    parser.add_argument("--duration", type=float, help="stop issuing requests after this many seconds")
+    parser.add_argument("--sessions", type=int, default=16, help="distinct session ids to spread history over")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--output", help="also write the JSON report here")
+    args = parser.parse_args()
+
+    report = asyncio.run(
+        run_load(
+            args.url,
+            load_workload(args.workload, args.prompt_field),
+            parse_mix(args.mix),
+            concurrency=args.concurrency,
+            rate=args.rate,
+            total=args.requests,
+            duration=args.duration if args.duration or args.requests else 30.0,
+            max_in_flight=args.max_in_flight,
+            poisson=not args.uniform_arrivals,
+            sessions=args.sessions,
+            seed=args.seed,
+        )
+    )
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as fh:
+            fh.write(text + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,29 +1,238 @@
-from typing import List, Tuple
+import argparse
+import functools
+import itertools
+import json
+import multiprocessing
+import os
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterable, Iterator, List, Sequence, Tuple
 
-import evaluate
-import sacrebleu
-from rouge_score import rouge_scorer
+from rouge_score import rouge_scorer, tokenize, tokenizers
+from sacrebleu.metrics import BLEU
+
+
+# bleu_stats and EvalTotals.result use BLEU._extract_corpus_statistics and
+# BLEU._compute_score_from_stats, which are private to sacrebleu: they are tied to
+# the sacrebleu==2.4.3 pin in requirements.txt, and tests/test_eval_metrics.py
+# fails if an upgrade removes or changes them.
+@functools.lru_cache(maxsize=None)
+def _bleu() -> BLEU:
+    # one per process; sacrebleu's defaults, as corpus_bleu uses
+    return BLEU()
+
+
+@functools.lru_cache(maxsize=None)
+def _stemmer():
+    return tokenizers.DefaultTokenizer(use_stemmer=True)._stemmer
+
+
+@functools.lru_cache(maxsize=1 << 16)
+def _stem(token: str) -> str:
+    # the Porter stemmer dominates ROUGE time; code repeats identifiers a lot
+    return _stemmer().stem(token)
+
+
+def rouge_tokens(text: str) -> List[str]:
+    """Tokens exactly as rouge_score's DefaultTokenizer(use_stemmer=True) produces them."""
+    tokens = tokenize.SPACES_RE.split(tokenize.NON_ALPHANUM_RE.sub(" ", text.lower()))
+    return [t for t in (_stem(x) if len(x) > 3 else x for x in tokens) if tokenize.VALID_TOKEN_RE.match(t)]
+
+
+def lcs_length(a: Sequence[str], b: Sequence[str]) -> int:
+    """Length of the longest common subsequence, bit-parallel (Hyyrö) over Python ints.
+
+    Same result as rouge_score's O(len(a) * len(b)) table, with one big-int step
+    per token of `b` instead of a Python loop per cell.
+    """
+    masks: Dict[str, int] = {}
+    for i, token in enumerate(a):
+        masks[token] = masks.get(token, 0) | (1 << i)
+    full = (1 << len(a)) - 1
+    v = full
+    for token in b:
+        u = v & masks.get(token, 0)
+        v = ((v + u) | (v - u)) & full
+    return len(a) - v.bit_count()
+
+
+def rouge_l(reference: str, prediction: str) -> float:
+    """ROUGE-L F1 of one pair, equal to RougeScorer(["rougeL"], use_stemmer=True)."""
+    target, pred = rouge_tokens(reference), rouge_tokens(prediction)
+    if not target or not pred:
+        return 0.0
+    lcs = lcs_length(target, pred)
+    return rouge_scorer.scoring.fmeasure(lcs / len(pred), lcs / len(target))
+
+
+def bleu_stats(references: Sequence[str], predictions: Sequence[str]) -> List[int]:
+    """Summed sacrebleu sufficient statistics; they add up across chunks of a corpus."""
+    totals = [0] * (2 + 2 * _bleu().max_ngram_order)
+    for stats in _bleu()._extract_corpus_statistics(list(predictions), [list(references)]):
+        for i, value in enumerate(stats):
+            totals[i] += value
+    return totals
+
+
+def _precision_recall(relevant: Sequence[str], retrieved: Sequence[str], k: int) -> Tuple[float, float]:
+    topk = retrieved[:k]
+    hit = len(set(relevant) & set(topk))
+    return hit / max(1, len(topk)), hit / max(1, len(relevant))
 
 
 def bleu_score(references: List[str], predictions: List[str]) -> float:
-    bleu = sacrebleu.corpus_bleu(predictions, [references])
-    return float(bleu.score)
+    return float(_bleu().corpus_score(predictions, [references]).score)
 
 
 def rouge_l_f1(references: List[str], predictions: List[str]) -> float:
-    scorer = rouge_scorer.RougeScorer(["rougeL"], use_stemmer=True)
-    scores = [scorer.score(r, p)["rougeL"].fmeasure for r, p in zip(references, predictions)]
+    scores = [rouge_l(r, p) for r, p in zip(references, predictions)]
     return float(sum(scores) / max(1, len(scores)))
 
 
 def precision_recall_at_k(relevant: List[List[str]], retrieved: List[List[str]], k: int) -> Tuple[float, float]:
-    precisions = []
-    recalls = []
-    for rel, ret in zip(relevant, retrieved):
-        topk = ret[:k]
-        hit = len(set(rel) & set(topk))
-        precisions.append(hit / max(1, len(topk)))
-        recalls.append(hit / max(1, len(rel)))
+    pairs = [_precision_recall(rel, ret, k) for rel, ret in zip(relevant, retrieved)]
+    precisions = [p for p, _ in pairs]
+    recalls = [r for _, r in pairs]
     return float(sum(precisions) / max(1, len(precisions))), float(sum(recalls) / max(1, len(recalls)))
 
 
+@dataclass
+class EvalTotals:
+    """Additive aggregates of an eval set: merge the totals of any split, then read `result()`."""
+
+    k: int = 5
+    examples: int = 0
+    bleu: List[int] = field(default_factory=list)
+    rouge_l_sum: float = 0.0
+    retrieval_examples: int = 0
+    precision_sum: float = 0.0
+    recall_sum: float = 0.0
+
+    def merge(self, other: "EvalTotals") -> "EvalTotals":
+        self.examples += other.examples
+        self.bleu = [a + b for a, b in itertools.zip_longest(self.bleu, other.bleu, fillvalue=0)]
+        self.rouge_l_sum += other.rouge_l_sum
+        self.retrieval_examples += other.retrieval_examples
+        self.precision_sum += other.precision_sum
+        self.recall_sum += other.recall_sum
+        return self
+
+    def result(self) -> Dict[str, Any]:
+        bleu = float(_bleu()._compute_score_from_stats(self.bleu).score) if self.examples else 0.0
+        n = max(1, self.retrieval_examples)
+        return {
+            "examples": self.examples,
+            "bleu": bleu,
+            "rougeL_f1": self.rouge_l_sum / max(1, self.examples),
+            f"precision@{self.k}": self.precision_sum / n,
+            f"recall@{self.k}": self.recall_sum / n,
+        }
+
+
+def score_chunk(chunk: Sequence[Dict[str, Any]], k: int = 5) -> EvalTotals:
+    """Totals of examples with `reference` and `prediction` (and optionally `relevant`/`retrieved`)."""
+    references = [ex["reference"] for ex in chunk]
+    predictions = [ex["prediction"] for ex in chunk]
+    totals = EvalTotals(k, len(chunk), bleu_stats(references, predictions))
+    totals.rouge_l_sum = sum(rouge_l(r, p) for r, p in zip(references, predictions))
+    for ex in chunk:
+        if ex.get("relevant") is not None and ex.get("retrieved") is not None:
+            precision, recall = _precision_recall(ex["relevant"], ex["retrieved"], k)
+            totals.retrieval_examples += 1
+            totals.precision_sum += precision
+            totals.recall_sum += recall
+    return totals
+
+
+def iter_totals(
+    examples: Iterable[Dict[str, Any]],
+    k: int = 5,
+    workers: int | None = None,
+    chunksize: int = 256,
+    max_pending: int | None = None,
+) -> Iterator[EvalTotals]:
+    """Score `examples` lazily in chunks on a process pool, yielding the running totals.
+
+    Each yielded value covers every example scored so far, so callers can report
+    partial results of long runs; the last one is the whole set. At most
+    `max_pending` chunks (default: two per worker) are in flight, so memory stays
+    bounded for any input size. `workers=1` scores in this process.
+    """
+    workers = workers or os.cpu_count() or 1
+    it = iter(examples)
+    chunks = iter(lambda: list(itertools.islice(it, chunksize)), [])
+    running = EvalTotals(k)
+    if workers <= 1:
+        for chunk in chunks:
+            yield running.merge(score_chunk(chunk, k))
+        return
+    max_pending = max_pending or 2 * workers
+    pool = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn"))
+    pending: "deque[Future[EvalTotals]]" = deque()
+    try:
+        for chunk in chunks:
+            while len(pending) >= max_pending:
+                yield running.merge(pending.popleft().result())
+            pending.append(pool.submit(score_chunk, chunk, k))
+        while pending:
+            yield running.merge(pending.popleft().result())
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+def evaluate(examples: Iterable[Dict[str, Any]], k: int = 5, **kwargs: Any) -> Dict[str, Any]:
+    """BLEU, mean ROUGE-L F1 and precision/recall@k of a (possibly huge) stream of examples."""
+    totals = EvalTotals(k)
+    for totals in iter_totals(examples, k, **kwargs):
+        pass
+    return totals.result()
+
+
+def iter_jsonl_examples(
+    path: str,
+    reference_field: str = "reference_code",
+    prediction_field: str = "prediction",
+    relevant_field: str = "relevant_snippets",
+    retrieved_field: str = "retrieved_snippets",
+) -> Iterator[Dict[str, Any]]:
+    """Examples read one line at a time from a JSONL file of predictions."""
+    with open(path, encoding="utf-8") as fh:
+        for line in fh:
+            if line.strip():
+                record = json.loads(line)
+                yield {
+                    "reference": record[reference_field],
+                    "prediction": record[prediction_field],
+                    "relevant": record.get(relevant_field),
+                    "retrieved": record.get(retrieved_field),
+                }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Score a JSONL file of predictions against references.")
+    parser.add_argument("predictions", help="JSONL with a reference and a prediction per line")
+    parser.add_argument("--reference-field", default="reference_code")
+    parser.add_argument("--prediction-field", default="prediction")
+    parser.add_argument("--relevant-field", default="relevant_snippets")
+    parser.add_argument("--retrieved-field", default="retrieved_snippets")
+    parser.add_argument("-k", type=int, default=5)
+    parser.add_argument("--workers", type=int, default=None, help="scoring processes (default: CPU count)")
+    parser.add_argument("--chunksize", type=int, default=256)
+    parser.add_argument("--progress-every", type=int, default=0, help="print partial results every N examples")
+    args = parser.parse_args()
+
+    examples = iter_jsonl_examples(
+        args.predictions, args.reference_field, args.prediction_field, args.relevant_field, args.retrieved_field
+    )
+    totals = EvalTotals(args.k)
+    reported = 0
+    for totals in iter_totals(examples, args.k, args.workers, args.chunksize):
+        if args.progress_every and totals.examples - reported >= args.progress_every:
+            reported = totals.examples
+            print(json.dumps({"partial": True, **totals.result()}), flush=True)
+    print(json.dumps(totals.result(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
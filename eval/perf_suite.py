@@ -0,0 +1,479 @@
+import argparse
+import asyncio
+import gc
+import importlib
+import json
+import math
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Sequence
+
+
+REFERENCE = "reference"
+
+# benchmark name -> setup(context) returning the zero-argument operation to time
+BENCHMARKS: Dict[str, Callable[["SuiteContext"], Callable[[], Any]]] = {}
+
+
+def benchmark(name: str):
+    def register(setup: Callable[["SuiteContext"], Callable[[], Any]]):
+        BENCHMARKS[name] = setup
+        return setup
+
+    return register
+
+
+@dataclass
+class SuiteContext:
+    """Shared state of one run: the database is filled once and reused by the DB benchmarks."""
+
+    db_rows: int = 20_000
+    sessions: int = 200
+    code_lines: int = 300
+    _filled: bool = field(default=False, repr=False)
+    _counter: int = field(default=0, repr=False)
+    _cleanups: List[Callable[[], Any]] = field(default_factory=list, repr=False)
+
+    def next_id(self) -> int:
+        self._counter += 1
+        return self._counter
+
+    def defer(self, cleanup: Callable[[], Any]) -> None:
+        """Run `cleanup` when the suite finishes (e.g. to undo a setup's global patches)."""
+        self._cleanups.append(cleanup)
+
+    def close(self) -> None:
+        while self._cleanups:
+            self._cleanups.pop()()
+
+    def fill_db(self) -> None:
+        """Fill the database to `db_rows` messages; `bench-0` gets a long history."""
+        if self._filled:
+            return
+        from app.storage import db
+
+        code = _sample_code(40)
+        batch = []
+        for i in range(self.db_rows):
+            session = "bench-0" if i % 4 == 0 else f"bench-{i % self.sessions}"
+            batch.append(
+                {
+                    "session_id": session,
+                    "user_prompt": f"prompt {i}: write a helper for task {i % 97}",
+                    "generated_code": code,
+                    "diagram_base64": None,
+                    "analysis": {"token_count": 200, "avg_cyclomatic_complexity": 2.0, "patterns": []},
+                }
+            )
+            if len(batch) == 1000:
+                db.save_messages(batch)
+                batch = []
+        if batch:
+            db.save_messages(batch)
+        self._filled = True
+
+
+def _sample_code(lines: int) -> str:
+    from eval.analysis_benchmark import synthetic_code
+
+    return synthetic_code(lines)
+
+
+@benchmark("analyze_code")
+def _analyze_code(ctx: SuiteContext) -> Callable[[], Any]:
+    from app.services.analysis import analyze_code, unit_cache
+
+    code = _sample_code(ctx.code_lines)
+
+    def run() -> Any:
+        unit_cache.clear()
+        return analyze_code(code)
+
+    return run
+
+
+@benchmark("analyze_code_cached")
+def _analyze_code_cached(ctx: SuiteContext) -> Callable[[], Any]:
+    from app.services.analysis import analyze_code
+
+    code = _sample_code(ctx.code_lines)
+    analyze_code(code)
+    return lambda: analyze_code(code)
+
+
+@benchmark("save_message")
+def _save_message(ctx: SuiteContext) -> Callable[[], Any]:
+    from app.storage import db
+
+    ctx.fill_db()
+    code = _sample_code(40)
+    analysis = {"token_count": 200, "avg_cyclomatic_complexity": 2.0, "patterns": ["for_loop"]}
+    return lambda: db.save_message(f"bench-{ctx.next_id() % ctx.sessions}", "new prompt", code, None, analysis)
+
+
+@benchmark("fetch_history")
+def _fetch_history(ctx: SuiteContext) -> Callable[[], Any]:
+    from app.storage import db
+
+    ctx.fill_db()
+    return lambda: db.fetch_history("bench-0", limit=50)
+
+
+@benchmark("fetch_history_page")
+def _fetch_history_page(ctx: SuiteContext) -> Callable[[], Any]:
+    from app.storage import db
+
+    ctx.fill_db()
+    newest = db.fetch_history("bench-0", limit=200, fields=["id"])
+    cursor = newest[0]["id"]
+    return lambda: db.fetch_history("bench-0", limit=50, before_id=cursor, fields=["id", "user_prompt", "created_at"])
+
+
+@benchmark("diagram_base64")
+def _diagram_base64(ctx: SuiteContext) -> Callable[[], Any]:
+    from app.services.hf_clients import HFInferenceClient
+
+    image = os.urandom(512 * 1024)  # a typical SD diagram PNG
+    return lambda: HFInferenceClient.image_bytes_to_base64(image)
+
+
+@benchmark("build_prompts")
+def _build_prompts(ctx: SuiteContext) -> Callable[[], Any]:
+    from app.services.codegen import build_codegen_prompt
+    from app.services.diagram import build_diagram_prompt
+
+    examples = [_sample_code(20)] * 3
+    prompt = "Write a Flask route that paginates  search results\n with keyset cursors"
+
+    def run() -> Any:
+        build_codegen_prompt(prompt, examples)
+        return build_diagram_prompt(prompt, examples[0])
+
+    return run
+
+
+@benchmark("orchestrate")
+def _orchestrate(ctx: SuiteContext) -> Callable[[], Any]:
+    """The whole Gradio pipeline against the zero-latency HF stub (no network, no response cache)."""
+    import httpx
+
+    from app.config import settings
+    from app.frontend.gradio_app import orchestrate
+    from app.services import hf_clients
+    from app.services.runtime import run_sync
+    from app.storage.writer import writer
+    from eval.hf_stub import StubConfig, create_stub_app
+
+    stub = create_stub_app(StubConfig(code=_sample_code(40), seed=0))
+    clients: Dict[Any, httpx.AsyncClient] = {}
+
+    def _stub_client() -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        if loop not in clients:
+            clients[loop] = httpx.AsyncClient(transport=httpx.ASGITransport(app=stub))
+        return clients[loop]
+
+    patched = {"response_cache_enabled": False, "hf_client_mode": "live", "hf_api_url": "http://stub/models"}
+    saved = {name: getattr(settings, name) for name in patched}
+    original_client = hf_clients.get_http_client
+
+    def _restore() -> None:
+        hf_clients.get_http_client = original_client
+        for name, value in saved.items():
+            setattr(settings, name, value)
+        for client in clients.values():
+            if not client.is_closed:
+                run_sync(client.aclose())
+
+    hf_clients.get_http_client = _stub_client
+    for name, value in patched.items():
+        setattr(settings, name, value)
+    ctx.defer(_restore)
+
+    def run() -> Any:
+        result = run_sync(orchestrate(f"write helper {ctx.next_id()}", "bench-orchestrate"))
+        writer.flush()
+        return result
+
+    return run
+
+
+def calibrate(fn: Callable[[], Any], min_time: float = 0.05, max_loops: int = 10_000) -> int:
+    """Loops per sample so that one sample lasts about `min_time` (after a warm-up call)."""
+    fn()
+    start = time.perf_counter()
+    fn()
+    once = max(time.perf_counter() - start, 1e-9)
+    return max(1, min(max_loops, math.ceil(min_time / once)))
+
+
+def sample(fn: Callable[[], Any], loops: int) -> float:
+    """Seconds per call over `loops` calls, with the GC disabled like timeit."""
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        start = time.perf_counter()
+        for _ in range(loops):
+            fn()
+        return (time.perf_counter() - start) / loops
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+
+
+def summarize(samples: Sequence[float], loops: int) -> Dict[str, Any]:
+    return {
+        "loops": loops,
+        "samples": list(samples),
+        "median": statistics.median(samples),
+        "mean": statistics.fmean(samples),
+        "stdev": statistics.stdev(samples) if len(samples) > 1 else 0.0,
+        "min": min(samples),
+    }
+
+
+def reference_workload() -> int:
+    """Fixed pure-Python work that no change to the repo can affect; it tracks machine speed."""
+    table: Dict[str, int] = {}
+    total = 0
+    for i in range(2000):
+        key = f"k{i % 97}"
+        table[key] = table.get(key, 0) + i
+        total += len(key) * (i & 7)
+    return total + sum(sorted(table.values())[:10])
+
+
+def _git_commit() -> str | None:
+    try:
+        out = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=10, check=True
+        )
+        return out.stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def environment() -> Dict[str, Any]:
+    import sqlalchemy
+
+    return {
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+        "sqlalchemy": sqlalchemy.__version__,
+        "git_commit": _git_commit(),
+    }
+
+
+def run_suite(
+    names: Sequence[str] | None = None,
+    repeats: int = 15,
+    min_time: float = 0.05,
+    context: SuiteContext | None = None,
+) -> Dict[str, Any]:
+    context = context or SuiteContext()
+    selected = list(names or BENCHMARKS)
+    unknown = set(selected) - set(BENCHMARKS)
+    if unknown:
+        raise ValueError(f"unknown benchmarks: {', '.join(sorted(unknown))}; choose from {', '.join(BENCHMARKS)}")
+    try:
+        ops = {name: BENCHMARKS[name](context) for name in selected}
+        ops[REFERENCE] = reference_workload
+        loops = {name: calibrate(op, min_time) for name, op in ops.items()}
+        samples: Dict[str, list] = {name: [] for name in ops}
+        # round-robin, so drift over the run (thermal, noisy neighbours) spreads over all
+        # benchmarks' samples instead of biasing whichever ran during it
+        for _ in range(repeats):
+            for name, op in ops.items():
+                samples[name].append(sample(op, loops[name]))
+    finally:
+        context.close()
+    results = {name: summarize(samples[name], loops[name]) for name in ops}
+    return {
+        "created": datetime.now(timezone.utc).isoformat(),
+        "environment": environment(),
+        "config": {
+            "repeats": repeats,
+            "min_time": min_time,
+            "db_rows": context.db_rows,
+            "code_lines": context.code_lines,
+        },
+        "reference": results.pop(REFERENCE),
+        "benchmarks": results,
+    }
+
+
+def mann_whitney_greater(current: Sequence[float], baseline: Sequence[float]) -> float:
+    """One-sided p-value that `current` tends to be larger than `baseline`.
+
+    Mann-Whitney U with the normal approximation, tie and continuity corrected;
+    it makes no assumption about the (usually skewed) timing distributions.
+    """
+    n1, n2 = len(current), len(baseline)
+    if not n1 or not n2:
+        return 1.0
+    values = sorted([(v, 0) for v in current] + [(v, 1) for v in baseline])
+    ranks = [0.0] * len(values)
+    ties = 0.0
+    i = 0
+    while i < len(values):
+        j = i
+        while j + 1 < len(values) and values[j + 1][0] == values[i][0]:
+            j += 1
+        for k in range(i, j + 1):
+            ranks[k] = (i + j) / 2 + 1
+        t = j - i + 1
+        ties += t**3 - t
+        i = j + 1
+    r1 = sum(rank for rank, (_, group) in zip(ranks, values) if group == 0)
+    u1 = r1 - n1 * (n1 + 1) / 2
+    n = n1 + n2
+    variance = n1 * n2 / 12 * ((n + 1) - ties / (n * (n - 1)))
+    if variance <= 0:
+        return 1.0
+    z = (u1 - n1 * n2 / 2 - 0.5) / math.sqrt(variance)
+    return 0.5 * math.erfc(z / math.sqrt(2))
+
+
+def _relative(result: Dict[str, Any], reference: Dict[str, Any] | None) -> List[float]:
+    if reference is None or len(reference["samples"]) != len(result["samples"]):
+        return result["samples"]
+    return [s / r for s, r in zip(result["samples"], reference["samples"])]
+
+
+def compare(
+    current: Dict[str, Any],
+    baseline: Dict[str, Any],
+    alpha: float = 0.01,
+    threshold: float = 0.05,
+    normalize: bool = True,
+) -> Dict[str, Any]:
+    """Per-benchmark verdicts against `baseline`.
+
+    A benchmark regressed when its median is more than `threshold` slower and the
+    slowdown is significant (one-sided Mann-Whitney p < `alpha`); "improved" is the
+    mirror image; anything else is "unchanged". With `normalize`, each sample is
+    divided by the reference workload's sample of the same round first, so a
+    machine that is slower or faster as a whole does not count as a change.
+    """
+    rows = {}
+    normalize = normalize and "reference" in current and "reference" in baseline
+    for name, result in current["benchmarks"].items():
+        base = baseline["benchmarks"].get(name)
+        if base is None:
+            rows[name] = {"status": "new", "median": result["median"]}
+            continue
+        cur_samples = _relative(result, current.get("reference") if normalize else None)
+        base_samples = _relative(base, baseline.get("reference") if normalize else None)
+        base_median = statistics.median(base_samples)
+        ratio = statistics.median(cur_samples) / base_median if base_median else math.inf
+        p_slower = mann_whitney_greater(cur_samples, base_samples)
+        p_faster = mann_whitney_greater(base_samples, cur_samples)
+        if ratio > 1 + threshold and p_slower < alpha:
+            status = "regressed"
+        elif ratio < 1 - threshold and p_faster < alpha:
+            status = "improved"
+        else:
+            status = "unchanged"
+        rows[name] = {
+            "status": status,
+            "median": result["median"],
+            "baseline_median": base["median"],
+            "change": round(ratio - 1, 4),
+            "raw_change": round(result["median"] / base["median"] - 1, 4) if base["median"] else None,
+            "p_value": round(p_slower if ratio >= 1 else p_faster, 6),
+        }
+    keys = ("python", "implementation", "machine", "processor", "cpu_count")
+    mismatched = [k for k in keys if current["environment"].get(k) != baseline["environment"].get(k)]
+    return {
+        "regressions": sorted(n for n, r in rows.items() if r["status"] == "regressed"),
+        "normalized": normalize,
+        "environment_mismatch": mismatched,
+        "baseline_created": baseline.get("created"),
+        "benchmarks": rows,
+    }
+
+
+def _load(path: str) -> Dict[str, Any]:
+    with open(path, encoding="utf-8") as fh:
+        return json.load(fh)
+
+
+def _save(path: str, data: Dict[str, Any]) -> None:
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w", encoding="utf-8") as fh:
+        json.dump(data, fh, indent=2)
+        fh.write("\n")
+
+
+def _use_database(path: str) -> None:
+    # settings and the engine are built at import; if the app is already loaded with another
+    # database (e.g. main() called in-process), rebuild them for `path`
+    config = sys.modules.get("app.config")
+    if config is None or config.settings.database_path == path:
+        return
+    from app.storage import db
+
+    importlib.reload(config)
+    importlib.reload(db)
+
+
+def main(argv: Sequence[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the hot paths and gate on regressions against a baseline.")
+    parser.add_argument("benchmarks", nargs="*", help=f"subset to run (default: all of {', '.join(BENCHMARKS)})")
+    parser.add_argument("--repeats", type=int, default=15, help="timed samples per benchmark")
+    parser.add_argument("--min-time", type=float, default=0.05, help="seconds per sample (sets the loop count)")
+    parser.add_argument("--db-rows", type=int, default=20_000, help="messages in the benchmark database")
+    parser.add_argument("--db", help="database to fill and benchmark (default: a throwaway temp file)")
+    parser.add_argument("--results-dir", default=os.path.join("eval", "perf_results"))
+    parser.add_argument("--baseline", default=os.path.join("eval", "perf_results", "baseline.json"))
+    parser.add_argument("--save-baseline", action="store_true", help="store this run as the new baseline")
+    parser.add_argument("--alpha", type=float, default=0.01, help="significance level of the regression test")
+    parser.add_argument("--threshold", type=float, default=0.05, help="ignore median changes smaller than this")
+    parser.add_argument(
+        "--absolute", action="store_true", help="compare raw timings instead of timings relative to the reference"
+    )
+    args = parser.parse_args(argv)
+
+    # the DB benchmarks write thousands of bench-* messages: never into an exported DATABASE_PATH,
+    # only into a throwaway database or the one named explicitly with --db
+    tmpdir = tempfile.TemporaryDirectory(prefix="perf-suite-")
+    db_path = os.path.abspath(args.db) if args.db else os.path.join(tmpdir.name, "bench.db")
+    os.environ["DATABASE_PATH"] = db_path
+    os.environ.setdefault("WRITE_BEHIND", "0")
+    _use_database(db_path)
+
+    report = run_suite(args.benchmarks, args.repeats, args.min_time, SuiteContext(db_rows=args.db_rows))
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S.%fZ")
+    _save(os.path.join(args.results_dir, f"perf-{stamp}.json"), report)
+
+    status = 0
+    if args.save_baseline:
+        _save(args.baseline, report)
+        summary: Dict[str, Any] = {"baseline_saved": args.baseline}
+    elif os.path.exists(args.baseline):
+        summary = compare(report, _load(args.baseline), args.alpha, args.threshold, not args.absolute)
+        status = 1 if summary["regressions"] else 0
+    else:
+        summary = {"baseline_missing": args.baseline}
+    summary["medians_ms"] = {name: round(r["median"] * 1000, 4) for name, r in report["benchmarks"].items()}
+    print(json.dumps(summary, indent=2))
+    if summary.get("environment_mismatch"):
+        mismatched = ", ".join(summary["environment_mismatch"])
+        print(f"warning: baseline environment differs in {mismatched}", file=sys.stderr)
+    tmpdir.cleanup()
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,205 @@
+import argparse
+import io
+import json
+import math
+import multiprocessing
+import os
+import resource
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Sequence
+
+from eval.metrics import bleu_score, rouge_l
+
+
+MODES = ("peft_fp32", "merged_fp32", "merged_int8")
+
+DEFAULT_PROMPTS = [
+    "Write a Python function that returns the n-th Fibonacci number.",
+    "Write a Flask route that returns the current time as JSON.",
+    "Write a function that merges two sorted lists.",
+    "Write a SQL query that counts orders per customer.",
+    "Write a pytest test for a function add(a, b).",
+]
+
+
+def _load(mode: str, base_model: str, lora_dir: str, merged_dir: str):
+    import torch
+    from peft import PeftModel
+    from transformers import AutoModelForCausalLM, AutoTokenizer
+
+    from inference.lora_infer import load_merged
+
+    if mode == "peft_fp32":
+        # the current load_model path, pinned to fp32 on CPU
+        tokenizer = AutoTokenizer.from_pretrained(lora_dir)
+        if tokenizer.pad_token is None:
+            tokenizer.pad_token = tokenizer.eos_token
+        base = AutoModelForCausalLM.from_pretrained(base_model, torch_dtype=torch.float32)
+        model = PeftModel.from_pretrained(base, lora_dir).eval()
+        return tokenizer, model
+    tokenizer, model = load_merged(merged_dir, "int8" if mode == "merged_int8" else None)
+    return tokenizer, model.float().cpu() if mode == "merged_fp32" else model
+
+
+def _state_dict_bytes(model) -> int:
+    import torch
+
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return buffer.tell()
+
+
+def _continuation_nll(tokenizer, model, prompt: str, continuation: str) -> tuple[float, int]:
+    """Summed negative log-likelihood of `continuation` after `prompt`, and its token count."""
+    import torch
+
+    prompt_ids = tokenizer(prompt, return_tensors="pt")["input_ids"]
+    full_ids = tokenizer(prompt + continuation, return_tensors="pt")["input_ids"]
+    n = full_ids.shape[1] - prompt_ids.shape[1]
+    if n <= 0:
+        return 0.0, 0
+    with torch.inference_mode():
+        logits = model(full_ids).logits[0, -n - 1:-1].float()
+    logprobs = torch.log_softmax(logits, dim=-1)
+    targets = full_ids[0, -n:]
+    return float(-logprobs[torch.arange(n), targets].sum()), n
+
+
+def measure_mode(
+    mode: str,
+    base_model: str,
+    lora_dir: str,
+    merged_dir: str,
+    prompts: Sequence[str],
+    max_new_tokens: int,
+    references: Sequence[str] | None,
+    threads: int | None,
+) -> Dict[str, Any]:
+    """Load one variant in this (fresh) process and time greedy generation over `prompts`."""
+    import torch
+
+    if threads:
+        torch.set_num_threads(threads)
+    start = time.perf_counter()
+    tokenizer, model = _load(mode, base_model, lora_dir, merged_dir)
+    load_s = time.perf_counter() - start
+
+    def _generate(prompt: str) -> tuple[str, int]:
+        inputs = tokenizer(prompt, return_tensors="pt")
+        with torch.inference_mode():
+            out = model.generate(
+                **inputs, max_new_tokens=max_new_tokens, do_sample=False, pad_token_id=tokenizer.pad_token_id
+            )
+        new = out[0, inputs["input_ids"].shape[1]:]
+        return tokenizer.decode(new, skip_special_tokens=True), int(new.shape[0])
+
+    _generate(prompts[0])  # warm-up
+    texts, latencies, tokens = [], [], 0
+    for prompt in prompts:
+        start = time.perf_counter()
+        text, n = _generate(prompt)
+        latencies.append(time.perf_counter() - start)
+        texts.append(text)
+        tokens += n
+
+    nll, nll_tokens = 0.0, 0
+    for prompt, reference in zip(prompts, references or texts):
+        value, n = _continuation_nll(tokenizer, model, prompt, reference)
+        nll += value
+        nll_tokens += n
+    return {
+        "mode": mode,
+        "load_s": round(load_s, 2),
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "weights_mb": round(_state_dict_bytes(model) / 2**20, 1),
+        "mean_latency_ms": round(sum(latencies) / len(latencies) * 1000, 1),
+        "tokens_per_s": round(tokens / sum(latencies), 2) if sum(latencies) else None,
+        # perplexity of the fp32 reference outputs under this variant: drift from quantization
+        "reference_perplexity": round(math.exp(nll / nll_tokens), 4) if nll_tokens else None,
+        "texts": texts,
+    }
+
+
+def _in_fresh_process(*args: Any) -> Dict[str, Any]:
+    # one process per variant, so peak RSS is that variant's alone
+    with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context("spawn")) as pool:
+        return pool.submit(measure_mode, *args).result()
+
+
+def run(
+    base_model: str,
+    lora_dir: str,
+    merged_dir: str | None,
+    prompts: Sequence[str],
+    max_new_tokens: int = 64,
+    modes: Sequence[str] = MODES,
+    threads: int | None = None,
+) -> Dict[str, Any]:
+    tmp = None
+    if merged_dir is None and any(m.startswith("merged") for m in modes):
+        from inference.lora_infer import merge_and_export
+
+        tmp = tempfile.TemporaryDirectory(prefix="merged-")
+        merged_dir = merge_and_export(base_model, lora_dir, tmp.name)
+    try:
+        reference = _in_fresh_process(
+            "peft_fp32", base_model, lora_dir, merged_dir, prompts, max_new_tokens, None, threads
+        )
+        rows: List[Dict[str, Any]] = [reference]
+        for mode in modes:
+            if mode != "peft_fp32":
+                rows.append(
+                    _in_fresh_process(
+                        mode, base_model, lora_dir, merged_dir, prompts, max_new_tokens, reference["texts"], threads
+                    )
+                )
+    finally:
+        if tmp is not None:
+            tmp.cleanup()
+
+    for row in rows:
+        texts = row.pop("texts")
+        row["exact_match"] = sum(a == b for a, b in zip(texts, reference["texts"])) / len(texts)
+        row["rougeL_vs_fp32"] = round(sum(rouge_l(r, t) for r, t in zip(reference["texts"], texts)) / len(texts), 4)
+        row["bleu_vs_fp32"] = round(bleu_score(reference["texts"], texts), 2)
+        row["speedup"] = round(reference["mean_latency_ms"] / row["mean_latency_ms"], 2)
+        row["memory_ratio"] = round(row["peak_rss_mb"] / reference["peak_rss_mb"], 2)
+    return {
+        "base_model": base_model,
+        "lora_dir": lora_dir,
+        "prompts": len(prompts),
+        "max_new_tokens": max_new_tokens,
+        "threads": threads,
+        "modes": rows,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Latency, memory and output drift of the unmerged fp32, merged fp32 and merged int8 models."
+    )
+    parser.add_argument("--base-model", default=os.getenv("BASE_MODEL", "bigcode/starcoder2-3b"))
+    parser.add_argument("--lora-dir", default=os.getenv("LORA_DIR", "outputs/lora-codellama"))
+    parser.add_argument("--merged-dir", default=os.getenv("MERGED_DIR"), help="existing export (default: merge now)")
+    parser.add_argument("--prompts", help="JSONL with a `prompt` per line (default: five built-in prompts)")
+    parser.add_argument("--max-new-tokens", type=int, default=64)
+    parser.add_argument("--modes", default=",".join(MODES))
+    parser.add_argument("--threads", type=int, default=None, help="torch intra-op threads")
+    args = parser.parse_args()
+
+    prompts = DEFAULT_PROMPTS
+    if args.prompts:
+        with open(args.prompts, encoding="utf-8") as fh:
+            prompts = [json.loads(line)["prompt"] for line in fh if line.strip()]
+    modes = [m.strip() for m in args.modes.split(",") if m.strip()]
+    unknown = set(modes) - set(MODES)
+    if unknown:
+        parser.error(f"unknown modes {', '.join(sorted(unknown))}; choose from {', '.join(MODES)}")
+    report = run(args.base_model, args.lora_dir, args.merged_dir, prompts, args.max_new_tokens, modes, args.threads)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
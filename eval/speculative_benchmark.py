@@ -0,0 +1,153 @@
+import argparse
+import json
+import os
+import time
+from typing import Any, Callable, Dict, List, Sequence
+
+from eval.quantization_benchmark import DEFAULT_PROMPTS
+
+
+def replay_acceptance(
+    propose: Callable[[List[int], int], Sequence[int]],
+    prompt_ids: Sequence[int],
+    target_ids: Sequence[int],
+    lookahead: int,
+) -> Dict[str, int]:
+    """Replay greedy speculative decoding of `target_ids`, the main model's greedy completion.
+
+    At each step `propose(ids, n)` returns the draft's next (up to) `n` tokens
+    after `ids`; the longest run agreeing with the target is accepted and the
+    main model supplies the following token itself, as assisted generation does.
+    """
+    proposed = accepted = steps = pos = 0
+    while pos < len(target_ids):
+        proposal = list(propose([*prompt_ids, *target_ids[:pos]], min(lookahead, len(target_ids) - pos)))
+        n = 0
+        while n < len(proposal) and proposal[n] == target_ids[pos + n]:
+            n += 1
+        proposed += len(proposal)
+        accepted += n
+        steps += 1
+        pos += n + 1
+    return {"tokens": len(target_ids), "proposed": proposed, "accepted": accepted, "steps": steps}
+
+
+def run(
+    base_model: str,
+    lora_dir: str,
+    merged_dir: str | None,
+    draft_model: str,
+    prompts: Sequence[str],
+    max_new_tokens: int = 64,
+    lookaheads: Sequence[int] = (2, 4, 8),
+    threads: int | None = None,
+) -> Dict[str, Any]:
+    import torch
+
+    from inference.lora_infer import load_draft, load_merged, load_model
+
+    if threads:
+        torch.set_num_threads(threads)
+    tokenizer, model = load_merged(merged_dir) if merged_dir else load_model(base_model, lora_dir)
+    draft = load_draft(draft_model, lookaheads[0], model.dtype).to(model.device)
+
+    def _generate(prompt: str, assistant=None) -> tuple[List[int], List[int], float]:
+        inputs = tokenizer(prompt, return_tensors="pt").to(model.device)
+        start = time.perf_counter()
+        with torch.inference_mode():
+            out = model.generate(
+                **inputs,
+                max_new_tokens=max_new_tokens,
+                do_sample=False,
+                pad_token_id=tokenizer.pad_token_id,
+                assistant_model=assistant,
+            )
+        seconds = time.perf_counter() - start
+        prompt_ids = inputs["input_ids"][0].tolist()
+        return prompt_ids, out[0, len(prompt_ids):].tolist(), seconds
+
+    def _propose(ids: List[int], n: int) -> List[int]:
+        with torch.inference_mode():
+            out = draft.generate(
+                torch.tensor([ids], device=model.device),
+                max_new_tokens=n,
+                do_sample=False,
+                pad_token_id=tokenizer.pad_token_id,
+            )
+        return out[0, len(ids):].tolist()
+
+    _generate(prompts[0])  # warm-up
+    _generate(prompts[0], draft)
+    baseline = [_generate(prompt) for prompt in prompts]
+    tokens = sum(len(completion) for _, completion, _ in baseline)
+    baseline_s = sum(seconds for _, _, seconds in baseline)
+    rows: List[Dict[str, Any]] = []
+    for lookahead in lookaheads:
+        draft.generation_config.num_assistant_tokens = lookahead
+        assisted = [_generate(prompt, draft) for prompt in prompts]
+        seconds = sum(s for _, _, s in assisted)
+        totals = {"tokens": 0, "proposed": 0, "accepted": 0, "steps": 0}
+        for prompt_ids, completion, _ in baseline:
+            for key, value in replay_acceptance(_propose, prompt_ids, completion, lookahead).items():
+                totals[key] += value
+        rows.append(
+            {
+                "lookahead": lookahead,
+                "tokens_per_s": round(sum(len(c) for _, c, _ in assisted) / seconds, 2) if seconds else None,
+                "speedup": round(baseline_s / seconds, 2) if seconds else None,
+                "acceptance_rate": round(totals["accepted"] / totals["proposed"], 4) if totals["proposed"] else None,
+                # tokens produced per forward pass of the main model
+                "tokens_per_step": round(totals["tokens"] / totals["steps"], 2) if totals["steps"] else None,
+                "identical": sum(a[1] == b[1] for a, b in zip(assisted, baseline)) / len(prompts),
+            }
+        )
+    return {
+        "base_model": merged_dir or base_model,
+        "lora_dir": None if merged_dir else lora_dir,
+        "draft_model": draft_model,
+        "prompts": len(prompts),
+        "max_new_tokens": max_new_tokens,
+        "threads": threads,
+        "baseline_tokens_per_s": round(tokens / baseline_s, 2) if baseline_s else None,
+        "speculative": rows,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Acceptance rate, tokens/s and output equality of speculative (assisted) greedy decoding."
+    )
+    parser.add_argument("--base-model", default=os.getenv("BASE_MODEL", "bigcode/starcoder2-3b"))
+    parser.add_argument("--lora-dir", default=os.getenv("LORA_DIR", "outputs/lora-codellama"))
+    parser.add_argument("--merged-dir", default=os.getenv("MERGED_DIR"), help="load this merged export instead")
+    parser.add_argument("--draft-model", default=os.getenv("DRAFT_MODEL"), help="small model with the same tokenizer")
+    parser.add_argument("--prompts", help="JSONL with a `prompt` per line (default: five built-in prompts)")
+    parser.add_argument("--max-new-tokens", type=int, default=64)
+    parser.add_argument("--lookahead", default="2,4,8", help="comma-separated draft lookahead lengths to compare")
+    parser.add_argument("--threads", type=int, default=None, help="torch intra-op threads")
+    args = parser.parse_args()
+    if not args.draft_model:
+        parser.error("--draft-model (or DRAFT_MODEL) is required")
+
+    prompts = DEFAULT_PROMPTS
+    if args.prompts:
+        with open(args.prompts, encoding="utf-8") as fh:
+            prompts = [json.loads(line)["prompt"] for line in fh if line.strip()]
+    lookaheads = [int(k) for k in args.lookahead.split(",") if k.strip()]
+    if not lookaheads or min(lookaheads) < 1:
+        parser.error("--lookahead needs positive integers")
+    report = run(
+        args.base_model,
+        args.lora_dir,
+        args.merged_dir,
+        args.draft_model,
+        prompts,
+        args.max_new_tokens,
+        lookaheads,
+        args.threads,
+    )
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,4 @@
+import argparse
 import os
 from typing import Optional
 
@@ -20,30 +21,126 @@ def load_model(base_model: str, lora_dir: str):
     return tokenizer, model
 
 
-def generate(prompt: str, tokenizer, model, max_new_tokens: int = 256) -> str:
-    inputs = tokenizer(prompt, return_tensors="pt")
+def merge_and_export(base_model: str, lora_dir: str, output_dir: str) -> str:
+    """Fold the LoRA adapter into the base weights and save a plain model as safetensors.
+
+    The merged model loads with AutoModelForCausalLM alone and runs without the
+    adapter's extra matmuls in every forward pass.
+    """
+    tokenizer = AutoTokenizer.from_pretrained(lora_dir)
+    # merge in fp32: rounding the merged weights to fp16 first would add error
+    base = AutoModelForCausalLM.from_pretrained(base_model, torch_dtype=torch.float32)
+    merged = PeftModel.from_pretrained(base, lora_dir).merge_and_unload()
+    merged.save_pretrained(output_dir, safe_serialization=True)
+    tokenizer.save_pretrained(output_dir)
+    return output_dir
+
+
+def quantize_int8(model):
+    """Dynamic int8 quantization of the Linear layers for CPU inference.
+
+    Weights are stored as int8 and activations are quantized on the fly, which
+    shrinks the Linear weights about 4x and uses int8 matmul kernels.
+    """
+    return torch.ao.quantization.quantize_dynamic(model.float().cpu(), {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def load_merged(model_dir: str, quantize: Optional[str] = None):
+    """Load a `merge_and_export` output, optionally int8-quantized (CPU only)."""
+    tokenizer = AutoTokenizer.from_pretrained(model_dir)
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+    if quantize == "int8":
+        model = quantize_int8(AutoModelForCausalLM.from_pretrained(model_dir, torch_dtype=torch.float32))
+    elif quantize:
+        raise ValueError(f"unsupported quantization {quantize!r}; only int8 is available")
+    else:
+        model = AutoModelForCausalLM.from_pretrained(
+            model_dir,
+            torch_dtype=torch.float16 if torch.cuda.is_available() else torch.float32,
+        )
+    model.eval()
+    return tokenizer, model
+
+
+def load_draft(draft_model: str, lookahead: int = 5, dtype=None):
+    """A small causal LM that proposes `lookahead` tokens per step for assisted generation.
+
+    It must share the main model's tokenizer (e.g. a smaller model of the same family).
+    """
+    if dtype is None:
+        dtype = torch.float16 if torch.cuda.is_available() else torch.float32
+    draft = AutoModelForCausalLM.from_pretrained(draft_model, torch_dtype=dtype)
+    # a fixed lookahead, rather than transformers' adaptive default, so runs are comparable
+    draft.generation_config.num_assistant_tokens = lookahead
+    draft.generation_config.num_assistant_tokens_schedule = "constant"
+    draft.eval()
+    return draft
+
+
+def generate(
+    prompt: str,
+    tokenizer,
+    model,
+    max_new_tokens: int = 256,
+    draft=None,
+    temperature: float = 0.2,
+) -> str:
+    """Complete `prompt`; with a `load_draft` model, decode speculatively.
+
+    The draft proposes tokens and the main model checks them all in one forward
+    pass, keeping the longest agreeing run. At `temperature=0` (greedy) the
+    output is the same as without a draft.
+    """
+    inputs = tokenizer(prompt, return_tensors="pt").to(model.device)
     with torch.no_grad():
         outputs = model.generate(
             **inputs,
             max_new_tokens=max_new_tokens,
-            do_sample=True,
-            temperature=0.2,
-            top_p=0.9,
+            do_sample=temperature > 0,
+            temperature=temperature or None,
+            top_p=0.9 if temperature > 0 else None,
             pad_token_id=tokenizer.eos_token_id,
+            assistant_model=draft,
         )
     text = tokenizer.decode(outputs[0], skip_special_tokens=True)
     return text
 
 
 def main() -> None:
+    parser = argparse.ArgumentParser(description="Generate with a LoRA model, or export it merged.")
+    sub = parser.add_subparsers(dest="command")
+    export = sub.add_parser("export", help="merge the adapter into the base weights and save safetensors")
+    export.add_argument("--output-dir", default=os.getenv("MERGED_DIR", "outputs/merged"))
+    run = sub.add_parser("generate", help="generate from PROMPT (the default command)")
+    run.add_argument("--merged-dir", default=os.getenv("MERGED_DIR"), help="load this merged export instead")
+    run.add_argument("--quantize", choices=["int8"], default=os.getenv("QUANTIZE") or None)
+    run.add_argument("--draft-model", default=os.getenv("DRAFT_MODEL"), help="small model for speculative decoding")
+    run.add_argument("--lookahead", type=int, default=int(os.getenv("DRAFT_LOOKAHEAD", 5)))
+    run.add_argument("--temperature", type=float, default=0.2, help="0 for greedy decoding")
+    args = parser.parse_args()
+
     base = os.getenv("BASE_MODEL", "bigcode/starcoder2-3b")
     lora_dir = os.getenv("LORA_DIR", "outputs/lora-codellama")
+    if args.command == "export":
+        print(merge_and_export(base, lora_dir, args.output_dir))
+        return
     prompt = os.getenv("PROMPT", "Write a Python function to add two numbers")
-    tok, model = load_model(base, lora_dir)
-    print(generate(prompt, tok, model))
+    merged_dir = getattr(args, "merged_dir", None) or os.getenv("MERGED_DIR")
+    quantize = getattr(args, "quantize", None) or os.getenv("QUANTIZE") or None
+    if merged_dir:
+        tok, model = load_merged(merged_dir, quantize)
+    elif quantize:
+        parser.error("--quantize needs a merged export (--merged-dir); run the export command first")
+    else:
+        tok, model = load_model(base, lora_dir)
+    draft_model = getattr(args, "draft_model", None) or os.getenv("DRAFT_MODEL")
+    draft = None
+    if draft_model:
+        lookahead = getattr(args, "lookahead", None) or int(os.getenv("DRAFT_LOOKAHEAD", 5))
+        draft = load_draft(draft_model, lookahead, model.dtype).to(model.device)
+    print(generate(prompt, tok, model, draft=draft, temperature=getattr(args, "temperature", 0.2)))
 
 
 if __name__ == "__main__":
     main()
-
-
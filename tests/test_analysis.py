@@ -36,3 +36,107 @@ def fib(n):
 
 
 
+def test_complexity_matches_radon():
+    from radon.complexity import cc_visit
+
+    from app.services.analysis import cyclomatic_complexity
+
+    code = """
+import os
+
+class Loader:
+    def load(self, path):
+        assert path and os.path.exists(path)
+        try:
+            with open(path) as fh:
+                return [l for l in fh if l.strip() and not l.startswith("#")]
+        except OSError:
+            return []
+        else:
+            pass
+
+    class Inner:
+        def noop(self):
+            return 1 if self else 0
+
+def walk(items):
+    def visit(x):
+        while x:
+            x -= 1
+        return x
+    for item in items:
+        match item:
+            case 1:
+                pass
+            case _:
+                visit(item)
+    return items
+"""
+    blocks = cc_visit(code)
+    expected = sum(b.complexity for b in blocks) / len(blocks)
+    assert cyclomatic_complexity(code) == expected
+    assert analyze_code(code)["patterns"] == [
+        "class_definition", "function_definition", "for_loop", "while_loop",
+        "try_block", "except_block",
+    ]
+
+
+def test_invalid_python_falls_back_to_text_patterns():
+    code = "public class Main {\n  for (int i = 0; i < n; i++) {\n  }\n}\n"
+    result = analyze_code(code)
+    assert result["avg_cyclomatic_complexity"] == 0.0
+    assert "class_definition" in result["patterns"]
+
+
+def test_unit_cache_reanalyses_only_changed_units():
+    from app.services.analysis import AnalysisCache, split_units
+    from app.services import analysis
+
+    code = (
+        "import os\n\n"
+        "@staticmethod\n@other\ndef a(x):\n    return x if x else 0\n\n"
+        "class B:\n    def run(self):\n        for i in self:\n            pass\n\n"
+        "async def c():\n    while True:\n        break\n"
+    )
+    assert [u.split("\n", 1)[0] for u in split_units(code)] == ["import os", "@staticmethod", "class B:", "async def c():"]
+
+    cache = AnalysisCache(max_entries=16)
+    analysis.unit_cache, saved = cache, analysis.unit_cache
+    try:
+        first = analyze_code(code)
+        assert cache.stats()["misses"] == 4
+        # comments and blank lines do not change a unit's key
+        commented = analyze_code(code.replace("class B:", "# note\n\nclass B:"))
+        assert commented["avg_cyclomatic_complexity"] == first["avg_cyclomatic_complexity"]
+        assert cache.stats()["misses"] == 4
+        edited = code.replace("return x if x else 0", "return x or 0")
+        result = analyze_code(edited)
+        assert cache.stats()["misses"] == 5
+        analysis.settings.analysis_cache_entries, entries = 0, analysis.settings.analysis_cache_entries
+        try:
+            assert result == analyze_code(edited)
+        finally:
+            analysis.settings.analysis_cache_entries = entries
+    finally:
+        analysis.unit_cache = saved
+
+
+def test_analysis_cache_is_bounded():
+    from app.services.analysis import AnalysisCache
+
+    cache = AnalysisCache(max_entries=2)
+    for i in range(3):
+        cache.put(bytes([i]), ((i,), frozenset()))
+    assert cache.get(bytes([0])) is None
+    assert cache.get(bytes([2])) == ((2,), frozenset())
+    assert cache.stats()["evictions"] == 1
+
+
+def test_analyze_many_matches_analyze_code():
+    from app.services.analysis import analyze_many
+
+    items = [(i, f"def f{i}(x):\n    return x if x > {i} else {i}\n") for i in range(10)]
+    expected = [(key, analyze_code(code)) for key, code in items]
+    assert list(analyze_many(items, workers=1, chunksize=3)) == expected
+    assert list(analyze_many(iter(items), workers=2, chunksize=3, max_pending=1)) == expected
+    assert sorted(analyze_many(items, workers=2, chunksize=4, ordered=False)) == expected
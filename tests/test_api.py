@@ -1,8 +1,11 @@
+import asyncio
+import json
 import importlib
 import os
 import tempfile
 import base64
 
+import httpx
 import pytest
 
 
@@ -17,6 +20,10 @@ def app_client(monkeypatch):
     async def fake_generate_code(prompt: str) -> str:
         return "print('ok')\n"
 
+    async def fake_generate_code_stream(prompt: str):
+        for piece in ("print(", "'ok')\n"):
+            yield piece
+
     async def fake_generate_diagram(prompt: str, code: str | None) -> bytes:
         return base64.b64decode(base64.b64encode(b"img"))
 
@@ -24,12 +31,16 @@ def app_client(monkeypatch):
     from app.services import diagram as dg
 
     monkeypatch.setattr(cg, "generate_code", fake_generate_code)
+    monkeypatch.setattr(cg, "generate_code_stream", fake_generate_code_stream)
     monkeypatch.setattr(dg, "generate_diagram", fake_generate_diagram)
 
     # Reload config (pick env) and server
     from app import config as cfg
 
     importlib.reload(cfg)
+    from app.storage import db as sdb
+
+    importlib.reload(sdb)
     from app.api import server as api_server
 
     importlib.reload(api_server)
@@ -62,3 +73,120 @@ def test_generate_and_history(app_client):
     assert items[0]["user_prompt"] == "Say hi"
 
 
+
+
+def test_generate_stream_emits_events(app_client):
+    payload = {"prompt": "Say hi", "session_id": "s2"}
+    resp = app_client.post("/api/generate/stream", json=payload)
+    assert resp.status_code == 200
+    assert resp.mimetype == "text/event-stream"
+    body = resp.get_data(as_text=True)
+    events = [block.split("\n")[0].removeprefix("event: ") for block in body.strip().split("\n\n")]
+    assert events == ["token", "token", "code", "analysis", "diagram", "done"]
+    assert "print(" in body
+
+    hist = app_client.get("/api/history?session_id=s2")
+    assert hist.get_json()[0]["generated_code"] == "print('ok')\n"
+
+
+def test_diagram_endpoint_serves_blob_with_cache_headers(app_client):
+    app_client.post("/api/generate", json={"prompt": "Draw", "session_id": "s3"})
+    item = app_client.get("/api/history?session_id=s3").get_json()[0]
+    assert item["diagram_base64"] is None
+
+    resp = app_client.get(item["diagram_url"])
+    assert resp.status_code == 200
+    assert resp.data == b"img"
+    assert "immutable" in resp.headers["Cache-Control"]
+
+    cached = app_client.get(item["diagram_url"], headers={"If-None-Match": resp.headers["ETag"]})
+    assert cached.status_code == 304
+    assert app_client.get("/api/diagrams/" + "0" * 64).status_code == 404
+
+
+def test_history_pagination_params(app_client):
+    for i in range(3):
+        app_client.post("/api/generate", json={"prompt": f"p{i}", "session_id": "pg"})
+
+    resp = app_client.get("/api/history?session_id=pg&limit=2&fields=user_prompt")
+    assert [i["user_prompt"] for i in resp.get_json()] == ["p1", "p2"]
+    before = resp.headers["X-Next-Before-Id"]
+
+    older = app_client.get(f"/api/history?session_id=pg&limit=2&before_id={before}").get_json()
+    assert [i["user_prompt"] for i in older] == ["p0"]
+    assert app_client.get("/api/history?fields=bogus").status_code == 400
+    # a negative limit must not turn into SQLite's unbounded LIMIT -1
+    for limit in (-1, 0):
+        assert len(app_client.get(f"/api/history?session_id=pg&limit={limit}").get_json()) == 1
+
+
+def test_search_endpoint(app_client):
+    app_client.post("/api/generate", json={"prompt": "binary search tree", "session_id": "q1"})
+    data = app_client.get("/api/search?q=binary&session_id=q1").get_json()
+    assert [r["session_id"] for r in data["results"]] == ["q1"]
+    app_client.post("/api/generate", json={"prompt": "binary heap", "session_id": "q1"})
+    clamped = app_client.get("/api/search?q=binary&session_id=q1&limit=-1").get_json()
+    assert clamped["limit"] == 1 and len(clamped["results"]) == 1
+    assert app_client.get("/api/search").status_code == 400
+
+
+def test_metrics_endpoint(app_client):
+    app_client.post("/api/generate", json={"prompt": "Say hi", "session_id": "m1"})
+    resp = app_client.get("/metrics")
+    assert resp.status_code == 200
+    assert resp.content_type.startswith("text/plain")
+    text = resp.get_data(as_text=True)
+    assert 'app_requests_total{entrypoint="flask",route="/api/generate",status="200"}' in text
+    assert 'app_stage_duration_seconds_count{stage="analysis",model="local"}' in text
+
+    summary = app_client.get("/metrics?format=json").get_json()
+    assert summary["app_request_duration_seconds"][0]["p99"] is not None
+
+
+def test_request_trace_with_profile(app_client, tmp_path, monkeypatch):
+    from app.metrics import tracing
+
+    path = tmp_path / "traces.jsonl"
+    monkeypatch.setattr(tracing.settings, "trace_file", str(path))
+    monkeypatch.setattr(tracing.settings, "tracing_enabled", True)
+    monkeypatch.setattr(tracing.settings, "trace_allow_profile", True)
+
+    resp = app_client.post("/api/generate?profile=1", json={"prompt": "Say hi"}, headers={"X-Request-Id": "abc"})
+    assert resp.headers["X-Request-Id"] == "abc"
+    (record,) = [json.loads(line) for line in path.read_text().splitlines()]
+    assert record["request_id"] == "abc" and record["attrs"] == {"entrypoint": "flask"}
+    names = [s["name"] for s in record["spans"]]
+    assert "analyze_code" in names and "save_message" in names
+    assert isinstance(record["profile"], list)
+
+
+def test_generate_reports_failed_write_behind_insert(app_client, monkeypatch):
+    from app.storage import writer as writer_module
+
+    def broken_save_messages(messages):
+        raise RuntimeError("disk full")
+
+    monkeypatch.setattr(writer_module.settings, "write_behind", True)
+    monkeypatch.setattr(writer_module.db, "save_messages", broken_save_messages)
+    resp = app_client.post("/api/generate", json={"prompt": "p", "session_id": "wb"})
+    assert resp.status_code == 500
+
+
+def test_asgi_generate_reports_failed_write_behind_insert(app_client, monkeypatch):
+    from app.api import asgi as api_asgi
+    from app.storage import writer as writer_module
+
+    def broken_save_messages(messages):
+        raise RuntimeError("disk full")
+
+    importlib.reload(api_asgi)
+    monkeypatch.setattr(writer_module.settings, "write_behind", True)
+    monkeypatch.setattr(writer_module.db, "save_messages", broken_save_messages)
+
+    async def _post():
+        transport = httpx.ASGITransport(app=api_asgi.create_asgi_app())
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.post("/api/generate", json={"prompt": "p", "session_id": "wb"})
+
+    resp = asyncio.run(_post())
+    assert resp.status_code == 500 and resp.json()["error"] == "disk full"
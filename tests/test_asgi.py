@@ -0,0 +1,94 @@
+import asyncio
+import base64
+import importlib
+import json
+import os
+import tempfile
+
+import httpx
+import pytest
+
+
+@pytest.fixture()
+def asgi_app(monkeypatch):
+    fd, path = tempfile.mkstemp(suffix=".db")
+    os.close(fd)
+    monkeypatch.setenv("DATABASE_PATH", path)
+
+    async def fake_generate_code(prompt: str) -> str:
+        return "print('ok')\n"
+
+    async def fake_generate_code_stream(prompt: str):
+        yield "print('ok')\n"
+
+    async def fake_generate_diagram(prompt: str, code: str | None) -> bytes:
+        return base64.b64decode(base64.b64encode(b"img"))
+
+    from app.services import codegen as cg
+    from app.services import diagram as dg
+
+    monkeypatch.setattr(cg, "generate_code", fake_generate_code)
+    monkeypatch.setattr(cg, "generate_code_stream", fake_generate_code_stream)
+    monkeypatch.setattr(dg, "generate_diagram", fake_generate_diagram)
+
+    from app import config as cfg
+    from app.storage import db as sdb
+
+    importlib.reload(cfg)
+    importlib.reload(sdb)
+    from app.api import server as api_server
+    from app.api import asgi as api_asgi
+
+    importlib.reload(api_server)
+    importlib.reload(api_asgi)
+    return api_asgi.create_asgi_app()
+
+
+def _request(app, method: str, url: str, **kwargs) -> httpx.Response:
+    async def _send():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.request(method, url, **kwargs)
+
+    return asyncio.run(_send())
+
+
+def test_asgi_generate_and_history(asgi_app):
+    assert _request(asgi_app, "GET", "/api/health").json() == {"status": "ok"}
+
+    resp = _request(asgi_app, "POST", "/api/generate", json={"prompt": "Say hi", "session_id": "a1"})
+    assert resp.status_code == 200
+    data = resp.json()
+    assert data["generated_code"] == "print('ok')\n"
+    assert "token_count" in data["analysis"]
+
+    items = _request(asgi_app, "GET", "/api/history", params={"session_id": "a1"}).json()
+    assert [i["user_prompt"] for i in items] == ["Say hi"]
+
+
+def test_asgi_stream_and_fallback(asgi_app):
+    resp = _request(asgi_app, "POST", "/api/generate/stream", json={"prompt": "Say hi"})
+    assert resp.headers["content-type"] == "text/event-stream"
+    assert "event: done" in resp.text
+
+    # unknown routes fall through to the Flask app
+    assert _request(asgi_app, "GET", "/api/missing").status_code == 404
+
+
+def test_asgi_metrics(asgi_app):
+    _request(asgi_app, "GET", "/api/health")
+    text = _request(asgi_app, "GET", "/metrics").text
+    assert 'app_requests_total{entrypoint="asgi",route="/api/health",status="200"}' in text
+
+
+def test_asgi_request_trace(asgi_app, tmp_path, monkeypatch):
+    from app.metrics import tracing
+
+    path = tmp_path / "traces.jsonl"
+    monkeypatch.setattr(tracing.settings, "trace_file", str(path))
+    monkeypatch.setattr(tracing.settings, "trace_allow_profile", True)
+
+    resp = _request(asgi_app, "POST", "/api/generate", json={"prompt": "hi"}, headers={"X-Profile": "1"})
+    record = json.loads(path.read_text().splitlines()[-1])
+    assert resp.headers["x-request-id"] == record["request_id"]
+    assert "profile" in record and "analyze_code" in [s["name"] for s in record["spans"]]
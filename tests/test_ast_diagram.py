@@ -0,0 +1,69 @@
+import asyncio
+
+from app.services.ast_diagram import build_code_graph, render_svg
+
+
+CODE = """
+import os
+from typing import List
+
+
+class Base:
+    pass
+
+
+class Repo(Base):
+    def load(self):
+        return self.parse(os.listdir("."))
+
+    def parse(self, items: List[str]):
+        return helper(items)
+
+
+def helper(items):
+    return sorted(items)
+"""
+
+
+def test_build_code_graph_nodes_and_edges():
+    graph = build_code_graph(CODE)
+    kinds = {n: d["kind"] for n, d in graph.nodes(data=True)}
+    assert kinds["import:os"] == "import"
+    assert kinds["class:Repo"] == "class"
+    assert kinds["method:Repo.load"] == "method"
+    assert kinds["function:helper"] == "function"
+
+    edges = {(u, v): d["kind"] for u, v, d in graph.edges(data=True)}
+    assert edges[("class:Repo", "class:Base")] == "inherits"
+    assert edges[("method:Repo.load", "method:Repo.parse")] == "calls"
+    assert edges[("method:Repo.parse", "function:helper")] == "calls"
+    assert edges[("module", "import:typing")] == "imports"
+
+
+def test_render_svg_is_deterministic():
+    graph = build_code_graph(CODE)
+    svg = render_svg(graph)
+    assert svg.startswith(b"<svg")
+    assert b"Repo.load" in svg
+    assert render_svg(build_code_graph(CODE)) == svg
+
+
+def test_generate_diagram_ast_backend(monkeypatch):
+    from app.services import diagram as dg
+
+    monkeypatch.setattr(dg.settings, "diagram_backend", "ast")
+    monkeypatch.setattr(dg.settings, "diagram_format", "svg")
+
+    async def no_sd(prompt: str) -> bytes:
+        raise AssertionError("Stable Diffusion should not be called")
+
+    monkeypatch.setattr(dg, "_request_diagram", no_sd)
+    image = asyncio.run(dg.generate_diagram("repo", CODE))
+    assert image.startswith(b"<svg")
+
+    # unparseable code falls back to Stable Diffusion when enabled
+    async def fake_sd(prompt: str) -> bytes:
+        return b"png"
+
+    monkeypatch.setattr(dg, "_request_diagram", fake_sd)
+    assert asyncio.run(dg.generate_diagram("java", "public class A {}")) == b"png"
@@ -0,0 +1,50 @@
+import importlib
+import json
+import os
+import tempfile
+
+
+def _reload_db(monkeypatch):
+    fd, path = tempfile.mkstemp(suffix=".db")
+    os.close(fd)
+    monkeypatch.setenv("DATABASE_PATH", path)
+    from app import config as cfg
+
+    importlib.reload(cfg)
+    from app.storage import db as sdb
+
+    importlib.reload(sdb)
+    return sdb
+
+
+def test_batch_analysis_writes_back_missing_rows(monkeypatch, capsys):
+    sdb = _reload_db(monkeypatch)
+    from app.services import batch_analysis
+
+    done = sdb.save_message("s", "p", "x = 1", None, {"token_count": -1})
+    todo = [sdb.save_message("s", "p", f"def f{i}():\n    pass\n", None, None) for i in range(3)]
+    sdb.save_message("s", "p", None, None, None)
+
+    batch_analysis.main(["--db", "--missing-only", "--write", "--write-batch", "2", "--workers", "1"])
+    summary = json.loads(capsys.readouterr().out)
+    assert summary["analysed"] == 3 and summary["written"] == 3
+
+    rows = {r["id"]: r for r in sdb.fetch_history("s", limit=10)}
+    assert json.loads(rows[done]["analysis_json"]) == {"token_count": -1}
+    for message_id in todo:
+        assert "function_definition" in json.loads(rows[message_id]["analysis_json"])["patterns"]
+
+
+def test_batch_analysis_reads_jsonl(tmp_path, capsys):
+    from app.services import batch_analysis
+
+    src = tmp_path / "in.jsonl"
+    src.write_text(
+        json.dumps({"request_id": "a", "body": "for i in x:\n    pass\n"}) + "\n\n" + json.dumps({"request_id": "b"}) + "\n"
+    )
+    out = tmp_path / "out.jsonl"
+    batch_analysis.main(["--jsonl", str(src), "--code-field", "body", "--id-field", "request_id", "--output", str(out)])
+    assert json.loads(capsys.readouterr().out)["analysed"] == 1
+    (line,) = out.read_text().splitlines()
+    record = json.loads(line)
+    assert record["id"] == "a" and record["analysis"]["patterns"] == ["for_loop"]
@@ -0,0 +1,135 @@
+import asyncio
+import importlib
+import os
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+
+def _fresh_db(monkeypatch):
+    fd, path = tempfile.mkstemp(suffix=".db")
+    os.close(fd)
+    monkeypatch.setenv("DATABASE_PATH", path)
+
+    from app import config as cfg
+
+    importlib.reload(cfg)
+    from app.storage import db as sdb
+
+    importlib.reload(sdb)
+    return sdb
+
+
+def test_cache_key_normalizes_prompt():
+    from app.services.cache import make_cache_key
+
+    params = {"temperature": 0.2, "max_new_tokens": 8}
+    a = make_cache_key("m", "  Write   fib\n", params)
+    b = make_cache_key("m", "Write fib", dict(reversed(list(params.items()))))
+    assert a == b
+    assert a != make_cache_key("other", "Write fib", params)
+    assert a != make_cache_key("m", "Write fib", {**params, "temperature": 0.7})
+
+
+def test_memory_and_disk_tiers(monkeypatch):
+    _fresh_db(monkeypatch)
+    from app.services.cache import ResponseCache
+
+    cache = ResponseCache(max_memory_entries=1)
+    assert cache.get("k1") is None
+    cache.put("k1", "m", "one")
+    assert cache.get("k1") == "one"
+
+    # pushes k1 out of the memory tier; it must come back from SQLite
+    cache.put("k2", "m", "two")
+    assert cache.get("k1") == "one"
+
+    stats = cache.stats()
+    assert stats["misses"] == 1
+    assert stats["memory_hits"] == 1
+    assert stats["disk_hits"] == 1
+    assert stats["evictions"] >= 1
+
+
+def test_ttl_and_size_eviction(monkeypatch):
+    _fresh_db(monkeypatch)
+    from app.services.cache import ResponseCache
+
+    expired = ResponseCache(ttl_seconds=-1)
+    expired.put("k", "m", "value")
+    assert expired.get("k") is None
+
+    small = ResponseCache(max_memory_entries=0, max_disk_bytes=10)
+    small.put("a", "m", "x" * 6)
+    small.put("b", "m", "y" * 6)
+    assert small.get("a") is None
+    assert small.get("b") == "y" * 6
+
+
+def test_disk_hits_keep_their_expiry(monkeypatch):
+    sdb = _fresh_db(monkeypatch)
+    from app.services.cache import ResponseCache
+
+    cache = ResponseCache(max_memory_entries=1, ttl_seconds=60)
+    cache.put("k1", "m", "one")
+    cache.put("k2", "m", "two")  # k1 is now only on disk
+    with sdb.session_scope() as s:
+        s.get(sdb.ResponseCacheEntry, "k1").created_at = datetime.utcnow() - timedelta(seconds=59)
+    assert cache.get("k1") == "one"
+
+    # promoted into memory with 1s left, not a fresh 60s: two seconds on, both tiers have expired it
+    now = time.monotonic()
+    monkeypatch.setattr(time, "monotonic", lambda: now + 2)
+    with sdb.session_scope() as s:
+        s.get(sdb.ResponseCacheEntry, "k1").created_at = datetime.utcnow() - timedelta(seconds=61)
+    assert cache.get("k1") is None
+    assert cache.stats()["misses"] == 1
+
+
+def test_generate_code_hits_cache(monkeypatch):
+    _fresh_db(monkeypatch)
+    from app.services import codegen as cg
+    from app.services.cache import ResponseCache
+    from app.services.hf_clients import HFInferenceClient
+
+    calls = []
+
+    async def fake_text_generation(self, model_id, payload):
+        calls.append(payload)
+        return [{"generated_text": "print('fib')"}]
+
+    monkeypatch.setattr(HFInferenceClient, "text_generation", fake_text_generation)
+    monkeypatch.setattr(cg, "response_cache", ResponseCache())
+
+    first = asyncio.run(cg.generate_code("fib"))
+    second = asyncio.run(cg.generate_code("  fib "))
+    assert first == second == "print('fib')"
+    assert len(calls) == 1
+
+
+def test_async_access_keeps_sqlite_off_the_loop(monkeypatch):
+    sdb = _fresh_db(monkeypatch)
+    from app.services import cache as cache_module
+
+    threads = []
+    for name in ("cache_get", "cache_put"):
+        original = getattr(sdb, name)
+
+        def _record(*args, _original=original):
+            threads.append(threading.current_thread())
+            return _original(*args)
+
+        monkeypatch.setattr(cache_module.db, name, _record)
+
+    cache = cache_module.ResponseCache(max_memory_entries=1)
+
+    async def _roundtrip():
+        await cache.aput("k1", "m", "one")
+        await cache.aput("k2", "m", "two")  # k1 leaves the memory tier
+        return await cache.aget("k1"), await cache.aget("k1")  # from SQLite, then from memory
+
+    assert asyncio.run(_roundtrip()) == ("one", "one")
+    loop_thread = threading.main_thread()
+    assert len(threads) == 3 and all(t is not loop_thread for t in threads)
+    assert cache.stats()["disk_hits"] == 1 and cache.stats()["memory_hits"] == 1
@@ -0,0 +1,73 @@
+import json
+
+import sacrebleu
+from rouge_score import rouge_scorer
+
+from eval import metrics
+
+
+REFERENCES = [
+    "def add(a, b):\n    return a + b\n",
+    "class Parser:\n    def parsing(self, items):\n        return [i for i in items if i]\n",
+    "",
+    "for running in runs:\n    total += running\n",
+]
+PREDICTIONS = [
+    "def add(x, y):\n    return x + y\n",
+    "class Parser:\n    def parse(self, items):\n        return list(filter(None, items))\n",
+    "print('x')",
+    "for run in runs: total = total + run\n",
+]
+
+
+def _examples():
+    return [
+        {"reference": r, "prediction": p, "relevant": ["a", "b"], "retrieved": ["b", "c", "d"]}
+        for r, p in zip(REFERENCES, PREDICTIONS)
+    ]
+
+
+def test_fast_rouge_matches_rouge_score():
+    scorer = rouge_scorer.RougeScorer(["rougeL"], use_stemmer=True)
+    for r, p in zip(REFERENCES, PREDICTIONS):
+        assert metrics.rouge_l(r, p) == scorer.score(r, p)["rougeL"].fmeasure
+    assert metrics.lcs_length("abcbdab", "bdcaba") == 4
+
+
+def test_chunked_totals_match_corpus_scores():
+    expected_bleu = sacrebleu.corpus_bleu(PREDICTIONS, [REFERENCES]).score
+    totals = metrics.score_chunk(_examples()[:1]).merge(metrics.score_chunk(_examples()[1:]))
+    result = totals.result()
+    assert abs(result["bleu"] - expected_bleu) < 1e-9
+    assert abs(metrics.bleu_score(REFERENCES, PREDICTIONS) - expected_bleu) < 1e-9
+    assert abs(result["rougeL_f1"] - metrics.rouge_l_f1(REFERENCES, PREDICTIONS)) < 1e-12
+    assert result["precision@5"] == metrics.precision_recall_at_k([["a", "b"]], [["b", "c", "d"]], 5)[0]
+
+
+def test_iter_totals_streams_partial_results(tmp_path):
+    path = tmp_path / "preds.jsonl"
+    with open(path, "w") as fh:
+        for ex in _examples() * 3:
+            fh.write(json.dumps({"reference_code": ex["reference"], "prediction": ex["prediction"]}) + "\n")
+
+    counts = [t.examples for t in metrics.iter_totals(metrics.iter_jsonl_examples(str(path)), workers=1, chunksize=5)]
+    assert counts == [5, 10, 12]
+
+    serial = metrics.evaluate(metrics.iter_jsonl_examples(str(path)), workers=1, chunksize=5)
+    parallel = metrics.evaluate(metrics.iter_jsonl_examples(str(path)), workers=2, chunksize=5)
+    assert serial["examples"] == parallel["examples"] == 12
+    assert serial["bleu"] == parallel["bleu"]
+    assert abs(serial["rougeL_f1"] - parallel["rougeL_f1"]) < 1e-12
+    # no retrieval fields in the file: nothing to average
+    assert serial["precision@5"] == 0.0
+
+
+def test_sacrebleu_private_api_is_still_there():
+    # bleu_stats/EvalTotals rely on these private methods (pinned sacrebleu==2.4.3)
+    bleu = sacrebleu.metrics.BLEU()
+    for name in ("_extract_corpus_statistics", "_compute_score_from_stats"):
+        assert callable(getattr(bleu, name, None)), f"sacrebleu {sacrebleu.__version__} no longer has BLEU.{name}"
+    stats = metrics.bleu_stats(REFERENCES, PREDICTIONS)
+    assert len(stats) == 2 + 2 * bleu.max_ngram_order and all(isinstance(v, int) for v in stats)
+    # the private path must agree with the public corpus score
+    assert bleu._compute_score_from_stats(stats).score == bleu.corpus_score(PREDICTIONS, [REFERENCES]).score
@@ -2,9 +2,12 @@ import importlib
 import os
 import tempfile
 import base64
+import io
 
+import pytest
 
-def test_gradio_orchestration(monkeypatch):
+
+def _gradio_app(monkeypatch, diagram: bytes = b"img"):
     # Use a temp DB path before importing gradio app
     fd, path = tempfile.mkstemp(suffix=".db")
     os.close(fd)
@@ -14,21 +17,90 @@ def test_gradio_orchestration(monkeypatch):
     async def fake_generate_code(prompt: str) -> str:
         return "print('ok')\n"
 
+    async def fake_generate_code_stream(prompt: str):
+        for piece in ("print(", "'ok')\n"):
+            yield piece
+
     async def fake_generate_diagram(prompt: str, code: str | None) -> bytes:
-        return base64.b64decode(base64.b64encode(b"img"))
+        return base64.b64decode(base64.b64encode(diagram))
 
     from app.services import codegen as cg
     from app.services import diagram as dg
 
     monkeypatch.setattr(cg, "generate_code", fake_generate_code)
+    monkeypatch.setattr(cg, "generate_code_stream", fake_generate_code_stream)
     monkeypatch.setattr(dg, "generate_diagram", fake_generate_diagram)
 
+    from app import config as cfg
+    from app.storage import db as sdb
+
+    importlib.reload(cfg)
+    importlib.reload(sdb)
     from app.frontend import gradio_app as ga
 
     importlib.reload(ga)
+    return ga
+
+
+def test_gradio_orchestration(monkeypatch):
+    ga = _gradio_app(monkeypatch)
     code, b64, analysis = ga._orchestrate_sync("Say hi", "s1")
     assert code.startswith("print")
     assert isinstance(b64, str)
     assert "token_count" in analysis
 
 
+
+    updates = list(ga._orchestrate_stream_sync("Say hi", "s2"))
+    assert updates[0] == ("print(", None, None)
+    final_code, final_b64, final_analysis = updates[-1]
+    assert final_code == "print('ok')\n"
+    assert isinstance(final_b64, str)
+    assert "latency_ms" in final_analysis
+
+
+def test_gradio_surfaces_failed_writes(monkeypatch):
+    ga = _gradio_app(monkeypatch)
+    from app.storage import writer as writer_module
+
+    def broken_save_messages(messages):
+        raise RuntimeError("disk full")
+
+    monkeypatch.setattr(writer_module.settings, "write_behind", True)
+    monkeypatch.setattr(writer_module.db, "save_messages", broken_save_messages)
+    with pytest.raises(RuntimeError, match="disk full"):
+        ga._orchestrate_sync("Say hi", "s3")
+    with pytest.raises(RuntimeError, match="disk full"):
+        list(ga._orchestrate_stream_sync("Say hi", "s4"))
+
+
+def test_gradio_submit_yields_a_displayable_image(monkeypatch):
+    import gradio as gr
+    from PIL import Image
+
+    buf = io.BytesIO()
+    Image.new("RGB", (4, 3), "red").save(buf, format="PNG")
+    ga = _gradio_app(monkeypatch, diagram=buf.getvalue())
+
+    updates = list(ga._on_submit("Say hi", "s5"))
+    assert updates[0][1] is None
+    final_code, image, final_analysis = updates[-1]
+    assert final_code == "print('ok')\n"
+    assert isinstance(image, Image.Image) and image.size == (4, 3)
+    assert "latency_ms" in final_analysis
+    assert gr.Image().postprocess(image) is not None
+    # bytes that aren't an image leave the output empty instead of failing the stream
+    assert ga._diagram_image(base64.b64encode(b"img").decode()) is None
+
+
+def test_gradio_submit_shows_svg_diagrams(monkeypatch):
+    import gradio as gr
+
+    svg = b'<svg xmlns="http://www.w3.org/2000/svg" width="4" height="3"><rect width="4" height="3"/></svg>'
+    ga = _gradio_app(monkeypatch, diagram=svg)
+
+    _, image, _ = list(ga._on_submit("Say hi", "s6"))[-1]
+    assert isinstance(image, str) and image.endswith(".svg")
+    with open(image, "rb") as fh:
+        assert fh.read() == svg
+    assert gr.Image().postprocess(image).path == image
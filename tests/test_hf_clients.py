@@ -0,0 +1,139 @@
+import asyncio
+import threading
+import time
+
+import httpx
+import pytest
+
+from app.services import hf_clients
+from app.services.cassette import Cassette, CassetteMiss, request_key
+from app.services.hf_clients import HFInferenceClient, get_http_client
+from app.services.runtime import run_sync
+
+
+def test_pooled_client_is_reused_per_loop():
+    async def _two_clients():
+        return get_http_client(), get_http_client()
+
+    first, second = run_sync(_two_clients())
+    assert first is second
+    assert not first.is_closed
+
+    # a different loop gets its own pool
+    other, _ = asyncio.run(_two_clients())
+    assert other is not first
+
+
+def test_text_generation_uses_injected_client():
+    def handler(request: httpx.Request) -> httpx.Response:
+        assert request.url.path.endswith("/some/model")
+        return httpx.Response(200, json=[{"generated_text": "print('hi')"}])
+
+    async def _call():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as http:
+            client = HFInferenceClient(token="t", client=http)
+            return await client.text_generation("some/model", {"inputs": "x"})
+
+    result = asyncio.run(_call())
+    assert result[0]["generated_text"] == "print('hi')"
+    assert hf_clients.HF_API_URL.startswith("https://")
+
+
+def test_text_generation_stream_parses_sse():
+    body = (
+        'data:{"token": {"text": "def", "special": false}}\n\n'
+        'data:{"token": {"text": " f()", "special": false}}\n\n'
+        'data:{"token": {"text": "</s>", "special": true}, "generated_text": "def f()"}\n\n'
+    )
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        assert b'"stream": true' in request.content or b'"stream":true' in request.content
+        return httpx.Response(200, text=body, headers={"content-type": "text/event-stream"})
+
+    async def _collect():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as http:
+            client = HFInferenceClient(client=http)
+            return [p async for p in client.text_generation_stream("m", {"inputs": "x"})]
+
+    assert asyncio.run(_collect()) == ["def", " f()"]
+
+
+def test_record_then_replay_offline(tmp_path):
+    sse = (
+        'data:{"token": {"text": "def", "special": false}}\n\n'
+        'data:{"token": {"text": " f()", "special": false}}\n\n'
+    )
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        if request.headers.get("content-type", "").startswith("application/json"):
+            if b'"stream"' in request.content:
+                return httpx.Response(200, text=sse, headers={"content-type": "text/event-stream"})
+            return httpx.Response(200, json=[{"generated_text": "print('hi')"}])
+        return httpx.Response(200, content=b"\x89PNG fake")
+
+    def offline(request: httpx.Request) -> httpx.Response:
+        raise AssertionError("replay must not touch the network")
+
+    async def _calls(transport, mode, cassette):
+        async with httpx.AsyncClient(transport=transport) as http:
+            client = HFInferenceClient(client=http, mode=mode, cassette=cassette)
+            text = await client.text_generation("m", {"inputs": "x"})
+            pieces = [p async for p in client.text_generation_stream("m", {"inputs": "x"})]
+            image = await client.text_to_image("sd", "a diagram")
+            return text, pieces, image
+
+    recorded = asyncio.run(_calls(httpx.MockTransport(handler), "record", Cassette(str(tmp_path))))
+    assert recorded == ([{"generated_text": "print('hi')"}], ["def", " f()"], b"\x89PNG fake")
+
+    # a fresh cassette object reads what was written to disk
+    cassette = Cassette(str(tmp_path))
+    assert len(cassette) == 3
+    assert asyncio.run(_calls(httpx.MockTransport(offline), "replay", cassette)) == recorded
+
+    async def _unknown():
+        client = HFInferenceClient(mode="replay", cassette=cassette)
+        await client.text_generation("m", {"inputs": "never recorded"})
+
+    with pytest.raises(CassetteMiss):
+        asyncio.run(_unknown())
+
+
+def test_replay_simulates_recorded_latency(tmp_path):
+    cassette = Cassette(str(tmp_path), latency_scale=1.0)
+    key = request_key("text-generation", "m", {"inputs": "x"})
+    cassette._append({"key": key, "task": "text-generation", "model": "m", "latency_ms": 50.0, "json": {"ok": 1}})
+
+    async def _replay():
+        start = time.perf_counter()
+        result = await HFInferenceClient(mode="replay", cassette=cassette).text_generation("m", {"inputs": "x"})
+        return result, time.perf_counter() - start
+
+    result, elapsed = asyncio.run(_replay())
+    assert result == {"ok": 1} and elapsed >= 0.045
+
+    cassette.latency_scale = 0.0
+    assert asyncio.run(_replay())[1] < 0.045
+
+
+def test_cassette_files_are_written_off_the_event_loop(tmp_path, monkeypatch):
+    cassette = Cassette(str(tmp_path))
+    threads = []
+    for name in ("_append", "_lookup"):
+        original = getattr(cassette, name)
+
+        def _record(*args, _original=original):
+            threads.append(threading.current_thread())
+            return _original(*args)
+
+        monkeypatch.setattr(cassette, name, _record)
+
+    async def _roundtrip():
+        async def call():
+            return {"ok": 1}
+
+        await cassette.record_json("text-generation", "m", {"inputs": "x"}, call)
+        return await cassette.replay_json("text-generation", "m", {"inputs": "x"}), threading.current_thread()
+
+    result, loop_thread = asyncio.run(_roundtrip())
+    assert result == {"ok": 1}
+    assert len(threads) == 2 and loop_thread not in threads
@@ -0,0 +1,189 @@
+import asyncio
+import base64
+import importlib
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+
+def _setup(monkeypatch, fake_generate_diagram):
+    fd, path = tempfile.mkstemp(suffix=".db")
+    os.close(fd)
+    monkeypatch.setenv("DATABASE_PATH", path)
+
+    from app.services import diagram as dg
+
+    monkeypatch.setattr(dg, "generate_diagram", fake_generate_diagram)
+
+    from app import config as cfg
+    from app.storage import db as sdb
+
+    importlib.reload(cfg)
+    importlib.reload(sdb)
+    from app.services import jobs
+
+    importlib.reload(jobs)
+    return sdb, jobs
+
+
+def test_worker_completes_job_and_updates_message(monkeypatch):
+    async def fake_generate_diagram(prompt: str, code: str | None) -> bytes:
+        return b"img"
+
+    sdb, jobs = _setup(monkeypatch, fake_generate_diagram)
+    mid = sdb.save_message("s", "draw it", "print(1)", None, {"token_count": 1})
+    job_id = sdb.enqueue_diagram_job(mid, "draw it", "print(1)")
+    assert sdb.get_diagram_job(job_id)["status"] == "queued"
+
+    worker = jobs.DiagramWorkerPool(workers=1)
+    assert worker.run_once() is True
+    assert worker.run_once() is False
+
+    job = sdb.get_diagram_job(job_id)
+    assert job["status"] == "done"
+    assert job["attempts"] == 1
+    assert base64.b64decode(job["diagram_base64"]) == b"img"
+    assert sdb.fetch_history("s")[0]["diagram_url"] == job["diagram_url"]
+
+
+def test_failed_jobs_are_retried_then_marked_failed(monkeypatch):
+    async def failing_generate_diagram(prompt: str, code: str | None) -> bytes:
+        raise RuntimeError("sd unavailable")
+
+    sdb, jobs = _setup(monkeypatch, failing_generate_diagram)
+    mid = sdb.save_message("s", "draw it", None, None, None)
+    job_id = sdb.enqueue_diagram_job(mid, "draw it", None)
+
+    worker = jobs.DiagramWorkerPool(workers=1, max_attempts=2)
+    worker.run_once()
+    assert sdb.get_diagram_job(job_id)["status"] == "queued"
+    worker.run_once()
+    job = sdb.get_diagram_job(job_id)
+    assert job["status"] == "failed"
+    assert job["error"] == "sd unavailable"
+
+
+def test_stale_running_jobs_are_requeued(monkeypatch):
+    async def fake_generate_diagram(prompt: str, code: str | None) -> bytes:
+        return b"img"
+
+    sdb, _ = _setup(monkeypatch, fake_generate_diagram)
+    job_id = sdb.enqueue_diagram_job(1, "p", None)
+    assert sdb.claim_diagram_job()["id"] == job_id
+    assert sdb.requeue_running_jobs() == 1
+    assert sdb.get_diagram_job(job_id)["status"] == "queued"
+
+    # a fresh (or renewed) lease belongs to a worker that may still be running it
+    assert sdb.claim_diagram_job()["id"] == job_id
+    assert sdb.requeue_running_jobs(60) == 0
+    with sdb.session_scope() as s:
+        s.get(sdb.DiagramJob, job_id).updated_at = datetime.utcnow() - timedelta(seconds=120)
+    sdb.heartbeat_diagram_jobs([job_id])
+    assert sdb.requeue_running_jobs(60) == 0
+    with sdb.session_scope() as s:
+        s.get(sdb.DiagramJob, job_id).updated_at = datetime.utcnow() - timedelta(seconds=120)
+    assert sdb.requeue_running_jobs(60) == 1
+    assert sdb.get_diagram_job(job_id)["status"] == "queued"
+
+
+def test_jobs_running_in_another_pool_keep_their_lease(monkeypatch):
+    async def slow_generate_diagram(prompt: str, code: str | None) -> bytes:
+        await asyncio.sleep(1.0)
+        return b"img"
+
+    sdb, jobs = _setup(monkeypatch, slow_generate_diagram)
+    mid = sdb.save_message("s", "draw it", None, None, None)
+    job_id = sdb.enqueue_diagram_job(mid, "draw it", None)
+
+    first = jobs.DiagramWorkerPool(workers=1, poll_interval=0.05, lease_seconds=0.3)
+    first.start()
+    deadline = time.time() + 5
+    while sdb.get_diagram_job(job_id)["status"] != "running" and time.time() < deadline:
+        time.sleep(0.01)
+    time.sleep(0.5)  # longer than the lease: only the heartbeat keeps the job claimed
+    # a second process starting up must not requeue a job that is still being rendered
+    second = jobs.DiagramWorkerPool(workers=1, poll_interval=0.05, lease_seconds=0.3)
+    second.start()
+    while sdb.get_diagram_job(job_id)["status"] != "done" and time.time() < deadline:
+        time.sleep(0.05)
+    second.stop()
+    first.stop()
+    job = sdb.get_diagram_job(job_id)
+    assert job["status"] == "done" and job["attempts"] == 1
+
+
+def test_api_async_diagram_returns_job_id(monkeypatch):
+    async def fake_generate_code(prompt: str) -> str:
+        return "print('ok')\n"
+
+    async def fake_generate_diagram(prompt: str, code: str | None) -> bytes:
+        return b"img"
+
+    from app.services import codegen as cg
+
+    monkeypatch.setattr(cg, "generate_code", fake_generate_code)
+    _setup(monkeypatch, fake_generate_diagram)
+    from app.api import server as api_server
+
+    importlib.reload(api_server)
+    client = api_server.create_app().test_client()
+
+    data = client.post("/api/generate", json={"prompt": "hi", "async_diagram": True}).get_json()
+    assert data["generated_code"] == "print('ok')\n"
+    assert data["diagram_base64"] is None
+
+    deadline = time.time() + 5
+    while True:
+        job = client.get(f"/api/jobs/{data['diagram_job_id']}").get_json()
+        if job["status"] == "done" or time.time() > deadline:
+            break
+        time.sleep(0.05)
+    assert job["status"] == "done"
+    assert client.get("/api/jobs/999").status_code == 404
+
+
+def test_worker_survives_a_failed_claim(monkeypatch):
+    async def fake_generate_diagram(prompt: str, code: str | None) -> bytes:
+        return b"img"
+
+    sdb, jobs = _setup(monkeypatch, fake_generate_diagram)
+    calls = []
+
+    def flaky_claim():
+        calls.append(1)
+        if len(calls) == 1:
+            raise sqlite3.OperationalError("database is locked")
+        return sdb.claim_diagram_job()
+
+    monkeypatch.setattr(jobs, "claim_diagram_job", flaky_claim)
+    mid = sdb.save_message("s", "draw it", None, None, None)
+    job_id = sdb.enqueue_diagram_job(mid, "draw it", None)
+
+    worker = jobs.DiagramWorkerPool(workers=1, poll_interval=0.05)
+    worker.start()
+    deadline = time.time() + 5
+    while sdb.get_diagram_job(job_id)["status"] != "done" and time.time() < deadline:
+        time.sleep(0.05)
+    alive = [t.is_alive() for t in worker._threads]
+    worker.stop()
+    assert sdb.get_diagram_job(job_id)["status"] == "done"
+    assert len(calls) >= 2 and alive == [True]
+
+
+def test_start_replaces_dead_workers(monkeypatch):
+    async def fake_generate_diagram(prompt: str, code: str | None) -> bytes:
+        return b"img"
+
+    _, jobs = _setup(monkeypatch, fake_generate_diagram)
+    worker = jobs.DiagramWorkerPool(workers=2, poll_interval=0.05)
+    dead = threading.Thread(target=lambda: None)
+    dead.start()
+    dead.join()
+    worker._threads = [dead]
+    worker.start()
+    alive = [t.is_alive() for t in worker._threads]
+    worker.stop()
+    assert len(alive) == 2 and all(alive)
@@ -0,0 +1,110 @@
+import asyncio
+import importlib
+import os
+import tempfile
+
+import httpx
+import pytest
+
+from eval.hf_stub import Latency, StubConfig, create_stub_app
+from eval.loadtest import parse_mix, percentile, run_load
+
+
+def _stub_client(stub) -> httpx.AsyncClient:
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=stub), base_url="http://stub")
+
+
+def test_stub_speaks_the_inference_api():
+    from app.services.hf_clients import HFInferenceClient
+
+    stub = create_stub_app(StubConfig(text_latency=Latency(1.0, "exponential"), seed=1))
+
+    async def _calls():
+        async with _stub_client(stub) as http:
+            client = HFInferenceClient(client=http, base_url="http://stub/models")
+            text = await client.text_generation("m", {"inputs": "x"})
+            pieces = [p async for p in client.text_generation_stream("m", {"inputs": "x"})]
+            image = await client.text_to_image("sd", "a diagram")
+            return text, pieces, image
+
+    text, pieces, image = asyncio.run(_calls())
+    assert text[0]["generated_text"] == "".join(pieces)
+    assert image.startswith(b"\x89PNG")
+    assert stub.stats == {"requests": 3, "failures": 0}
+
+
+def test_load_run_against_asgi_app_and_stub(monkeypatch):
+    fd, path = tempfile.mkstemp(suffix=".db")
+    os.close(fd)
+    monkeypatch.setenv("DATABASE_PATH", path)
+    monkeypatch.setenv("RESPONSE_CACHE_ENABLED", "0")
+    from app import config as cfg
+    from app.storage import db as sdb
+
+    importlib.reload(cfg)
+    importlib.reload(sdb)
+    from app.services import codegen, diagram, hf_clients
+    from app.api import server as api_server
+    from app.api import asgi as api_asgi
+
+    for module in (codegen, diagram, api_server, api_asgi):
+        importlib.reload(module)
+
+    stub = create_stub_app(StubConfig(failure_rate=0.3, seed=7))
+    clients = {}
+
+    def _pooled():
+        loop = asyncio.get_running_loop()
+        if loop not in clients:
+            clients[loop] = _stub_client(stub)
+        return clients[loop]
+
+    monkeypatch.setattr(hf_clients, "get_http_client", _pooled)
+    app = api_asgi.create_asgi_app()
+    records = [{"prompt": f"write function {i}"} for i in range(5)]
+
+    report = asyncio.run(
+        run_load(
+            "http://api",
+            records,
+            parse_mix("generate=1,stream=1,history=1"),
+            concurrency=4,
+            total=30,
+            seed=3,
+            transport=httpx.ASGITransport(app=app),
+        )
+    )
+    total = report["total"]
+    assert total["requests"] == 30
+    assert set(report["endpoints"]) == {"generate", "stream", "history"}
+    assert report["endpoints"]["history"]["errors"] == 0
+    # stub failures surface as API errors; the history endpoint never calls the stub
+    assert 0 < total["errors"] < 30 and total["error_rate"] == pytest.approx(total["errors"] / 30, abs=1e-4)
+    assert total["p50_ms"] <= total["p95_ms"] <= total["p99_ms"] <= total["max_ms"]
+
+
+def test_open_loop_drops_beyond_max_in_flight():
+    async def slow(scope, receive, send):
+        await asyncio.sleep(0.05)
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"{}"})
+
+    report = asyncio.run(
+        run_load(
+            "http://api",
+            [{"prompt": "x"}],
+            {"health": 1.0},
+            rate=400,
+            total=40,
+            max_in_flight=2,
+            poisson=False,
+            transport=httpx.ASGITransport(app=slow),
+        )
+    )
+    assert report["dropped"] > 0
+    assert report["total"]["requests"] + report["dropped"] == 40
+
+
+def test_percentile_nearest_rank():
+    values = list(range(1, 101))
+    assert percentile(values, 0.5) == 50 and percentile(values, 0.99) == 99 and percentile([], 0.5) is None
@@ -0,0 +1,188 @@
+import asyncio
+import re
+import threading
+
+import pytest
+
+from app.services import codegen, local_inference
+from app.services.local_inference import BatchScheduler
+
+
+class FakeRunner:
+    def __init__(self, fail_on: str | None = None) -> None:
+        self.batches = []
+        self.fail_on = fail_on
+        self.gate = threading.Event()
+        self.gate.set()
+
+    def generate(self, prompts, **parameters):
+        self.gate.wait(5)
+        self.batches.append((list(prompts), parameters))
+        if self.fail_on in prompts:
+            raise RuntimeError("out of memory")
+        return [f"out:{p}" for p in prompts]
+
+
+def test_concurrent_requests_share_batches():
+    runner = FakeRunner()
+    scheduler = BatchScheduler(runner, max_batch_size=4, max_wait=0.2)
+    runner.gate.clear()  # hold the first batch so the rest queue up behind it
+    first = scheduler.submit("p0", {"max_new_tokens": 8})
+    futures = [scheduler.submit(f"p{i}", {"max_new_tokens": 8}) for i in range(1, 10)]
+    runner.gate.set()
+    assert [f.result(5) for f in [first, *futures]] == [f"out:p{i}" for i in range(10)]
+    scheduler.close()
+
+    sizes = [len(prompts) for prompts, _ in runner.batches]
+    assert sum(sizes) == 10 and max(sizes) == 4 and len(sizes) <= 4
+    assert all(params == {"max_new_tokens": 8} for _, params in runner.batches)
+    assert scheduler.stats == {"requests": 10, "batches": len(sizes)}
+
+
+def test_parameters_are_not_mixed_and_errors_stay_in_their_batch():
+    runner = FakeRunner(fail_on="bad")
+    scheduler = BatchScheduler(runner, max_batch_size=8, max_wait=0.05)
+    runner.gate.clear()
+    blocker = scheduler.submit("warm", {"temperature": 0.2})
+    cold = [scheduler.submit(p, {"temperature": 0.0}) for p in ("a", "bad")]
+    warm = scheduler.submit("b", {"temperature": 0.2})
+    runner.gate.set()
+
+    assert blocker.result(5) == "out:warm" and warm.result(5) == "out:b"
+    for future in cold:
+        with pytest.raises(RuntimeError, match="out of memory"):
+            future.result(5)
+    # the scheduler keeps serving after a failed batch
+    assert scheduler.submit("c", {"temperature": 0.0}).result(5) == "out:c"
+    scheduler.close()
+    for prompts, params in runner.batches:
+        assert len({p in ("a", "bad", "c") for p in prompts}) == 1, (prompts, params)
+
+
+def test_generate_code_uses_local_backend(monkeypatch):
+    runner = FakeRunner()
+    scheduler = BatchScheduler(runner, max_batch_size=8, max_wait=0.1)
+    monkeypatch.setattr(local_inference, "_scheduler", scheduler)
+    monkeypatch.setattr(codegen.settings, "codegen_backend", "local")
+    monkeypatch.setattr(codegen.settings, "response_cache_enabled", False)
+
+    async def _three():
+        return await asyncio.gather(*(codegen.generate_code(f"task {i}") for i in range(3)))
+
+    results = asyncio.run(_three())
+    scheduler.close()
+    assert all(r.startswith("out:") and f"User request:\ntask {i}\n" in r for i, r in enumerate(results))
+    assert len(runner.batches) == 1 and len(runner.batches[0][0]) == 3
+    assert runner.batches[0][1]["max_new_tokens"] == codegen.GENERATION_PARAMETERS["max_new_tokens"]
+    assert codegen.codegen_model_id().startswith("local:")
+
+
+def test_prefix_cache_is_bounded_lru():
+    computed = []
+    cache = local_inference.PrefixCache(max_entries=2)
+
+    def prefill(prefix):
+        computed.append(prefix)
+        return f"kv:{prefix}"
+
+    assert cache.get("a", prefill) == "kv:a"
+    cache.get("b", prefill)
+    assert cache.get("a", prefill) == "kv:a"  # hit, and now the most recent
+    cache.get("c", prefill)  # evicts b
+    cache.get("b", prefill)
+    assert computed == ["a", "b", "c", "b"] and len(cache) == 2
+    assert cache.stats == {"hits": 1, "misses": 4, "evictions": 2}
+
+
+def test_codegen_prompts_share_a_registered_prefix():
+    prefixes = local_inference._PROMPT_PREFIXES
+    plain = [codegen.build_codegen_prompt(f"task {i}") for i in range(3)]
+    with_examples = codegen.build_codegen_prompt("task", ["def f():\n    pass"])
+    request_prefix = f"{codegen.SYSTEM_PROMPT}\n\n{codegen.REQUEST_HEADER}"
+
+    assert local_inference.shared_prefix(plain, prefixes) == request_prefix
+    assert local_inference.shared_prefix([with_examples], prefixes).endswith(codegen.EXAMPLES_HEADER)
+    # a mixed batch still shares the system prompt
+    assert local_inference.shared_prefix([*plain, with_examples], prefixes) == f"{codegen.SYSTEM_PROMPT}\n\n"
+    # a prompt must continue past the prefix for there to be anything left to run
+    assert local_inference.shared_prefix(["other", *plain], prefixes) is None
+    assert local_inference.shared_prefix([request_prefix], prefixes) == f"{codegen.SYSTEM_PROMPT}\n\n"
+
+
+def test_runner_is_loaded_on_the_worker_thread():
+    loaded_on = []
+
+    def load():
+        loaded_on.append(threading.current_thread().name)
+        return FakeRunner()
+
+    scheduler = BatchScheduler(load, max_batch_size=2, max_wait=0.01)
+    assert loaded_on == []  # nothing is loaded by the caller
+    assert scheduler.submit("p").result(5) == "out:p"
+    scheduler.close()
+    assert loaded_on == ["local-inference"]
+
+
+def test_failed_load_fails_requests_without_retrying():
+    attempts = []
+
+    def load():
+        attempts.append(1)
+        raise OSError("model not found")
+
+    scheduler = BatchScheduler(load, max_batch_size=2, max_wait=0.01)
+    for prompt in ("a", "b"):
+        with pytest.raises(RuntimeError, match="model not found"):
+            scheduler.submit(prompt).result(5)
+    scheduler.close()
+    assert attempts == [1]
+
+
+class BPELikeTokenizer:
+    """Pre-tokenizes like GPT-2/starcoder: trailing "\\n\\n" is one token, but "\\n", "\\n" before text."""
+
+    PATTERN = re.compile(r" ?[A-Za-z]+| ?[0-9]+| ?[^\sA-Za-z0-9]+|\s+(?!\S)|\s+")
+
+    def __init__(self) -> None:
+        self.vocab = {}
+
+    def __call__(self, text):
+        if isinstance(text, list):
+            return {"input_ids": [self(t)["input_ids"] for t in text]}
+        return {"input_ids": [self.vocab.setdefault(p, len(self.vocab) + 1) for p in self.PATTERN.findall(text)]}
+
+
+def test_prefix_layout_feeds_the_same_tokens_as_the_plain_path():
+    tokenizer = BPELikeTokenizer()
+    # a mixed batch shares only "<system prompt>\n\n"
+    prompts = [codegen.build_codegen_prompt("add two numbers"), codegen.build_codegen_prompt("sort", ["x = 1"])]
+    prefix = local_inference.shared_prefix(prompts, local_inference._PROMPT_PREFIXES)
+    assert prefix.endswith("\n\n")
+    full = tokenizer(prompts)["input_ids"]
+
+    # tokenized on its own, the prefix ends in tokens the full prompts do not contain
+    alone = tokenizer(prefix)["input_ids"]
+    assert full[0][:len(alone)] != alone
+    stable = alone[:local_inference.common_prefix_length(alone, full[0])]
+
+    rows, masks = local_inference.prefix_layout(stable, full, pad_token_id=0)
+    assert [[t for t, m in zip(row, mask) if m] for row, mask in zip(rows, masks)] == full
+    assert all(row[:len(stable)] == stable for row in rows) and len({len(r) for r in rows}) == 1
+    # the unshared prefix tokens would change the prompt, so they are refused
+    assert local_inference.prefix_layout(alone, full, pad_token_id=0) is None
+
+
+def test_cancelled_requests_do_not_stall_the_batch():
+    runner = FakeRunner()
+    scheduler = BatchScheduler(runner, max_batch_size=4, max_wait=0.2)
+    runner.gate.clear()
+    first = scheduler.submit("p0")
+    queued = [scheduler.submit(f"p{i}") for i in range(1, 4)]
+    assert queued[1].cancel()  # the caller went away while waiting
+    runner.gate.set()
+
+    assert first.result(5) == "out:p0"
+    assert [queued[0].result(5), queued[2].result(5)] == ["out:p1", "out:p3"]
+    assert scheduler.submit("p4").result(5) == "out:p4"
+    scheduler.close()
+    assert all("p2" not in prompts for prompts, _ in runner.batches)
@@ -0,0 +1,99 @@
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("transformers")
+pytest.importorskip("peft")
+
+from peft import LoraConfig, get_peft_model  # noqa: E402
+from tokenizers import Tokenizer, models, pre_tokenizers  # noqa: E402
+from transformers import LlamaConfig, LlamaForCausalLM, PreTrainedTokenizerFast  # noqa: E402
+
+from app.services import local_inference  # noqa: E402
+from inference.lora_infer import generate, load_merged, load_model, merge_and_export  # noqa: E402
+
+WORDS = ["<unk>", "<eos>", "def", "add", "a", "b", "return", "+", "(", ")", ":", ",", "print", "x", "y", "z"]
+PROMPT = "def add ( a , b ) :"
+
+
+@pytest.fixture(scope="module")
+def tiny_lora(tmp_path_factory):
+    """A randomly initialised two-layer Llama and a LoRA adapter with non-zero weights."""
+    root = tmp_path_factory.mktemp("tiny")
+    base_dir, lora_dir = str(root / "base"), str(root / "lora")
+    backend = Tokenizer(models.WordLevel({w: i for i, w in enumerate(WORDS)}, unk_token="<unk>"))
+    backend.pre_tokenizer = pre_tokenizers.Whitespace()
+    tokenizer = PreTrainedTokenizerFast(
+        tokenizer_object=backend,
+        unk_token="<unk>",
+        eos_token="<eos>",
+        pad_token="<eos>",
+        model_input_names=["input_ids", "attention_mask"],
+    )
+
+    torch.manual_seed(0)
+    config = LlamaConfig(
+        vocab_size=len(WORDS),
+        hidden_size=32,
+        intermediate_size=64,
+        num_hidden_layers=2,
+        num_attention_heads=4,
+        max_position_embeddings=64,
+        eos_token_id=1,
+        pad_token_id=1,
+    )
+    LlamaForCausalLM(config).save_pretrained(base_dir)
+    tokenizer.save_pretrained(base_dir)
+
+    # init_lora_weights=False: B is random too, so the adapter really changes the outputs
+    lora = LoraConfig(r=4, lora_alpha=8, target_modules=["q_proj", "v_proj"], init_lora_weights=False)
+    get_peft_model(LlamaForCausalLM.from_pretrained(base_dir), lora).save_pretrained(lora_dir)
+    tokenizer.save_pretrained(lora_dir)
+    return base_dir, lora_dir, str(root / "merged")
+
+
+def _logits(tokenizer, model):
+    with torch.no_grad():
+        return model(**tokenizer(PROMPT, return_tensors="pt")).logits
+
+
+def test_merged_export_matches_the_peft_model(tiny_lora):
+    base_dir, lora_dir, merged_dir = tiny_lora
+    tokenizer, peft_model = load_model(base_dir, lora_dir)
+    merge_and_export(base_dir, lora_dir, merged_dir)
+    merged_tokenizer, merged = load_merged(merged_dir)
+
+    assert not hasattr(merged, "peft_config")
+    assert torch.allclose(_logits(tokenizer, peft_model), _logits(merged_tokenizer, merged), atol=1e-5)
+    greedy = generate(PROMPT, tokenizer, peft_model, max_new_tokens=6, temperature=0)
+    assert generate(PROMPT, merged_tokenizer, merged, max_new_tokens=6, temperature=0) == greedy
+
+
+def test_int8_model_is_quantized_and_generates(tiny_lora):
+    base_dir, lora_dir, merged_dir = tiny_lora
+    merge_and_export(base_dir, lora_dir, merged_dir)
+    tokenizer, model = load_merged(merged_dir, "int8")
+
+    quantized = [m for m in model.modules() if isinstance(m, torch.ao.nn.quantized.dynamic.Linear)]
+    assert quantized and not any(type(m) is torch.nn.Linear for m in model.modules())
+    assert generate(PROMPT, tokenizer, model, max_new_tokens=4, temperature=0).startswith(PROMPT)
+    with pytest.raises(ValueError, match="int8"):
+        load_merged(merged_dir, "int4")
+
+
+def test_runner_merges_the_adapter_and_serves_int8(tiny_lora, monkeypatch):
+    base_dir, lora_dir, _ = tiny_lora
+    tokenizer, peft_model = load_model(base_dir, lora_dir)
+    expected = generate(PROMPT, tokenizer, peft_model, max_new_tokens=5, temperature=0)[len(PROMPT):]
+
+    runner = local_inference.TransformersRunner(base_dir, lora_dir, prefix_cache_entries=0)
+    assert runner.generate([PROMPT], max_new_tokens=5)[0].strip() == expected.strip()
+
+    monkeypatch.setattr(local_inference, "_PROMPT_PREFIXES", ["def add"])
+    cached = local_inference.TransformersRunner(base_dir, lora_dir)
+    prompts = [PROMPT, "def add ( x , y , z ) :"]
+    assert cached.generate(prompts, max_new_tokens=5) == runner.generate(prompts, max_new_tokens=5)
+    assert cached.prefix_cache.stats["misses"] == 1
+
+    int8 = local_inference.TransformersRunner(base_dir, lora_dir, "int8")
+    assert int8.device == "cpu"
+    assert len(int8.generate(prompts, max_new_tokens=3)) == 2
@@ -0,0 +1,59 @@
+import asyncio
+import threading
+
+import pytest
+
+from app.metrics.metrics import MetricsRegistry, with_timing
+
+
+def test_histogram_quantiles_and_prometheus_text():
+    registry = MetricsRegistry()
+    hist = registry.histogram("stage_seconds", "Stage duration", ("stage",), buckets=(0.1, 1.0, 10.0))
+    for value in [0.05] * 50 + [0.5] * 45 + [5.0] * 5:
+        hist.observe(value, stage="codegen")
+    assert hist.count(stage="codegen") == 100
+    assert hist.quantile(0.5, stage="codegen") == pytest.approx(0.1)
+    assert 0.1 < hist.quantile(0.95, stage="codegen") <= 1.0
+    assert 1.0 < hist.quantile(0.99, stage="codegen") <= 10.0
+
+    text = registry.render()
+    assert "# TYPE stage_seconds histogram" in text
+    assert 'stage_seconds_bucket{stage="codegen",le="1"} 95' in text
+    assert 'stage_seconds_bucket{stage="codegen",le="+Inf"} 100' in text
+    assert 'stage_seconds_count{stage="codegen"} 100' in text
+
+    (row,) = registry.snapshot()["stage_seconds"]
+    assert row["labels"] == {"stage": "codegen"} and row["count"] == 100
+    assert set(row) >= {"p50", "p95", "p99", "mean"}
+
+
+def test_counters_are_thread_safe_and_labels_checked():
+    registry = MetricsRegistry()
+    counter = registry.counter("hits_total", "Hits", ("route",))
+    assert registry.counter("hits_total", "Hits", ("route",)) is counter
+
+    def _work():
+        for _ in range(1000):
+            counter.inc(route="/a")
+
+    threads = [threading.Thread(target=_work) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert counter.value(route="/a") == 8000
+    with pytest.raises(ValueError):
+        counter.inc(path="/a")
+    with pytest.raises(ValueError):
+        registry.gauge("hits_total", "Hits", ("route",))
+
+
+def test_with_timing_supports_async_functions():
+    @with_timing
+    async def slow(x):
+        await asyncio.sleep(0.01)
+        return x * 2
+
+    result, ms = asyncio.run(slow(21))
+    assert result == 42 and ms >= 10
+    assert with_timing(lambda: "ok")()[0] == "ok"
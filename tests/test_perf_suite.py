@@ -0,0 +1,105 @@
+import importlib
+import json
+import os
+import tempfile
+
+from eval import perf_suite
+from eval.perf_suite import SuiteContext, compare, mann_whitney_greater, run_suite
+
+
+def _report(samples, reference=None):
+    report = {"environment": {"python": "3.11"}, "benchmarks": {}}
+    for name, values in samples.items():
+        report["benchmarks"][name] = {"samples": values, "median": sorted(values)[len(values) // 2]}
+    if reference is not None:
+        report["reference"] = {"samples": reference, "median": sorted(reference)[len(reference) // 2]}
+    return report
+
+
+def test_mann_whitney_separates_shifted_samples():
+    base = [1.0 + i * 0.01 for i in range(15)]
+    assert mann_whitney_greater([v * 1.3 for v in base], base) < 0.001
+    assert mann_whitney_greater(base, base) > 0.4
+    assert mann_whitney_greater(base, [v * 1.3 for v in base]) > 0.99
+
+
+def test_compare_flags_only_significant_changes():
+    base = [1.0 + i * 0.01 for i in range(15)]
+    baseline = _report({"slow": base, "fast": base, "same": base})
+    current = _report({"slow": [v * 1.3 for v in base], "fast": [v * 0.7 for v in base], "same": base, "added": base})
+    result = compare(current, baseline)
+    assert result["regressions"] == ["slow"]
+    statuses = {name: row["status"] for name, row in result["benchmarks"].items()}
+    assert statuses == {"slow": "regressed", "fast": "improved", "same": "unchanged", "added": "new"}
+
+
+def test_machine_wide_slowdown_is_normalized_away():
+    base = [1.0 + i * 0.01 for i in range(15)]
+    reference = [0.5 + i * 0.005 for i in range(15)]
+    baseline = _report({"op": base}, reference)
+    # everything, including the reference workload, is 40% slower: the machine, not the code
+    current = _report({"op": [v * 1.4 for v in base]}, [v * 1.4 for v in reference])
+    assert compare(current, baseline)["regressions"] == []
+    assert compare(current, baseline, normalize=False)["regressions"] == ["op"]
+
+
+def test_suite_runs_db_benchmarks_and_gates(tmp_path, monkeypatch):
+    fd, path = tempfile.mkstemp(suffix=".db")
+    os.close(fd)
+    monkeypatch.setenv("DATABASE_PATH", path)
+    monkeypatch.setenv("WRITE_BEHIND", "0")
+    from app import config as cfg
+    from app.storage import db as sdb
+
+    importlib.reload(cfg)
+    importlib.reload(sdb)
+
+    report = run_suite(["save_message", "fetch_history"], repeats=3, min_time=0.001, context=SuiteContext(db_rows=60))
+    assert set(report["benchmarks"]) == {"save_message", "fetch_history"}
+    assert len(report["reference"]["samples"]) == 3
+    assert report["environment"]["python"] and report["config"]["db_rows"] == 60
+    assert len(sdb.fetch_history("bench-0", limit=100)) == 15
+
+    baseline = tmp_path / "baseline.json"
+    args = ["build_prompts", "--repeats", "3", "--min-time", "0.001", "--results-dir", str(tmp_path)]
+    assert perf_suite.main(args + ["--baseline", str(baseline), "--save-baseline"]) == 0
+    assert "build_prompts" in json.loads(baseline.read_text())["benchmarks"]
+    # three samples can never reach p < 0.01, so an unchanged tree always passes
+    assert perf_suite.main(args + ["--baseline", str(baseline)]) == 0
+    assert len(list(tmp_path.glob("perf-*.json"))) == 2
+
+
+def test_main_never_fills_an_exported_database(tmp_path, monkeypatch):
+    real = tmp_path / "real.db"
+    monkeypatch.setenv("DATABASE_PATH", str(real))
+    monkeypatch.setenv("WRITE_BEHIND", "0")
+    from app import config as cfg
+    from app.storage import db as sdb
+
+    importlib.reload(cfg)
+    importlib.reload(sdb)
+    args = ["save_message", "--repeats", "2", "--min-time", "0.001", "--db-rows", "10"]
+    assert perf_suite.main(args + ["--results-dir", str(tmp_path), "--baseline", str(tmp_path / "b.json")]) == 0
+
+    monkeypatch.setenv("DATABASE_PATH", str(real))
+    importlib.reload(cfg)
+    importlib.reload(sdb)
+    assert sdb.fetch_history("bench-0", limit=10) == []
+
+
+def test_orchestrate_setup_restores_globals(monkeypatch):
+    fd, path = tempfile.mkstemp(suffix=".db")
+    os.close(fd)
+    monkeypatch.setenv("DATABASE_PATH", path)
+    monkeypatch.setenv("WRITE_BEHIND", "0")
+    from app import config as cfg
+    from app.storage import db as sdb
+
+    importlib.reload(cfg)
+    importlib.reload(sdb)
+    from app.config import settings
+    from app.services import hf_clients
+
+    before = (hf_clients.get_http_client, settings.hf_api_url, settings.response_cache_enabled)
+    run_suite(["orchestrate"], repeats=1, min_time=0.001, context=SuiteContext(db_rows=10))
+    assert (hf_clients.get_http_client, settings.hf_api_url, settings.response_cache_enabled) == before
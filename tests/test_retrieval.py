@@ -0,0 +1,122 @@
+import asyncio
+import importlib
+import os
+import tempfile
+import threading
+
+import numpy as np
+
+
+def _fresh_db(monkeypatch):
+    fd, path = tempfile.mkstemp(suffix=".db")
+    os.close(fd)
+    monkeypatch.setenv("DATABASE_PATH", path)
+
+    from app import config as cfg
+
+    importlib.reload(cfg)
+    from app.storage import db as sdb
+
+    importlib.reload(sdb)
+    return sdb
+
+
+def test_tokenize_splits_identifiers():
+    from app.services.retrieval import tokenize
+
+    assert tokenize("parseHTTPResponse(json_body, 2)") == ["parse", "http", "response", "json", "body", "2"]
+
+
+def test_vector_index_grows_persists_and_searches_in_chunks(monkeypatch):
+    from app.services.retrieval import HashingEmbedder, VectorIndex
+
+    directory = tempfile.mkdtemp()
+    embedder = HashingEmbedder(dim=64)
+    texts = [f"def handler_{i}(request): return route_{i}" for i in range(50)]
+    texts[17] = "def binary_search(items, target): lo, hi = 0, len(items)"
+
+    index = VectorIndex(directory, dim=64, initial_capacity=4)
+    index.add(list(range(1, 51)), embedder.embed_many(texts))
+    assert index.capacity >= 50
+
+    reopened = VectorIndex(directory, dim=64)
+    assert reopened.count == 50 and reopened.last_id == 50
+    monkeypatch.setattr(VectorIndex, "SEARCH_CHUNK_ROWS", 7)
+    hits = reopened.search(embedder.embed("binary search over sorted items"), k=3)
+    assert hits[0][0] == 18
+    assert len(hits) == 3
+    assert np.isclose(np.linalg.norm(embedder.embed("x y")), 1.0)
+
+
+def test_retriever_indexes_incrementally(monkeypatch):
+    sdb = _fresh_db(monkeypatch)
+    from app.services.retrieval import Retriever
+
+    sdb.save_message("s", "fib", "def fibonacci(n):\n    a, b = 0, 1", None, None)
+    sdb.save_message("s", "sort", "def merge_sort(xs):\n    return sorted(xs)", None, None)
+
+    retriever = Retriever(tempfile.mkdtemp(), dim=128, min_score=0.1)
+    assert retriever.refresh() == 2
+    sdb.save_message("s", "parse", "def parse_config(path):\n    return json.load(open(path))", None, None)
+    assert retriever.refresh() == 1
+    assert retriever.refresh() == 0
+
+    snippets = retriever.retrieve("merge sort a list", k=1)
+    assert snippets == ["def merge_sort(xs):\n    return sorted(xs)"]
+
+
+def test_generate_code_injects_retrieved_examples(monkeypatch):
+    _fresh_db(monkeypatch)
+    from app.services import codegen as cg
+    from app.services.cache import ResponseCache
+    from app.services.hf_clients import HFInferenceClient
+
+    prompts = []
+
+    async def fake_text_generation(self, model_id, payload):
+        prompts.append(payload["inputs"])
+        return [{"generated_text": "print(1)"}]
+
+    monkeypatch.setattr(HFInferenceClient, "text_generation", fake_text_generation)
+    monkeypatch.setattr(cg, "response_cache", ResponseCache(persistent=False))
+    monkeypatch.setattr(cg.settings, "retrieval_enabled", True)
+
+    threads = []
+
+    class FakeRetriever:
+        def retrieve(self, text, k):
+            threads.append(threading.current_thread())
+            return ["def old(): pass"]
+
+    monkeypatch.setattr(cg, "get_retriever", FakeRetriever)
+
+    asyncio.run(cg.generate_code("do it"))
+    assert "Relevant examples" in prompts[0]
+    assert "def old(): pass" in prompts[0]
+    assert threads and threads[0] is not threading.main_thread()
+    assert cg.build_codegen_prompt("do it") == cg.build_codegen_prompt("do it", [])
+
+
+def test_search_refreshes_in_the_background(monkeypatch):
+    sdb = _fresh_db(monkeypatch)
+    from app.services import retrieval
+
+    sdb.save_message("s", "sort", "def merge_sort(xs):\n    return sorted(xs)", None, None)
+    release = threading.Event()
+    fetch_code_since = sdb.fetch_code_since
+
+    def slow_fetch(last_id, limit):
+        release.wait(5)
+        return fetch_code_since(last_id, limit)
+
+    monkeypatch.setattr(retrieval.db, "fetch_code_since", slow_fetch)
+    retriever = retrieval.Retriever(tempfile.mkdtemp(), dim=128, min_score=0.1)
+
+    # the first search does not wait for indexing; it sees the (still empty) index
+    assert retriever.retrieve("merge sort a list", k=1) == []
+    refresher = retriever.refresh_in_background()
+    assert refresher is not None and refresher.is_alive()
+    release.set()
+    refresher.join(5)
+    assert retriever.retrieve("merge sort a list", k=1) == ["def merge_sort(xs):\n    return sorted(xs)"]
+    assert retriever.refresh_in_background() is None
@@ -0,0 +1,60 @@
+import asyncio
+
+import pytest
+
+from app.services.singleflight import SingleFlight
+
+
+def test_concurrent_calls_share_one_upstream_call():
+    flight = SingleFlight()
+    calls = []
+
+    async def upstream():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "result"
+
+    async def _run():
+        results = await asyncio.gather(*(flight.do("k", upstream) for _ in range(5)))
+        # once finished, a new call goes upstream again
+        again = await flight.do("k", upstream)
+        return results, again
+
+    results, again = asyncio.run(_run())
+    assert results == ["result"] * 5
+    assert again == "result"
+    assert len(calls) == 2
+    assert flight.inflight() == 0
+
+
+def test_errors_propagate_to_all_waiters():
+    flight = SingleFlight()
+
+    async def failing():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("upstream down")
+
+    async def _run():
+        return await asyncio.gather(*(flight.do("k", failing) for _ in range(3)), return_exceptions=True)
+
+    results = asyncio.run(_run())
+    assert all(isinstance(r, RuntimeError) for r in results)
+
+
+def test_cancelled_caller_does_not_cancel_shared_call():
+    flight = SingleFlight()
+
+    async def upstream():
+        await asyncio.sleep(0.02)
+        return 42
+
+    async def _run():
+        first = asyncio.ensure_future(flight.do("k", upstream))
+        second = asyncio.ensure_future(flight.do("k", upstream))
+        await asyncio.sleep(0)
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return await second
+
+    assert asyncio.run(_run()) == 42
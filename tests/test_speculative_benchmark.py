@@ -0,0 +1,33 @@
+from eval.speculative_benchmark import replay_acceptance
+
+
+PROMPT = [1, 2]
+TARGET = [10, 11, 12, 13, 14, 15, 16]
+
+
+def _oracle(ids, n):
+    # proposes exactly the main model's continuation
+    pos = len(ids) - len(PROMPT)
+    return TARGET[pos:pos + n]
+
+
+def test_perfect_draft_accepts_everything():
+    stats = replay_acceptance(_oracle, PROMPT, TARGET, lookahead=3)
+    # each step accepts 3 draft tokens and adds the main model's own: 4 tokens per step
+    assert stats == {"tokens": 7, "proposed": 6, "accepted": 6, "steps": 2}
+
+
+def test_wrong_draft_falls_back_to_one_token_per_step():
+    stats = replay_acceptance(lambda ids, n: [0] * n, PROMPT, TARGET, lookahead=4)
+    assert stats["accepted"] == 0 and stats["steps"] == len(TARGET)
+
+
+def test_acceptance_stops_at_first_disagreement():
+    def diverge_second(ids, n):
+        proposal = _oracle(ids, n)
+        return proposal[:1] + [0] * (len(proposal) - 1)
+
+    stats = replay_acceptance(diverge_second, PROMPT, TARGET, lookahead=3)
+    # steps start at target positions 0, 2, 4, 6; the last has one token left to propose
+    assert stats == {"tokens": 7, "proposed": 10, "accepted": 4, "steps": 4}
+    assert replay_acceptance(_oracle, PROMPT, [], lookahead=3)["steps"] == 0
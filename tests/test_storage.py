@@ -1,6 +1,9 @@
 import importlib
 import os
 import tempfile
+import threading
+import time
+import base64
 
 
 def test_storage_save_and_fetch(monkeypatch):
@@ -33,3 +36,223 @@ def test_storage_save_and_fetch(monkeypatch):
     assert item["generated_code"] == code
 
 
+
+
+def test_diagrams_go_to_blob_store(monkeypatch):
+    fd, path = tempfile.mkstemp(suffix=".db")
+    os.close(fd)
+    monkeypatch.setenv("DATABASE_PATH", path)
+    monkeypatch.setenv("BLOB_DIR", tempfile.mkdtemp())
+
+    from app import config as cfg
+
+    importlib.reload(cfg)
+    from app.storage import db as sdb
+
+    importlib.reload(sdb)
+
+    png = b"\x89PNG\r\n\x1a\n" + b"0" * 32
+    diag = base64.b64encode(png).decode()
+    first = sdb.save_message("blobs", "a", "x", diag, None)
+    sdb.save_message("blobs", "b", "y", diag, None)
+
+    hist = sdb.fetch_history("blobs")
+    refs = {item["diagram_ref"] for item in hist}
+    assert len(refs) == 1  # identical diagrams are stored once
+    ref = refs.pop()
+    assert hist[0]["diagram_base64"] is None
+    assert hist[0]["diagram_url"] == f"/api/diagrams/{ref}"
+    assert sdb.load_diagram(ref) == png
+    assert len(os.listdir(os.path.join(cfg.settings.blob_dir, ref[:2]))) == 1
+
+    # legacy rows with inline base64 are moved out by the migration
+    with sdb.session_scope() as s:
+        s.get(sdb.ChatMessage, first).diagram_base64 = diag
+    assert sdb.migrate_legacy_diagrams() == 1
+    assert sdb.fetch_history("blobs")[0]["diagram_base64"] is None
+
+
+def test_fetch_history_keyset_pagination_and_fields(monkeypatch):
+    fd, path = tempfile.mkstemp(suffix=".db")
+    os.close(fd)
+    monkeypatch.setenv("DATABASE_PATH", path)
+
+    from app import config as cfg
+
+    importlib.reload(cfg)
+    from app.storage import db as sdb
+
+    importlib.reload(sdb)
+
+    ids = [sdb.save_message("paged", f"p{i}", f"code{i}", None, None) for i in range(7)]
+    sdb.save_message("other", "x", None, None, None)
+
+    newest = sdb.fetch_history("paged", limit=3)
+    assert [i["id"] for i in newest] == ids[4:]
+
+    older = sdb.fetch_history("paged", limit=3, before_id=newest[0]["id"])
+    assert [i["id"] for i in older] == ids[1:4]
+
+    newer = sdb.fetch_history("paged", limit=2, after_id=ids[1])
+    assert [i["id"] for i in newer] == ids[2:4]
+
+    slim = sdb.fetch_history("paged", limit=1, fields=["id", "user_prompt"])
+    assert slim == [{"id": ids[-1], "user_prompt": "p6"}]
+
+    try:
+        sdb.fetch_history("paged", fields=["nope"])
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("unknown field accepted")
+
+
+def test_write_behind_batches_and_wal(monkeypatch):
+    fd, path = tempfile.mkstemp(suffix=".db")
+    os.close(fd)
+    monkeypatch.setenv("DATABASE_PATH", path)
+
+    from app import config as cfg
+
+    importlib.reload(cfg)
+    from app.storage import db as sdb
+
+    importlib.reload(sdb)
+    from app.storage import writer as sw
+
+    importlib.reload(sw)
+
+    with sdb.engine.connect() as conn:
+        assert conn.exec_driver_sql("PRAGMA journal_mode").scalar() == "wal"
+
+    batches = []
+    real_save_messages = sdb.save_messages
+
+    def counting_save_messages(messages):
+        batches.append(len(messages))
+        return real_save_messages(messages)
+
+    monkeypatch.setattr(sdb, "save_messages", counting_save_messages)
+
+    queue = sw.WriteBehindQueue(max_pending=8, batch_size=10, max_delay=0.2)
+    futures = [
+        queue.submit(session_id="wb", user_prompt=f"p{i}", generated_code=None, diagram_base64=None, analysis=None)
+        for i in range(25)
+    ]
+    queue.flush()
+    ids = [f.result(timeout=5) for f in futures]
+    assert len(set(ids)) == 25
+    assert sum(batches) == 25
+    assert len(batches) < 25
+    assert [i["user_prompt"] for i in sdb.fetch_history("wb", limit=2)] == ["p23", "p24"]
+    queue.close()
+
+
+def test_write_behind_survives_cancelled_futures(monkeypatch):
+    fd, path = tempfile.mkstemp(suffix=".db")
+    os.close(fd)
+    monkeypatch.setenv("DATABASE_PATH", path)
+
+    from app import config as cfg
+
+    importlib.reload(cfg)
+    from app.storage import db as sdb
+
+    importlib.reload(sdb)
+    from app.storage import writer as sw
+
+    importlib.reload(sw)
+
+    gate = threading.Event()
+    real_save_messages = sdb.save_messages
+
+    def gated_save_messages(messages):
+        gate.wait(5)
+        return real_save_messages(messages)
+
+    monkeypatch.setattr(sdb, "save_messages", gated_save_messages)
+    queue = sw.WriteBehindQueue(batch_size=10, max_delay=0.05)
+
+    def _submit(i):
+        return queue.submit(
+            session_id="c", user_prompt=f"p{i}", generated_code=None, diagram_base64=None, analysis=None
+        )
+
+    first = _submit(0)  # the writer blocks on this batch
+    time.sleep(0.1)
+    queued = [_submit(i) for i in range(1, 4)]
+    assert queued[1].cancel()  # e.g. the client disconnected while waiting
+    gate.set()
+
+    flusher = threading.Thread(target=queue.flush, daemon=True)
+    flusher.start()
+    flusher.join(5)
+    assert not flusher.is_alive()
+    assert [f.result(5) for f in (first, queued[0], queued[2])]
+    # the writer thread is still serving, and the cancelled message was written anyway
+    assert _submit(4).result(5)
+    assert len(sdb.fetch_history("c", limit=10)) == 5
+    queue.close()
+
+
+def test_full_text_search(monkeypatch):
+    fd, path = tempfile.mkstemp(suffix=".db")
+    os.close(fd)
+    monkeypatch.setenv("DATABASE_PATH", path)
+
+    from app import config as cfg
+
+    importlib.reload(cfg)
+    from app.storage import db as sdb
+
+    importlib.reload(sdb)
+
+    sdb.save_message("s1", "fibonacci in python", "def fib_iter(n):\n    return n", None, None)
+    sdb.save_message("s2", "sort a list", "def quick_sort(xs):\n    return sorted(xs)", None, None)
+    mid = sdb.save_message("s2", "fibonacci again", "def fib_rec(n):\n    return n", None, None)
+
+    hits = sdb.search_messages("fibonacci")
+    assert {h["session_id"] for h in hits} == {"s1", "s2"}
+    assert "[fibonacci]" in hits[0]["prompt_snippet"]
+
+    assert [h["id"] for h in sdb.search_messages("fibonacci", session_id="s2")] == [mid]
+    assert len(sdb.search_messages("quick_sort")) == 1
+    assert len(sdb.search_messages("fib*")) == 2
+    assert len(sdb.search_messages("fibonacci", limit=1, offset=1)) == 1
+    assert sdb.search_messages('" OR NEAR(') == []
+
+    # updates and deletes keep the index in sync
+    with sdb.session_scope() as s:
+        s.get(sdb.ChatMessage, mid).user_prompt = "memoized recursion"
+    assert [h["id"] for h in sdb.search_messages("memoized")] == [mid]
+    with sdb.session_scope() as s:
+        s.delete(s.get(sdb.ChatMessage, mid))
+    assert sdb.search_messages("memoized") == []
+
+
+def test_search_index_backfills_existing_rows(monkeypatch):
+    fd, path = tempfile.mkstemp(suffix=".db")
+    os.close(fd)
+    monkeypatch.setenv("DATABASE_PATH", path)
+
+    import sqlite3
+
+    conn = sqlite3.connect(path)
+    conn.execute(
+        "CREATE TABLE chat_messages (id INTEGER PRIMARY KEY, session_id VARCHAR(64), user_prompt TEXT, "
+        "generated_code TEXT, diagram_base64 TEXT, analysis_json TEXT, created_at DATETIME)"
+    )
+    conn.execute(
+        "INSERT INTO chat_messages (session_id, user_prompt, generated_code, created_at) "
+        "VALUES ('old', 'legacy binary search', 'pass', '2024-01-01 00:00:00')"
+    )
+    conn.commit()
+    conn.close()
+
+    from app import config as cfg
+
+    importlib.reload(cfg)
+    from app.storage import db as sdb
+
+    importlib.reload(sdb)
+    assert [h["session_id"] for h in sdb.search_messages("binary")] == ["old"]
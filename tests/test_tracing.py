@@ -0,0 +1,66 @@
+import asyncio
+import json
+
+import pytest
+
+from app.metrics import tracing
+from app.metrics.tracing import span, trace_request
+
+
+@pytest.fixture()
+def trace_file(tmp_path, monkeypatch):
+    path = tmp_path / "traces.jsonl"
+    monkeypatch.setattr(tracing.settings, "trace_file", str(path))
+    monkeypatch.setattr(tracing.settings, "tracing_enabled", True)
+    return path
+
+
+def _records(path):
+    return [json.loads(line) for line in path.read_text().splitlines()]
+
+
+def test_spans_nest_across_awaits_and_export(trace_file):
+    async def child(name):
+        with span(name):
+            await asyncio.sleep(0.001)
+
+    async def pipeline():
+        with span("outer", stage="x"):
+            await asyncio.gather(child("a"), child("b"))
+        with pytest.raises(ValueError):
+            with span("failing"):
+                raise ValueError("boom")
+
+    with trace_request("test", request_id="req-1") as trace:
+        asyncio.run(pipeline())
+    assert trace.request_id == "req-1"
+
+    (record,) = _records(trace_file)
+    assert record["request_id"] == "req-1" and "profile" not in record
+    spans = {s["name"]: s for s in record["spans"]}
+    assert spans["a"]["parent_id"] == spans["outer"]["id"] == spans["b"]["parent_id"]
+    assert spans["outer"]["attrs"] == {"stage": "x"} and spans["outer"]["parent_id"] is None
+    assert spans["failing"]["error"] == "ValueError: boom"
+
+
+def test_disabled_tracing_is_a_no_op(trace_file, monkeypatch):
+    monkeypatch.setattr(tracing.settings, "tracing_enabled", False)
+    with trace_request("test") as trace:
+        assert trace is None
+        assert span("anything") is span("other")
+    assert not trace_file.exists() or trace_file.read_text() == ""
+
+
+def test_profile_is_attached(trace_file, monkeypatch):
+    monkeypatch.setattr(tracing.settings, "tracing_enabled", False)
+
+    def busy():
+        total = 0
+        for i in range(300_000):
+            total += i * i
+        return total
+
+    with trace_request("profiled", profile=True):
+        busy()
+    (record,) = _records(trace_file)
+    assert any("busy" in row["function"] for row in record["profile"])